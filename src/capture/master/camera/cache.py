@@ -0,0 +1,163 @@
+from collections import OrderedDict
+import threading
+
+from utility.setting import setting
+
+
+class CameraCacheManager:
+    """相機圖像快取管理
+
+    所有相機的 CameraLibrary 共用的快取，以壓縮後的位元組數計算上限
+    採用 segmented LRU:
+        新放入的圖像先進試用區，再次被存取才升級到保護區
+        保護區超過比例時，最久沒用的圖像降回試用區
+        超過上限時先從試用區最久沒用的開始淘汰
+    整段拖拉播放一次的圖像不會把反覆查看的圖像擠出去
+
+    Args:
+        budget: 位元組上限
+        protected_ratio: 保護區可佔上限的比例
+        on_evict: 淘汰時的回調，參數為 (key, camera_pixmap)
+
+    """
+
+    def __init__(self, budget, protected_ratio, on_evict=None):
+        self._budget = budget  # 位元組上限
+        self._protected_budget = int(budget * protected_ratio)  # 保護區上限
+        self._on_evict = on_evict  # 淘汰時的回調
+        self._probation = OrderedDict()  # 試用區 {key: (pixmap, 大小)}
+        self._protected = OrderedDict()  # 保護區 {key: (pixmap, 大小)}
+        self._probation_size = 0
+        self._protected_size = 0
+        self._lock = threading.Lock()
+
+        # 統計
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    @staticmethod
+    def make_key(camera_pixmap):
+        """產生圖像的快取 key (相機, shot, 快取類型, 影格)
+
+        Args:
+            camera_pixmap: CameraPixmap
+
+        """
+        return (
+            camera_pixmap.camera_id,
+            camera_pixmap.shot_id,
+            camera_pixmap.get_cache_type(),
+            camera_pixmap.frame,
+        )
+
+    def set_on_evict(self, on_evict):
+        """設定淘汰時的回調"""
+        self._on_evict = on_evict
+
+    def get(self, key):
+        """取得快取的圖像，沒有的話回傳 None
+
+        命中試用區的圖像會升級到保護區
+
+        Args:
+            key: make_key 產生的 key
+
+        """
+        with self._lock:
+            if key in self._protected:
+                self._protected.move_to_end(key)
+                self._hits += 1
+                return self._protected[key][0]
+
+            if key not in self._probation:
+                self._misses += 1
+                return None
+
+            self._hits += 1
+            pixmap, size = self._probation.pop(key)
+            self._probation_size -= size
+            self._protected[key] = (pixmap, size)
+            self._protected_size += size
+
+            # 保護區超過比例時降級最久沒用的
+            while (
+                self._protected_size > self._protected_budget and
+                len(self._protected) > 1
+            ):
+                old_key, old_item = self._protected.popitem(last=False)
+                self._protected_size -= old_item[1]
+                self._probation[old_key] = old_item
+                self._probation_size += old_item[1]
+
+            return pixmap
+
+    def contains(self, key):
+        """是否有快取，不影響淘汰順序與統計"""
+        with self._lock:
+            return key in self._probation or key in self._protected
+
+    def put(self, key, camera_pixmap):
+        """放入快取，超過上限時淘汰
+
+        Args:
+            key: make_key 產生的 key
+            camera_pixmap: 已經 save_cache 的 CameraPixmap
+
+        """
+        size = camera_pixmap.get_size()
+        evicted = []
+
+        with self._lock:
+            if key in self._probation or key in self._protected:
+                return
+
+            self._probation[key] = (camera_pixmap, size)
+            self._probation_size += size
+
+            while (
+                self._probation_size + self._protected_size > self._budget
+            ):
+                if self._probation:
+                    old_key, (old_pixmap, old_size) = (
+                        self._probation.popitem(last=False)
+                    )
+                    self._probation_size -= old_size
+                else:
+                    old_key, (old_pixmap, old_size) = (
+                        self._protected.popitem(last=False)
+                    )
+                    self._protected_size -= old_size
+                self._evictions += 1
+                evicted.append((old_key, old_pixmap))
+
+        # 回調在鎖外執行，避免回調裡再存取快取
+        if self._on_evict is not None:
+            for old_key, old_pixmap in evicted:
+                self._on_evict(old_key, old_pixmap)
+
+    def get_size(self):
+        """取得目前快取的位元組數"""
+        with self._lock:
+            return self._probation_size + self._protected_size
+
+    def get_stats(self):
+        """取得快取統計"""
+        with self._lock:
+            hits = self._hits
+            misses = self._misses
+            return {
+                'size': self._probation_size + self._protected_size,
+                'budget': self._budget,
+                'count': len(self._probation) + len(self._protected),
+                'hits': hits,
+                'misses': misses,
+                'evictions': self._evictions,
+                'hit_ratio': hits / (hits + misses) if hits + misses else 0.0,
+            }
+
+
+camera_cache = CameraCacheManager(
+    int(setting.camera_cache.budget_gb * 1024 ** 3),
+    setting.camera_cache.protected_ratio
+)
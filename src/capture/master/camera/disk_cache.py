@@ -0,0 +1,279 @@
+import threading
+import json
+import os
+
+from utility.logger import log
+from utility.setting import setting
+
+
+class CameraDiskCache:
+    """相機縮圖的硬碟快取
+
+    記憶體快取下的第二層，master 重開後打開同一個 shot 不用再向 slave 索取
+    資料存成只會附加寫入的分段檔案:
+        {編號}.pack: 依序串接的 JPEG
+        {編號}.idx: 每行一筆 JSON [key, 位置, 大小]，資料寫入後才寫索引
+    開啟時重播所有索引，無法解析或超出 pack 大小的索引 (寫入中斷) 直接略過
+    接續寫入前會截掉索引檔尾端不完整的一行
+    超過上限時整段刪除最舊的分段，最舊分段裡被讀取的資料會先搬到目前的分段
+    第一次使用時才讀取索引，第一次寫入時才建立快取資料夾
+    讀取失敗的資料直接捨棄，其他檔案錯誤 (例如沒有該磁碟、空間不足) 時停用硬碟快取
+    兩種情況都回傳 None，由呼叫端改向 slave 索取
+
+    Args:
+        folder: 快取資料夾
+        budget: 位元組上限
+        segment_size: 每個分段的大小
+
+    """
+
+    def __init__(self, folder, budget, segment_size):
+        self._folder = folder  # 快取資料夾
+        self._budget = budget  # 位元組上限
+        self._segment_size = segment_size  # 每個分段的大小
+        self._index = {}  # {key: (分段編號, 位置, 大小)}
+        self._segments = {}  # {分段編號: 大小}
+        self._readers = {}  # {分段編號: 讀取用的檔案}
+        self._writer = None  # 目前分段的 pack 檔案
+        self._index_writer = None  # 目前分段的 idx 檔案
+        self._current = 0  # 目前的分段編號
+        self._lock = threading.Lock()
+        self._enabled = True  # 是否啟用
+        self._is_loaded = False  # 是否已讀取索引
+
+        # 統計
+        self._hits = 0
+        self._misses = 0
+        self._evicted_segments = 0
+
+    @staticmethod
+    def make_key(camera_pixmap):
+        """產生圖像的 key (shot, 相機, 影格, 最長邊長度, 品質)
+
+        Args:
+            camera_pixmap: CameraPixmap
+
+        """
+        return (
+            f'{camera_pixmap.shot_id}/{camera_pixmap.camera_id}/'
+            f'{camera_pixmap.frame}/{camera_pixmap.scale_length}/'
+            f'{camera_pixmap.quality}'
+        )
+
+    def _get_path(self, segment, ext):
+        return os.path.join(self._folder, f'{segment:08d}.{ext}')
+
+    def _load(self):
+        """讀取所有分段的索引，資料夾還不存在的話為空的快取"""
+        self._is_loaded = True
+        if not os.path.isdir(self._folder):
+            return
+
+        segments = sorted(
+            int(name[:-5]) for name in os.listdir(self._folder)
+            if name.endswith('.pack') and name[:-5].isdigit()
+        )
+
+        for segment in segments:
+            pack_size = os.path.getsize(self._get_path(segment, 'pack'))
+            self._segments[segment] = pack_size
+
+            index_path = self._get_path(segment, 'idx')
+            if not os.path.isfile(index_path):
+                continue
+
+            with open(index_path, 'r') as f:
+                for line in f:
+                    try:
+                        key, offset, size = json.loads(line)
+                    except (ValueError, TypeError):
+                        continue
+                    if offset + size <= pack_size:
+                        self._index[key] = (segment, offset, size)
+
+        # 之後接續寫入最後一個分段
+        if segments:
+            self._current = segments[-1]
+
+    def _repair_index(self, segment):
+        """截掉索引檔尾端寫入中斷的不完整一行"""
+        index_path = self._get_path(segment, 'idx')
+        if not os.path.isfile(index_path):
+            return
+
+        with open(index_path, 'rb+') as f:
+            data = f.read()
+            if data and not data.endswith(b'\n'):
+                f.truncate(data.rfind(b'\n') + 1)
+
+    def _open_segment(self, segment):
+        """開啟要寫入的分段"""
+        if self._writer is not None:
+            self._writer.close()
+            self._index_writer.close()
+
+        self._repair_index(segment)
+        self._current = segment
+        self._writer = open(self._get_path(segment, 'pack'), 'ab')
+        self._index_writer = open(self._get_path(segment, 'idx'), 'a')
+        self._segments.setdefault(segment, self._writer.tell())
+
+    def _get_reader(self, segment):
+        if segment not in self._readers:
+            self._readers[segment] = open(self._get_path(segment, 'pack'), 'rb')
+        return self._readers[segment]
+
+    def _read(self, segment, offset, size):
+        reader = self._get_reader(segment)
+        reader.seek(offset)
+        return reader.read(size)
+
+    def _disable(self, error):
+        """檔案錯誤時停用硬碟快取，關閉所有檔案"""
+        log.warning(f'Camera disk cache disabled ({error}): {self._folder}')
+        self._enabled = False
+        self._index.clear()
+
+        files = [self._writer, self._index_writer, *self._readers.values()]
+        self._writer = None
+        self._index_writer = None
+        self._readers.clear()
+        for file in files:
+            if file is None:
+                continue
+            try:
+                file.close()
+            except OSError:
+                pass
+
+    def _write(self, key, data):
+        """寫入目前的分段，滿了就換下一個分段，超過上限時淘汰"""
+        # 第一次寫入時才建立資料夾
+        if self._writer is None:
+            os.makedirs(self._folder, exist_ok=True)
+            self._open_segment(self._current)
+
+        if self._segments[self._current] >= self._segment_size:
+            self._open_segment(self._current + 1)
+            self._evict()
+
+        offset = self._segments[self._current]
+        self._writer.write(data)
+        self._writer.flush()
+        self._index_writer.write(json.dumps([key, offset, len(data)]) + '\n')
+        self._index_writer.flush()
+
+        self._segments[self._current] += len(data)
+        self._index[key] = (self._current, offset, len(data))
+
+    def _evict(self):
+        """超過上限時刪除最舊的分段"""
+        while (
+            sum(self._segments.values()) > self._budget and
+            len(self._segments) > 1
+        ):
+            segment = min(self._segments)
+            del self._segments[segment]
+
+            reader = self._readers.pop(segment, None)
+            if reader is not None:
+                reader.close()
+
+            for ext in ('pack', 'idx'):
+                try:
+                    os.remove(self._get_path(segment, ext))
+                except OSError:
+                    pass
+
+            self._index = {
+                key: entry for key, entry in self._index.items()
+                if entry[0] != segment
+            }
+            self._evicted_segments += 1
+
+    def get(self, key):
+        """讀取資料，沒有的話回傳 None
+
+        Args:
+            key: make_key 產生的 key
+
+        """
+        if not self._enabled:
+            return None
+
+        with self._lock:
+            try:
+                if not self._is_loaded:
+                    self._load()
+            except OSError as error:
+                self._disable(error)
+                return None
+
+            entry = self._index.get(key)
+            if entry is None:
+                self._misses += 1
+                return None
+
+            # 讀取失敗或資料不完整就捨棄這筆資料
+            segment, offset, size = entry
+            try:
+                data = self._read(segment, offset, size)
+            except OSError:
+                data = b''
+            if len(data) != size:
+                del self._index[key]
+                self._misses += 1
+                return None
+
+            self._hits += 1
+
+            # 在最舊的分段就搬到目前的分段，避免常用的資料被整段淘汰
+            if segment == min(self._segments) and segment != self._current:
+                try:
+                    self._write(key, data)
+                except OSError as error:
+                    self._disable(error)
+
+            return data
+
+    def put(self, key, data):
+        """寫入資料，已經有的話略過
+
+        Args:
+            key: make_key 產生的 key
+            data: JPEG 資料
+
+        """
+        if not self._enabled:
+            return
+
+        with self._lock:
+            try:
+                if not self._is_loaded:
+                    self._load()
+                if key in self._index:
+                    return
+                self._write(key, data)
+            except OSError as error:
+                self._disable(error)
+
+    def get_stats(self):
+        """取得快取統計"""
+        with self._lock:
+            return {
+                'enabled': self._enabled,
+                'size': sum(self._segments.values()),
+                'budget': self._budget,
+                'count': len(self._index),
+                'segments': len(self._segments),
+                'hits': self._hits,
+                'misses': self._misses,
+                'evicted_segments': self._evicted_segments,
+            }
+
+
+camera_disk_cache = CameraDiskCache(
+    setting.camera_cache.disk_path,
+    int(setting.camera_cache.disk_budget_gb * 1024 ** 3),
+    setting.camera_cache.disk_segment_mb * 1024 ** 2
+)
@@ -1,5 +1,6 @@
-from queue import Queue
+from queue import Queue, Empty
 import threading
+import time
 import cv2
 import numpy as np
 import lz4framed
@@ -8,7 +9,7 @@ from pathlib import Path
 
 from utility.setting import setting
 from utility.message import message_manager
-from common.jpeg_coder import jpeg_coder
+from common.jpeg_coder import jpeg_coder, TJPF_RGB
 from utility.define import (
     UIEventType,
     MessageType,
@@ -21,21 +22,39 @@ from master.streaming import server
 from master.ui import ui
 from master.projects import project_manager
 
+from .cache import camera_cache
+from .disk_cache import camera_disk_cache
+from .prefetcher import camera_prefetcher
+
 
 class CameraLibrary(threading.Thread):
     """相機快取圖庫
 
     當 slave 傳圖片過來時，會在這邊轉成 UI 可用的 pixmap
-    如果不是相機預覽，會將圖片存到 self._cache 建立快取來加速播放
+    如果不是相機預覽，會將圖片存到共用的 camera_cache 建立快取來加速播放
     圖片因為有不同的參數，存放方式以參數產生獨立的 key 來識別
     同時也處理圖片請求，如果 self._cache 沒有的圖也會向 slave 索取
+    向 slave 索取中的圖像記錄在 self._in_flight，重複的請求併入同一個索取
+    逾時沒收到的索取會重送，超過次數後放棄
+    播放位置跳躍前的預先索取在送給 slave 前捨棄
 
     """
 
     def __init__(self):
         super().__init__()
         self._queue = Queue()  # 圖片佇列
-        self._cache = {}  # 快取
+        self._hot_pixmaps = []  # 播放位置附近保留解碼結果的圖像
+        self._in_flight = {}  # 索取中的圖像 {key: 索取資訊}
+        self._in_flight_lock = threading.Lock()
+        self._request_timeout = setting.camera_request.timeout  # 索取逾時秒數
+        self._request_retries = setting.camera_request.retries  # 重送次數上限
+
+        # 索取統計
+        self._merged = 0
+        self._retried = 0
+        self._lost = 0
+        self._stale = 0
+
         self._delay = DelayExecutor()
         self._encoder = CameraPixmapEncoder(self)
 
@@ -44,16 +63,39 @@ class CameraLibrary(threading.Thread):
 
     def run(self):
         while True:
-            task_type, payload = self._queue.get()
+            try:
+                task_type, payload = self._queue.get(
+                    timeout=self._request_timeout
+                )
+            except Empty:
+                self._retry_requests()
+                continue
+
+            self._retry_requests()
 
             if task_type is CameraLibraryTask.IMPORT:
                 self._import_pixmap(payload)
             elif task_type is CameraLibraryTask.REQUEST:
+                # 預先索取只需要確認快取裡有沒有，不影響淘汰順序
+                if payload.is_prefetch() and camera_cache.contains(
+                    camera_cache.make_key(payload)
+                ):
+                    camera_prefetcher.on_image_arrived(payload)
+                    continue
+
                 target_pixmap = self._get_pixmap_from_cache(payload)
 
                 # 看快取裡面是否已經有，有的話直接傳給 UI
                 if target_pixmap:
+                    camera_prefetcher.on_image_arrived(target_pixmap)
+                    self._keep_hot(target_pixmap)
                     self.send_ui(target_pixmap)
+                # 硬碟快取有的話，解碼後傳給 UI
+                elif self._load_from_disk(payload):
+                    pass
+                # 已經在索取中的話，併入該索取
+                elif self._merge_request(payload):
+                    pass
                 # 沒有的話，向 slave 發送請求
                 elif payload.is_delay():
                     self._delay.execute(lambda: self._slave_request(payload))
@@ -61,13 +103,150 @@ class CameraLibrary(threading.Thread):
                     self._slave_request(payload)
 
     def _get_pixmap_from_cache(self, camera_pixmap):
-        try:
-            pixmap = self._cache[camera_pixmap.shot_id][
-                camera_pixmap.get_cache_type()
-            ][camera_pixmap.frame]
-            return pixmap
-        except KeyError:
-            return None
+        return camera_cache.get(camera_cache.make_key(camera_pixmap))
+
+    @staticmethod
+    def _is_disk_cacheable(camera_pixmap):
+        """是否存到硬碟快取，只存向 slave 索取的縮圖"""
+        return (
+            camera_pixmap.is_shot()
+            and not camera_pixmap.is_original()
+            and not camera_pixmap.is_offline()
+        )
+
+    def _load_from_disk(self, camera_pixmap):
+        """從硬碟快取讀取圖像，交給 encoder 解碼，沒有的話回傳 False
+
+        Args:
+            camera_pixmap: 請求的 CameraPixmap
+
+        """
+        if not self._is_disk_cacheable(camera_pixmap):
+            return False
+
+        data = camera_disk_cache.get(camera_disk_cache.make_key(camera_pixmap))
+        if data is None:
+            return False
+
+        self._encoder.add_task(CameraPixmap(camera_pixmap.get_parms(), data))
+        return True
+
+    def _merge_request(self, camera_pixmap):
+        """相同圖像已經在索取中的話併入，不重複向 slave 索取
+
+        索取中的是預先索取而這次是 UI 的請求時，收到後改傳給 UI
+
+        Args:
+            camera_pixmap: 請求的 CameraPixmap
+
+        Returns:
+            是否已併入
+
+        """
+        key = camera_cache.make_key(camera_pixmap)
+        with self._in_flight_lock:
+            request = self._in_flight.get(key)
+            if request is None:
+                return False
+
+            if not camera_pixmap.is_prefetch():
+                request["show"] = True
+            self._merged += 1
+            return True
+
+    def _resolve_request(self, camera_pixmap):
+        """收到 slave 回傳的圖像，移除索取紀錄
+
+        Args:
+            camera_pixmap: 收到的 CameraPixmap
+
+        """
+        key = camera_cache.make_key(camera_pixmap)
+        with self._in_flight_lock:
+            request = self._in_flight.pop(key, None)
+
+        if request is None:
+            return
+
+        # 只有 slave 實際回傳的圖像計入預先索取的延遲
+        camera_prefetcher.on_image_replied(camera_pixmap)
+
+        # 有 UI 的請求併入的話，改成一般圖像傳給 UI
+        if request["show"]:
+            camera_pixmap.get_parms()["prefetch"] = False
+
+    def _retry_requests(self):
+        """重送逾時的索取，超過次數或已經過時的放棄"""
+        now = time.perf_counter()
+        retry_pixmaps = []
+        lost_pixmaps = []
+        with self._in_flight_lock:
+            for key, request in list(self._in_flight.items()):
+                if now - request["time"] < self._request_timeout:
+                    continue
+
+                if request["retries"] >= self._request_retries:
+                    del self._in_flight[key]
+                    self._lost += 1
+                    lost_pixmaps.append(request["pixmap"])
+                    continue
+
+                # 沒有 UI 等待的舊世代預先索取不再重送
+                if not request["show"] and camera_prefetcher.is_stale(
+                    request["pixmap"]
+                ):
+                    del self._in_flight[key]
+                    self._stale += 1
+                    continue
+
+                request["time"] = now
+                request["retries"] += 1
+                self._retried += 1
+                retry_pixmaps.append(request["pixmap"])
+
+        for camera_pixmap in retry_pixmaps:
+            self._send_request(camera_pixmap)
+
+        for camera_pixmap in lost_pixmaps:
+            camera_prefetcher.on_request_lost(camera_pixmap)
+
+    def get_request_stats(self):
+        """取得向 slave 索取的統計"""
+        with self._in_flight_lock:
+            return {
+                "in_flight": len(self._in_flight),
+                "merged": self._merged,
+                "retried": self._retried,
+                "lost": self._lost,
+                "stale": self._stale,
+            }
+
+    def _keep_hot(self, camera_pixmap):
+        """保留播放位置附近的解碼結果
+
+        快取只存壓縮過的資料，來回播放時播放位置前後 hot_frames 格內的圖像保留解碼結果
+        超出範圍的釋放解碼結果
+
+        Args:
+            camera_pixmap: 目前播放位置的 CameraPixmap
+
+        """
+        window = setting.camera_cache.hot_frames
+        hot_pixmaps = []
+        for pixmap in self._hot_pixmaps:
+            if pixmap is camera_pixmap:
+                continue
+            if (
+                pixmap.shot_id == camera_pixmap.shot_id and
+                abs(pixmap.frame - camera_pixmap.frame) <= window
+            ):
+                hot_pixmaps.append(pixmap)
+            else:
+                pixmap.drop_decoded()
+
+        camera_pixmap.keep_decoded()
+        hot_pixmaps.append(camera_pixmap)
+        self._hot_pixmaps = hot_pixmaps
 
     def _import_pixmap(self, camera_pixmap):
         """將 camera_pixmap 存進快取
@@ -76,31 +255,31 @@ class CameraLibrary(threading.Thread):
             camera_pixmap: CameraPixmap
 
         """
-        if camera_pixmap.shot_id not in self._cache:
-            self._cache[camera_pixmap.shot_id] = {
-                CameraCacheType.ORIGINAL: {},
-                CameraCacheType.THUMBNAIL: {},
-            }
+        camera_prefetcher.on_image_arrived(camera_pixmap)
 
-        target_cache = self._cache[camera_pixmap.shot_id][
-            camera_pixmap.get_cache_type()
-        ]
+        key = camera_cache.make_key(camera_pixmap)
+        if camera_cache.contains(key):
+            return
 
-        if camera_pixmap.frame in target_cache:
-            if target_cache[camera_pixmap.frame] is not None:
-                return
+        # 縮圖的 JPEG 也存到硬碟快取
+        jpeg = camera_pixmap.get_jpeg()
+        if jpeg is not None and self._is_disk_cacheable(camera_pixmap):
+            camera_disk_cache.put(
+                camera_disk_cache.make_key(camera_pixmap), jpeg
+            )
 
-        target_cache[camera_pixmap.frame] = camera_pixmap
         camera_pixmap.save_cache()
 
+        # 先更新進度，放入快取時淘汰的圖像才能正確回退進度
         shot = project_manager.get_shot(camera_pixmap.shot_id)
         shot.update_cache_progress(camera_pixmap)
+        camera_cache.put(key, camera_pixmap)
 
     def _slave_request(self, camera_pixmap):
         """向 slave 索取指定圖像
 
         先看 submit 的 shot 是否有該 frame 的圖像
-        沒有的話，藉由 camera_pixmap 的資料去向 slave 索取圖像
+        沒有的話，藉由 camera_pixmap 的資料去向該相機所在的 slave 索取圖像
 
         Args:
             camera_pixmap: CameraPixmap
@@ -110,8 +289,32 @@ class CameraLibrary(threading.Thread):
             self.on_image_received(camera_pixmap.get_parms(), True)
             return
 
-        message_manager.send_message(
-            MessageType.GET_SHOT_IMAGE, camera_pixmap.get_parms()
+        # 播放位置已經跳走的預先索取不送出
+        if camera_prefetcher.is_stale(camera_pixmap):
+            with self._in_flight_lock:
+                self._stale += 1
+            return
+
+        # 延遲期間可能已經有相同的索取
+        if self._merge_request(camera_pixmap):
+            return
+
+        key = camera_cache.make_key(camera_pixmap)
+        with self._in_flight_lock:
+            self._in_flight[key] = {
+                "pixmap": camera_pixmap,  # 請求的 CameraPixmap
+                "time": time.perf_counter(),  # 送出時間
+                "retries": 0,  # 已重送次數
+                "show": not camera_pixmap.is_prefetch(),  # 是否傳給 UI
+            }
+
+        self._send_request(camera_pixmap)
+
+    def _send_request(self, camera_pixmap):
+        message_manager.send_to(
+            camera_pixmap.camera_id,
+            MessageType.GET_SHOT_IMAGE,
+            camera_pixmap.get_parms(),
         )
 
     def add_task(self, task_type, payload):
@@ -120,11 +323,16 @@ class CameraLibrary(threading.Thread):
     def send_ui(self, camera_pixmap, save=False):
         """將 camera_pixmap 傳送給 UI
 
+        預先索取的圖像不傳給 UI，只存進快取
+
         Args:
             camera_pixmap: CameraPixmap
 
         """
-        if camera_pixmap.is_state():
+        if camera_pixmap.is_prefetch():
+            if save:
+                self.add_task(CameraLibraryTask.IMPORT, camera_pixmap)
+        elif camera_pixmap.is_state():
             ui.dispatch_event(
                 UIEventType.CAMERA_STATE, camera_pixmap.to_state()
             )
@@ -144,6 +352,8 @@ class CameraLibrary(threading.Thread):
         """收到圖像的回調"""
         if not direct:
             pixmap = CameraPixmap(*message.unpack())
+            if pixmap.is_shot():
+                self._resolve_request(pixmap)
         else:
             pixmap = CameraPixmap(message)
         self._encoder.add_task(pixmap)
@@ -157,6 +367,8 @@ class CameraLibrary(threading.Thread):
         scale_length,
         delay,
         offline_path=None,
+        prefetch=False,
+        generation=None,
     ):
         """UI 顯示圖像的請求
 
@@ -171,6 +383,8 @@ class CameraLibrary(threading.Thread):
             scale_length: 最長邊長度
             delay: 是否延遲
             offline_path: 離線路徑
+            prefetch: 是否為預先索取
+            generation: 預先索取時的播放位置世代，UI 的請求為 None
 
         """
         parms = {
@@ -181,6 +395,8 @@ class CameraLibrary(threading.Thread):
             "scale_length": scale_length,
             "delay": delay,
             "offline_path": offline_path,
+            "prefetch": prefetch,
+            "generation": generation,
         }
 
         camera_pixmap = CameraPixmap(parms)
@@ -212,6 +428,9 @@ class CameraPixmapEncoder(threading.Thread):
             # 傳給 UI
             if decode_result:
                 self._library.send_ui(pixmap, save=True)
+            # 無法取得的 shot 圖像不再等待
+            elif pixmap.is_shot():
+                camera_prefetcher.on_request_lost(pixmap)
 
 
 class CameraPixmap:
@@ -234,12 +453,19 @@ class CameraPixmap:
     _ow = setting.camera_resolution[0]
     _oh = setting.camera_resolution[1]
     _kernel = np.ones((5, 5), np.uint8)
+    _store_jpeg = setting.camera_cache.store_jpeg  # 快取存 JPEG 而不是 RGB
+    _scaling_factors = sorted(
+        jpeg_coder.scaling_factors, key=lambda f: f[0] / f[1]
+    )  # TurboJPEG 支援的縮放比例，由小到大
 
     def __init__(self, parms, buf=None, pixmap=None):
         self._buf = buf
         self._pixmap = pixmap  # QPixmap
         self._parms = parms  # 圖像資訊
         self._cache = None
+        self._jpeg = None  # 原始 JPEG
+        self._is_jpeg_cache = False  # 快取是否為 JPEG
+        self._decoded = None  # 保留的解碼結果
 
     def __getattr__(self, prop):
         if prop in self._parms:
@@ -253,6 +479,14 @@ class CameraPixmap:
     def is_delay(self):
         return "delay" in self._parms and self._parms["delay"]
 
+    def is_prefetch(self):
+        """是否是預先索取的圖像，收到後只存進快取"""
+        return self._parms.get("prefetch", False)
+
+    def get_generation(self):
+        """取得預先索取時的播放位置世代，UI 的請求為 None"""
+        return self._parms.get("generation")
+
     def is_live_view(self):
         """是否是即時預覽的圖像"""
         return "shot_id" not in self._parms
@@ -307,6 +541,10 @@ class CameraPixmap:
     def get_buf(self):
         return self._buf
 
+    def get_jpeg(self):
+        """取得原始 JPEG，存成快取後為 None"""
+        return self._jpeg
+
     def get(self):
         """取得 QPixmap"""
         return self._pixmap
@@ -329,9 +567,46 @@ class CameraPixmap:
             with open(image_path, "rb") as f:
                 self._buf = f.read()
 
-        # 解碼 JPEG 成 cv2 跟正確顏色
-        im = jpeg_coder.decode(self._buf)
-        im = cv2.cvtColor(im, cv2.COLOR_BGR2RGB)
+        self._jpeg = self._buf
+        self._buf = self._decode_jpeg(self._jpeg)
+        self._shape = self._buf.shape
+        self._type = self._buf.dtype
+        return True
+
+    def _get_scaling_factor(self, length):
+        """取得 TurboJPEG 縮放解碼的比例
+
+        縮放後最長邊仍不小於 scale_length 的最小比例，不需要縮放時回傳 None
+
+        Args:
+            length: 原圖最長邊
+
+        """
+        if self.is_original() or not self._parms.get("scale_length"):
+            return None
+
+        for num, denom in self._scaling_factors:
+            if num >= denom:
+                break
+            if length * num / denom >= self._parms["scale_length"]:
+                return (num, denom)
+        return None
+
+    def _decode_jpeg(self, jpeg):
+        """解碼 JPEG 成 RGB
+
+        有指定最長邊時先用 TurboJPEG 的縮放解碼，剩下的比例再用 cv2 縮放
+
+        Args:
+            jpeg: JPEG 資料
+
+        """
+        width, height, _, _ = jpeg_coder.decode_header(jpeg)
+        im = jpeg_coder.decode(
+            jpeg,
+            pixel_format=TJPF_RGB,
+            scaling_factor=self._get_scaling_factor(max(width, height)),
+        )
 
         # 縮放圖片
         if (
@@ -344,17 +619,49 @@ class CameraPixmap:
                 im, (int(im.shape[1] * ratio), int(im.shape[0] * ratio))
             )
 
-        self._buf = im
-        self._shape = self._buf.shape
-        self._type = self._buf.dtype
-        return True
+        return im
 
     def save_cache(self):
+        """將圖像存成快取
+
+        store_jpeg 開啟時直接保留原始 JPEG，否則將 RGB 以 LZ4 壓縮
+
+        """
         if self._buf is None:
             return
-        self._cache = lz4framed.compress(self._buf)
+        if self._store_jpeg and self._jpeg is not None:
+            self._cache = self._jpeg
+            self._is_jpeg_cache = True
+        else:
+            self._cache = lz4framed.compress(self._buf)
+        self._jpeg = None
         self._buf = None
 
+    def get_decoded(self):
+        """取得 RGB 陣列，有保留的解碼結果就直接使用，沒有快取時回傳 None"""
+        if self._decoded is not None:
+            return self._decoded
+
+        if not self.is_cache():
+            return None
+
+        if self._is_jpeg_cache:
+            return self._decode_jpeg(self._cache)
+
+        buf = lz4framed.decompress(self._cache)
+        buf = np.frombuffer(buf, self._type)
+        buf.shape = self._shape
+        return buf
+
+    def keep_decoded(self):
+        """保留解碼結果，重複顯示時不用再解碼"""
+        if self._decoded is None:
+            self._decoded = self.get_decoded()
+
+    def drop_decoded(self):
+        """釋放保留的解碼結果"""
+        self._decoded = None
+
     def convert_to_pixmap(self, focus=False, save=False):
         """做一系列圖像轉換至 pixmap
 
@@ -362,11 +669,9 @@ class CameraPixmap:
 
         """
         if self._buf is None:
-            if not self.is_cache():
+            buf = self.get_decoded()
+            if buf is None:
                 return None
-            buf = lz4framed.decompress(self._cache)
-            buf = np.frombuffer(buf, self._type)
-            buf.shape = self._shape
         else:
             buf = np.copy(self._buf)
 
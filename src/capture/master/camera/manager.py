@@ -15,6 +15,9 @@ from master.audio import audio_manager
 from .proxy import CameraProxy
 from .parameter import CameraParameter
 from .report_collector import CameraReportCollector
+from .cache import camera_cache
+from .disk_cache import camera_disk_cache
+from .prefetcher import camera_prefetcher
 
 
 class CameraManager:
@@ -39,6 +42,8 @@ class CameraManager:
             self._request_camera_status, 0.1, True
         )
         self._delay = DelayExecutor(0.1)
+        camera_cache.set_on_evict(self._on_cache_evicted)
+        camera_prefetcher.set_requester(self._request_prefetch)
 
         # 綁定 UI
         ui.dispatch_event(
@@ -85,6 +90,20 @@ class CameraManager:
             if camera_id in data:
                 camera.update_status(data[camera_id])
 
+    def _on_cache_evicted(self, key, camera_pixmap):
+        """快取淘汰圖像的回調，回退該 shot 的快取進度
+
+        Args:
+            key: 快取 key
+            camera_pixmap: 被淘汰的 CameraPixmap
+
+        """
+        try:
+            shot = project_manager.get_shot(camera_pixmap.shot_id)
+        except KeyError:
+            return
+        shot.revert_cache_progress(camera_pixmap)
+
     def _on_state_changed(self, camera):
         """當相機狀態改變的回調
 
@@ -341,16 +360,46 @@ class CameraManager:
         """取得 shot 圖案
 
         UI 要圖像的方式，指定的相機找不到自己的緩衝有圖像時，會再向 slave 索取
+        UI 的請求會同時更新預先索取的播放位置
 
         Args:
             shot_id: shot ID
             frame: 指定影格
-            quality: 轉檔品質
-            scale_length: 最長邊長度，預設不更動
-            camera_ids: 相機ID列表
+            closeup_camera: 特寫相機，該相機取原始尺寸
+            delay: 是否延遲
 
         """
+        this_shot = project_manager.get_shot(shot_id)
+        camera_prefetcher.set_playhead(
+            shot_id, frame, this_shot.frame_range, closeup_camera
+        )
+        self._request_images(shot_id, frame, closeup_camera, delay, False)
+
+    def _request_prefetch(
+        self, shot_id, frame, closeup_camera, prefetch, generation
+    ):
+        """預先索取的回調，不延遲也不更新播放位置"""
+        return self._request_images(
+            shot_id, frame, closeup_camera, False, prefetch, generation
+        )
 
+    def _request_images(
+        self, shot_id, frame, closeup_camera, delay, prefetch, generation=None
+    ):
+        """向所有相機索取指定影格的圖像
+
+        Args:
+            shot_id: shot ID
+            frame: 指定影格
+            closeup_camera: 特寫相機，該相機取原始尺寸
+            delay: 是否延遲
+            prefetch: 是否為預先索取，收到後只存入快取
+            generation: 預先索取時的播放位置世代，UI 的請求為 None
+
+        Returns:
+            索取的相機 ID 列表
+
+        """
         this_shot = project_manager.get_shot(shot_id)
 
         for camera_id, camera in self._camera_list.items():
@@ -367,8 +416,12 @@ class CameraManager:
                 scale_length,
                 delay,
                 shot_path=this_shot.get_folder_path(),
+                prefetch=prefetch,
+                generation=generation,
             )
 
+        return list(self._camera_list)
+
     def submit_shot(self, submit_order: SubmitOrder):
         """到 deadline 放算"""
         shot = project_manager.current_shot
@@ -393,11 +446,19 @@ class CameraManager:
             )
 
     def cache_whole_shot(self, closeup_camera):
+        """快取整個 shot，交給預先索取依序送出"""
         shot = project_manager.current_shot
         sf, ef = shot.frame_range
 
-        for f in range(sf, ef + 1):
-            self.request_shot_image(shot.get_id(), f, closeup_camera)
+        camera_prefetcher.cache_range(shot.get_id(), sf, ef, closeup_camera)
+
+    def _get_request_stats(self):
+        """加總所有相機向 slave 索取圖像的統計"""
+        total = {}
+        for camera in self._camera_list.values():
+            for name, value in camera.get_request_stats().items():
+                total[name] = total.get(name, 0) + value
+        return total
 
     def _get_bias(self):
         """取得相機實際擷取的格數誤差的最大值"""
@@ -424,6 +485,13 @@ class CameraManager:
             "slaves": message_manager.get_nodes_count(),
             "frames": -1,
             "cache_size": project_manager.get_all_cache_size(),
+            "cache": camera_cache.get_stats(),
+            "disk_cache": camera_disk_cache.get_stats(),
+            "prefetch": camera_prefetcher.get_status(),
+            "requests": self._get_request_stats(),
+            "send_queue": message_manager.get_queue_depths(),
+            "dispatch": message_manager.get_dispatch_metrics(),
+            "compression": message_manager.get_compression_stats(),
         }
 
         if self._is_recording:
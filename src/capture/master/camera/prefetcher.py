@@ -0,0 +1,309 @@
+from collections import deque
+import threading
+import time
+
+from utility.setting import setting
+
+
+class CameraPrefetcher(threading.Thread):
+    """播放預先索取
+
+    依播放位置與方向，預先向 slave 索取前方 (與少量後方) 的影格，並控制同時索取中的影格數
+    前方的格數依 slave 回傳的延遲 (EWMA) 調整，延遲越高索取越多
+    跳到較遠的位置時，放棄還沒送出的索取 (包含快取整個 shot)，也不再等待舊位置索取中的影格
+    每次跳躍遞增播放位置的世代，索取帶有當時的世代，CameraLibrary 送給 slave 前捨棄舊世代的索取
+    快取整個 shot 時也經過這裡依序送出，不會一次塞滿 slave
+
+    預先索取的圖像帶有 prefetch 參數，收到後只存入快取，不更新 UI
+    每個影格只等待實際索取的相機，CameraLibrary 放棄索取或解碼失敗時也會釋放
+    延遲只計算 slave 實際回傳的圖像，快取已有的圖像不算
+
+    """
+
+    def __init__(self):
+        super().__init__()
+        config = setting.camera_prefetch
+        self._min_ahead = config.min_ahead  # 前方最少格數
+        self._max_ahead = config.max_ahead  # 前方最多格數
+        self._behind = config.behind  # 後方格數
+        self._max_in_flight = config.max_in_flight  # 同時索取中的影格數上限
+        self._timeout = config.timeout  # 索取逾時秒數
+
+        self._requester = None  # 索取影格的 func
+        self._cond = threading.Condition()
+
+        # 播放位置
+        self._shot_id = None
+        self._frame = None
+        self._frame_range = None
+        self._closeup_camera = None
+        self._direction = 1  # 播放方向
+        self._generation = 0  # 播放位置的世代，跳躍時遞增
+
+        self._requested = set()  # 目前位置附近已索取過的影格
+        self._in_flight = {}  # {(shot ID, 影格): 索取資訊}
+        self._range_queue = deque()  # 快取整個 shot 待索取的影格
+        self._latency = None  # 延遲的 EWMA (秒)
+
+        # 初始化即自動執行
+        self.start()
+
+    def set_requester(self, requester):
+        """設定索取影格的 func
+
+        Args:
+            requester: 參數為 (shot ID, 影格, closeup_camera, prefetch, 世代)，
+                回傳實際索取的相機 ID 列表
+
+        """
+        self._requester = requester
+
+    def set_playhead(self, shot_id, frame, frame_range, closeup_camera):
+        """更新播放位置
+
+        Args:
+            shot_id: shot ID
+            frame: 目前影格
+            frame_range: shot 的影格範圍 (開始, 結束)，沒有的話為 None
+            closeup_camera: 特寫相機
+
+        """
+        with self._cond:
+            is_jump = (
+                shot_id != self._shot_id or
+                closeup_camera != self._closeup_camera or
+                self._frame is None or
+                abs(frame - self._frame) > self._get_ahead()
+            )
+
+            if not is_jump and frame != self._frame:
+                self._direction = 1 if frame > self._frame else -1
+
+            # 跳到遠處，放棄舊位置的索取
+            if is_jump:
+                self._generation += 1
+                self._requested.clear()
+                self._in_flight.clear()
+                self._range_queue.clear()
+
+            self._shot_id = shot_id
+            self._frame = frame
+            self._frame_range = frame_range
+            self._closeup_camera = closeup_camera
+            self._requested.add(frame)
+            self._cond.notify()
+
+    def cache_range(self, shot_id, start_frame, end_frame, closeup_camera):
+        """依序索取整個範圍的影格
+
+        Args:
+            shot_id: shot ID
+            start_frame: 開始影格
+            end_frame: 結束影格
+            closeup_camera: 特寫相機
+
+        """
+        with self._cond:
+            self._range_queue = deque(
+                (shot_id, frame, closeup_camera)
+                for frame in range(start_frame, end_frame + 1)
+            )
+            self._cond.notify()
+
+    def is_stale(self, camera_pixmap):
+        """是否是跳躍前送出的索取，不是預先索取的話為 False
+
+        Args:
+            camera_pixmap: 請求的 CameraPixmap
+
+        """
+        generation = camera_pixmap.get_generation()
+        with self._cond:
+            return generation is not None and generation != self._generation
+
+    def on_image_replied(self, camera_pixmap):
+        """收到 slave 回傳圖像時的回調，更新延遲
+
+        Args:
+            camera_pixmap: 收到的 CameraPixmap
+
+        """
+        key = (camera_pixmap.shot_id, camera_pixmap.frame)
+        with self._cond:
+            request = self._in_flight.get(key)
+            if request is None:
+                return
+
+            # 延遲以每張圖像的到達時間計算
+            latency = time.perf_counter() - request["time"]
+            if self._latency is None:
+                self._latency = latency
+            else:
+                self._latency += (latency - self._latency) * 0.2
+
+    def on_image_arrived(self, camera_pixmap):
+        """收到圖像或快取已有圖像時的回調，更新索取中的影格
+
+        Args:
+            camera_pixmap: 收到的 CameraPixmap
+
+        """
+        self._on_camera_done(camera_pixmap)
+
+    def on_request_lost(self, camera_pixmap):
+        """CameraLibrary 放棄索取或圖像無法解碼時的回調，釋放索取中的影格
+
+        Args:
+            camera_pixmap: 放棄的 CameraPixmap
+
+        """
+        self._on_camera_done(camera_pixmap)
+
+    def _on_camera_done(self, camera_pixmap):
+        """一台相機的索取結束"""
+        key = (camera_pixmap.shot_id, camera_pixmap.frame)
+        with self._cond:
+            request = self._in_flight.get(key)
+            if request is None:
+                return
+
+            # 還不知道索取了哪些相機時先記下來
+            if request["pending"] is None:
+                request["done"].add(camera_pixmap.camera_id)
+                return
+
+            request["pending"].discard(camera_pixmap.camera_id)
+            if not request["pending"]:
+                del self._in_flight[key]
+                self._cond.notify()
+
+    def _set_pending(self, key, camera_ids):
+        """設定影格實際索取的相機"""
+        with self._cond:
+            request = self._in_flight.get(key)
+            if request is None:
+                return
+
+            request["pending"] = set(camera_ids) - request["done"]
+            if not request["pending"]:
+                del self._in_flight[key]
+                self._cond.notify()
+
+    def _get_ahead(self):
+        """依延遲取得前方的格數"""
+        if self._latency is None:
+            return self._min_ahead
+        ahead = self._min_ahead + int(self._latency * setting.frame_rate)
+        return min(ahead, self._max_ahead)
+
+    def _get_plan(self):
+        """取得目前位置要索取的影格，近的優先"""
+        if self._frame is None:
+            return []
+
+        ahead = self._get_ahead()
+        frames = []
+        for i in range(1, max(ahead, self._behind) + 1):
+            if i <= ahead:
+                frames.append(self._frame + i * self._direction)
+            if i <= self._behind:
+                frames.append(self._frame - i * self._direction)
+
+        if self._frame_range is not None:
+            start_frame, end_frame = self._frame_range
+            frames = [f for f in frames if start_frame <= f <= end_frame]
+
+        return [f for f in frames if f not in self._requested]
+
+    def _expire(self):
+        """移除逾時的索取，並清理離目前位置太遠的索取紀錄"""
+        now = time.perf_counter()
+        for key, request in list(self._in_flight.items()):
+            if now - request["time"] > self._timeout:
+                del self._in_flight[key]
+                self._requested.discard(key[1])
+
+        if self._frame is not None:
+            limit = self._max_ahead * 2
+            self._requested = {
+                f for f in self._requested if abs(f - self._frame) <= limit
+            }
+
+    def _get_wait_time(self):
+        """取得等待秒數，等到最早的索取逾時為止"""
+        if not self._in_flight:
+            return self._timeout
+        now = time.perf_counter()
+        earliest = min(
+            request["time"] for request in self._in_flight.values()
+        )
+        return max(earliest + self._timeout - now, 0.01)
+
+    @staticmethod
+    def _make_request(now):
+        return {
+            "time": now,  # 送出時間
+            "pending": None,  # 還沒結束的相機，送出後才知道
+            "done": set(),  # 知道要等哪些相機前就結束的相機
+        }
+
+    def _next_requests(self):
+        """取得可以送出的索取 [(shot ID, 影格, closeup_camera, prefetch, 世代)]"""
+        if self._requester is None:
+            return []
+
+        self._expire()
+
+        requests = []
+        free = self._max_in_flight - len(self._in_flight)
+        now = time.perf_counter()
+
+        # 播放位置附近優先，接著是快取整個 shot
+        for frame in self._get_plan()[:max(free, 0)]:
+            self._requested.add(frame)
+            self._in_flight[(self._shot_id, frame)] = self._make_request(now)
+            requests.append((
+                self._shot_id, frame, self._closeup_camera, True,
+                self._generation
+            ))
+        free -= len(requests)
+
+        while free > 0 and self._range_queue:
+            shot_id, frame, closeup_camera = self._range_queue.popleft()
+            self._in_flight[(shot_id, frame)] = self._make_request(now)
+            requests.append((
+                shot_id, frame, closeup_camera, False, self._generation
+            ))
+            free -= 1
+
+        return requests
+
+    def run(self):
+        while True:
+            with self._cond:
+                requests = self._next_requests()
+                if not requests:
+                    self._cond.wait(self._get_wait_time())
+                    continue
+
+            for shot_id, frame, closeup_camera, prefetch, generation in requests:
+                camera_ids = self._requester(
+                    shot_id, frame, closeup_camera, prefetch, generation
+                )
+                self._set_pending((shot_id, frame), camera_ids)
+
+    def get_status(self):
+        """取得預先索取的狀態"""
+        with self._cond:
+            return {
+                'in_flight': len(self._in_flight),
+                'queued': len(self._range_queue),
+                'generation': self._generation,
+                'ahead': self._get_ahead(),
+                'latency_ms': (
+                    self._latency * 1000 if self._latency is not None else None
+                ),
+            }
+
+
+camera_prefetcher = CameraPrefetcher()
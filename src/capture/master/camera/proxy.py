@@ -79,6 +79,10 @@ class CameraProxy:
         """取得相機 ID"""
         return self._id
 
+    def get_request_stats(self):
+        """取得向 slave 索取圖像的統計"""
+        return self._library.get_request_stats()
+
     def import_image(self, *args, **kwargs):
         self._image_buffers.import_image(*args, **kwargs)
 
@@ -94,6 +98,8 @@ class CameraProxy:
         scale_length,
         delay,
         shot_path,
+        prefetch=False,
+        generation=None,
     ):
         offline_path = None
         if self.is_offline():
@@ -109,4 +115,6 @@ class CameraProxy:
             scale_length,
             delay,
             offline_path,
+            prefetch,
+            generation,
         )
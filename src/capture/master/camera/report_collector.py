@@ -5,6 +5,35 @@ from utility.define import MessageType, UIEventType, SubmitOrder
 from master.projects import project_manager
 
 
+def clip_missing_intervals(missing_frames, start_frame, end_frame):
+    """將失蹤格數限制在開始結尾之間
+
+    slave 回報的失蹤格數為區段 [(開始, 結束), ...]
+    舊版 slave 回報的是逐格的陣列，一併轉為區段
+
+    Args:
+        missing_frames: 失蹤格數區段或逐格陣列
+        start_frame: 開始格數
+        end_frame: 結束格數
+
+    Returns:
+        限制後的區段陣列 [(開始, 結束), ...]
+
+    """
+    intervals = [
+        (f, f) if isinstance(f, int) else tuple(f) for f in missing_frames
+    ]
+
+    clipped = []
+    for start, end in intervals:
+        start = max(start, start_frame)
+        end = min(end, end_frame)
+        if start <= end:
+            clipped.append((start, end))
+
+    return clipped
+
+
 class CameraReportCollector:
     """報告搜集器
 
@@ -168,6 +197,8 @@ class RecordReportContainer(ReportContainer):
         """總結
 
         找出所有失蹤格數與最大最小格數，並更新 Shot 的資料
+        失蹤格數以區段 {相機ID: [(開始, 結束), ...]} 儲存
+        沒有錄到任何影格的相機，整段都算失蹤
 
         """
         # 總容量大小與最大、最小的格數
@@ -176,9 +207,15 @@ class RecordReportContainer(ReportContainer):
         size = 0
 
         for r in self._reports:
+            size += r["size"]
+            if r["frame_range"] is None:
+                continue
             start_frames.append(r["frame_range"][0])
             end_frames.append(r["frame_range"][1])
-            size += r["size"]
+
+        if len(start_frames) == 0:
+            log.warning(f"Shot [{self._shot_id}] recorded without frames")
+            return
 
         start_frame = max(start_frames)  # 讓開始格數齊頭
         end_frame = min(end_frames)  # 讓結束格數齊尾
@@ -186,10 +223,19 @@ class RecordReportContainer(ReportContainer):
         # 失蹤格數，藉由開始結尾跟相機編號所設立
         missing_frames = {}
         for r in self._reports:
-            frames = r["missing_frames"]
-            missing_frames[r["camera_id"]] = [
-                f for f in frames if start_frame <= f <= end_frame
-            ]
+            dropped_frames = r.get("dropped_frames", [])
+            if len(dropped_frames) > 0:
+                log.warning(
+                    f"[{r['camera_id']}] {len(dropped_frames)} frames dropped"
+                )
+
+            if r["frame_range"] is None:
+                missing_frames[r["camera_id"]] = [(start_frame, end_frame)]
+                continue
+
+            missing_frames[r["camera_id"]] = clip_missing_intervals(
+                r["missing_frames"], start_frame, end_frame
+            )
 
         data = {
             "frame_range": (start_frame, end_frame),
@@ -1,6 +1,7 @@
 def start_master() -> int:
     """master 總啟動程序"""
-    from utility.message import message_manager
+    from utility.setting import setting
+    from utility.message import message_manager, MessageDispatcher
     from utility.logger import log
     from utility.define import MessageType
 
@@ -12,43 +13,61 @@ def start_master() -> int:
     log.info('Start Master')
     ui.show()
 
-    try:
-        while True:
-            # Message 接收與觸發
-            message = message_manager.receive_message()
+    def on_slave_error(message):
+        slave_name, error_message, require_restart = message.unpack()
+        log_func = log.critical if require_restart else log.error
+        log_func(f'[{slave_name}] {error_message.rstrip()}')
+        if require_restart:
+            message_manager.send_message(
+                MessageType.SLAVE_RESTART,
+                {'slave_name': slave_name}
+            )
 
-            if (
-                message.type is MessageType.LIVE_VIEW_IMAGE or
-                message.type is MessageType.SHOT_IMAGE
-            ):
-                camera_manager.receive_image(message)
+    def on_control(message):
+        # 狀態、斷線、報告與錯誤會改動相機、proxy 與專案狀態
+        # 由同一個執行緒依序處理，跟原本主迴圈的順序一樣
+        if message.type is MessageType.CAMERA_STATUS:
+            camera_manager.update_status(message)
+        elif message.type is MessageType.SLAVE_DOWN:
+            camera_manager.stop_capture(message)
+        elif message.type is MessageType.SLAVE_ERROR:
+            on_slave_error(message)
+        else:
+            camera_manager.collect_report(message)
 
-            elif message.type is MessageType.CAMERA_STATUS:
-                camera_manager.update_status(message)
+    # Message 分派，圖像跟其他訊息分開處理，慢的處理不會卡住圖像
+    # 圖像依相機分給固定的執行緒，每台相機的 proxy 與 library 只會被一個執行緒處理
+    # 共用的快取與預先索取都有自己的鎖
+    dispatcher = MessageDispatcher()
+    dispatcher.register(
+        (MessageType.LIVE_VIEW_IMAGE, MessageType.SHOT_IMAGE),
+        camera_manager.receive_image,
+        'image',
+        workers=setting.image_dispatch_workers,
+        key=lambda message: message.get_parms()['camera_id']
+    )
+    dispatcher.register(
+        (
+            MessageType.CAMERA_STATUS,
+            MessageType.SLAVE_DOWN,
+            MessageType.RECORD_REPORT,
+            MessageType.SUBMIT_REPORT,
+            MessageType.SLAVE_ERROR,
+        ),
+        on_control,
+        'control'
+    )
+    message_manager.set_dispatcher(dispatcher)
 
-            elif message.type is MessageType.SLAVE_DOWN:
-                camera_manager.stop_capture(message)
+    try:
+        while True:
+            # 只剩沒有註冊分派的訊息會進收件匣
+            message = message_manager.receive_message()
 
-            elif message.type is MessageType.MASTER_DOWN:
+            if message.type is MessageType.MASTER_DOWN:
                 log.warning('Master closed')
                 break
 
-            elif message.type is MessageType.RECORD_REPORT:
-                camera_manager.collect_report(message)
-
-            elif message.type is MessageType.SUBMIT_REPORT:
-                camera_manager.collect_report(message)
-
-            elif message.type is MessageType.SLAVE_ERROR:
-                slave_name, error_message, require_restart = message.unpack()
-                log_func = log.critical if require_restart else log.error
-                log_func(f'[{slave_name}] {error_message.rstrip()}')
-                if require_restart:
-                    message_manager.send_message(
-                        MessageType.SLAVE_RESTART,
-                        {'slave_name': slave_name}
-                    )
-
     except KeyboardInterrupt:
         log.warning('Interrupted by keyboard!')
 
@@ -448,6 +448,30 @@ class ShotEntity(Entity):
 
         self.emit(EntityEvent.PROGRESS, self)
 
+    def revert_cache_progress(self, camera_pixmap):
+        """快取被淘汰時，回退 update_cache_progress 加上的進度
+
+        Args:
+            camera_pixmap: 被淘汰的 CameraPixmap
+
+        """
+        self._memory -= camera_pixmap.get_size()
+
+        if camera_pixmap.get_cache_type() is CameraCacheType.THUMBNAIL:
+            thumb_origin = self._cache_progress[CameraCacheType.THUMBNAIL]
+            unit = 1 / len(setting.get_working_camera_ids())
+            if camera_pixmap.frame in thumb_origin:
+                thumb_origin[camera_pixmap.frame] -= unit
+                if thumb_origin[camera_pixmap.frame] < unit / 2:
+                    del thumb_origin[camera_pixmap.frame]
+        else:
+            camera_id = camera_pixmap.camera_id
+            progress_origin = self._cache_progress[CameraCacheType.ORIGINAL]
+            if camera_pixmap.frame in progress_origin.get(camera_id, []):
+                progress_origin[camera_id].remove(camera_pixmap.frame)
+
+        self.emit(EntityEvent.PROGRESS, self)
+
     def get_cache_progress(self):
         return self._cache_progress
 
@@ -27,19 +27,38 @@ class StatusIndicator(LayoutWidget):
             if key not in self._widgets:
                 continue
 
+            if key == 'cache':
+                self._update_cache(value)
+                continue
+
             if isinstance(value, float):
                 text = f'{value:.2f}'
             else:
                 text = str(value)
             self._widgets[key].set_text(text)
 
+    def _update_cache(self, stats):
+        """顯示記憶體快取的命中率與淘汰數，詳細數量放在提示"""
+        widget = self._widgets['cache']
+        widget.set_text(f"{stats['hit_ratio']:.0%} / {stats['evictions']}")
+        widget.setToolTip(
+            f"hits: {stats['hits']}\n"
+            f"misses: {stats['misses']}\n"
+            f"evictions: {stats['evictions']}"
+        )
+
     def _setup_ui(self):
         self.addWidget(ScreenButton())
         self.addWidget(TriggerButton())
 
-        for text in ('slaves', 'bias', 'cache_size'):
-            widget = StatusItem(text, self)
-            self._widgets[text] = widget
+        for key, icon in (
+            ('slaves', 'slaves'),
+            ('bias', 'bias'),
+            ('cache_size', 'cache_size'),
+            ('cache', 'cache_hit'),
+        ):
+            widget = StatusItem(icon, self)
+            self._widgets[key] = widget
             self.addWidget(widget)
 
         self.addWidget(DecibelMeter())
@@ -0,0 +1,95 @@
+import queue
+import threading
+import numpy as np
+
+
+class CameraBuffer:
+    """擷取緩衝
+
+    緩衝池中的一格緩衝，以參考計數管理
+    recorder 與即時預覽共用同一格緩衝，所有使用者都釋放後才歸還緩衝池
+
+    Args:
+        pool: 所屬的 CameraBufferPool
+        index: 緩衝編號
+        array: 緩衝陣列
+
+    """
+
+    def __init__(self, pool, index, array):
+        self._pool = pool  # 所屬的緩衝池
+        self._index = index  # 緩衝編號
+        self._array = array  # 緩衝陣列
+        self._ref_count = 0  # 參考計數
+        self._lock = threading.Lock()
+
+    def get_array(self):
+        """取得緩衝陣列"""
+        return self._array
+
+    def retain(self):
+        """增加參考"""
+        with self._lock:
+            self._ref_count += 1
+
+    def release(self):
+        """釋放參考，沒有參考時歸還緩衝池"""
+        with self._lock:
+            self._ref_count -= 1
+            is_free = self._ref_count == 0
+
+        if is_free:
+            self._pool.put_back(self._index)
+
+
+class CameraBufferPool:
+    """擷取緩衝池
+
+    預先配置固定數量的緩衝，擷取時將 PySpin 的圖像複製一次到緩衝
+    之後 recorder 與即時預覽都直接使用該緩衝，不再複製
+
+    Args:
+        count: 緩衝數量
+        frame_size: 每格緩衝大小
+
+    """
+
+    def __init__(self, count, frame_size):
+        self._arrays = np.empty((count, frame_size), dtype=np.uint8)
+        self._buffers = [
+            CameraBuffer(self, i, self._arrays[i]) for i in range(count)
+        ]
+        self._free = queue.Queue()  # 可用的緩衝編號
+        for i in range(count):
+            self._free.put(i)
+
+    def acquire(self, block=False):
+        """取得可用的緩衝
+
+        取得的緩衝參考數為 1，沒有可用緩衝且不阻塞時回傳 None
+
+        Args:
+            block: 沒有可用緩衝時是否等待
+
+        """
+        try:
+            index = self._free.get(block)
+        except queue.Empty:
+            return None
+
+        buffer = self._buffers[index]
+        buffer.retain()
+        return buffer
+
+    def put_back(self, index):
+        """歸還緩衝"""
+        self._free.put(index)
+
+    def get_frame_size(self):
+        """取得每格緩衝大小"""
+        return self._arrays.shape[1]
+
+    def get_status(self):
+        """取得緩衝池的使用狀況 (使用中, 總數)"""
+        count = len(self._buffers)
+        return count - self._free.qsize(), count
@@ -5,13 +5,15 @@ import PySpin
 from pathlib import Path
 
 from utility.define import CameraState, CameraRotation
-from utility.setting import setting
+from utility.setting import setting, SHOT_SPILL_SUFFIX
+from utility.message import message_manager
 
 from .encoder import CameraLiveViewer, CameraShotLoader, CameraShotSubmitter
 from .recorder import CameraRecorder
 from .configurator import CameraConfigurator
 from .shot import CameraShotFileCore, CameraShotMeta
 from .image import CameraImage
+from .buffer_pool import CameraBufferPool
 from .receiver import Receiver
 
 
@@ -40,9 +42,18 @@ class CameraConnector(Process):
         self._record_folder_path = setting.get_record_folder_path(
             camera_index
         )  # 錄製的資料夾路徑
+        self._spill_folder_path = setting.get_spill_folder_path(
+            camera_index
+        )  # 錄製佇列滿時溢出的資料夾路徑
+        self._stripe_folder_paths = setting.get_stripe_folder_paths(
+            camera_index
+        )  # 分散錄製的資料夾路徑
         self._receiver = None
         self._log = logger
 
+        # 擷取緩衝池，在相機的 process 裡才配置
+        self._buffer_pool = None
+
         # 即時預覽
         self._live_viewer = None
 
@@ -107,6 +118,12 @@ class CameraConnector(Process):
             self._camera, self._log
         )
 
+        # 擷取緩衝池
+        self._buffer_pool = CameraBufferPool(
+            setting.get_buffer_pool_frames(),
+            setting.camera_resolution[0] * setting.camera_resolution[1]
+        )
+
         # set child threads
         self._live_viewer = CameraLiveViewer(self._id)
         self._receiver = Receiver(self, self._log)
@@ -154,31 +171,69 @@ class CameraConnector(Process):
 
             # 判斷是否有開啟即時預覽或錄製，有的情況才執行影像處理
             if self._is_live_view or self._is_recording:
-                camera_image = CameraImage(
-                    image_ptr.GetData(),
-                    image_ptr.GetWidth(),
-                    image_ptr.GetHeight(),
-                    self._camera_rotation
-                )
-
-                if self._is_live_view and not self._is_recording:  # 不要改!!! 錄製時不要預覽，三台相機撐不住
-                    self._live_viewer.set_buffer(camera_image)
-
-                if self._is_recording:
-                    self._recorder.add_task(
-                        self._current_frame,
-                        camera_image
-                    )
-
-                    if self._stop_sign:
-                        if len(self._recorder.get_record_frames()) > 0:
-                            self._stop_recording()
+                camera_image = self._copy_to_buffer(image_ptr)
+
+                if camera_image is None:
+                    # 緩衝池用完，錄製中的話記為捨棄的影格
+                    if self._is_recording:
+                        self._recorder.drop_frame(self._current_frame)
+                else:
+                    if self._is_live_view and not self._is_recording:  # 不要改!!! 錄製時不要預覽，三台相機撐不住
+                        self._live_viewer.set_buffer(camera_image)
+
+                    if self._is_recording:
+                        self._recorder.add_task(
+                            self._current_frame,
+                            camera_image
+                        )
+
+                    # 釋放擷取迴圈持有的參考
+                    camera_image.release()
+
+                if self._is_recording and self._stop_sign:
+                    if self._recorder.get_record_frame_count() > 0:
+                        self._stop_recording()
 
             image_ptr.Release()
 
             if self._state is not CameraState.CAPTURING:
                 break
 
+    def _copy_to_buffer(self, image_ptr):
+        """將 PySpin 的圖像複製到擷取緩衝池
+
+        PySpin 的圖像在 Release 後就會被相機重複使用，所以只在這裡複製一次
+        回傳的 CameraImage 參考數為 1，使用完需釋放
+        錄製時依錄製佇列的策略決定是否等待緩衝，沒有可用緩衝時回傳 None
+
+        Args:
+            image_ptr: PySpin 的圖像
+
+        """
+        data = image_ptr.GetData()
+        width = image_ptr.GetWidth()
+        height = image_ptr.GetHeight()
+
+        # 圖像不符合緩衝大小，直接複製一份
+        if data.size > self._buffer_pool.get_frame_size():
+            return CameraImage(
+                data.copy(), width, height, self._camera_rotation
+            )
+
+        buffer = self._buffer_pool.acquire(
+            block=(
+                self._is_recording and setting.record.queue_policy == 'block'
+            )
+        )
+        if buffer is None:
+            return None
+
+        view = buffer.get_array()[:data.size]
+        view[:] = data.ravel()
+        return CameraImage(
+            view, width, height, self._camera_rotation, buffer
+        )
+
     def _end_capture(self):
         """結束擷取
 
@@ -200,16 +255,42 @@ class CameraConnector(Process):
         self._log.info(f'Change to state: {state.name}')
         self._state = state
 
-    def get_shot_file_path_for_recording_and_makedir(self, shot_id):
+    def get_shot_file_path_for_recording_and_makedir(
+        self, shot_id, is_spill=False
+    ):
         """取得 shot 的檔案位置
 
         Args:
             shot_id: Shot ID
+            is_spill: 是否為溢出檔案，沒有溢出的硬碟時回傳 None
 
         """
-        shot_folder = Path(f'{self._record_folder_path}/{shot_id}')
+        if not is_spill:
+            record_folder_path = self._record_folder_path
+            file_name = self._id
+        elif self._spill_folder_path is not None:
+            record_folder_path = self._spill_folder_path
+            file_name = self._id + SHOT_SPILL_SUFFIX
+        else:
+            return None
+
+        shot_folder = Path(f'{record_folder_path}/{shot_id}')
         shot_folder.mkdir(parents=True, exist_ok=True)
-        return str(shot_folder / self._id)
+        return str(shot_folder / file_name)
+
+    def get_striped_shot_file_paths_and_makedir(self, shot_id):
+        """取得分散錄製時，每顆硬碟上的 shot 檔案位置
+
+        Args:
+            shot_id: Shot ID
+
+        """
+        file_paths = []
+        for record_folder_path in self._stripe_folder_paths:
+            shot_folder = Path(f'{record_folder_path}/{shot_id}')
+            shot_folder.mkdir(parents=True, exist_ok=True)
+            file_paths.append(str(shot_folder / self._id))
+        return tuple(file_paths)
 
     def stop_capture(self):
         """停止擷取
@@ -232,9 +313,15 @@ class CameraConnector(Process):
         }
 
         if self._is_recording and self._recorder:
-            status['record_frames_count'] = len(
-                self._recorder.get_record_frames()
+            status['record_frames_count'] = (
+                self._recorder.get_record_frame_count()
             )
+            status.update(self._recorder.get_write_status())
+
+        if self._buffer_pool is not None:
+            status['buffer_pool'] = self._buffer_pool.get_status()
+
+        status['send_queue'] = message_manager.get_queue_depths()
 
         return status
 
@@ -246,11 +333,25 @@ class CameraConnector(Process):
 
         """
         self._log.info('Start recording')
-        shot_meta = CameraShotMeta(
-            {'shot_id': shot_id, 'camera_id': self._id, 'is_cali': is_cali},
-            self.get_shot_file_path_for_recording_and_makedir(shot_id)
+        parms = {'shot_id': shot_id, 'camera_id': self._id, 'is_cali': is_cali}
+
+        # 校正只有一格，不做分散錄製
+        if len(self._stripe_folder_paths) > 1 and not is_cali:
+            shot_path = self.get_striped_shot_file_paths_and_makedir(shot_id)
+        else:
+            shot_path = self.get_shot_file_path_for_recording_and_makedir(
+                shot_id
+            )
+        shot_meta = CameraShotMeta(parms, shot_path)
+
+        spill_meta = None
+        spill_path = self.get_shot_file_path_for_recording_and_makedir(
+            shot_id, is_spill=True
         )
-        self._recorder = CameraRecorder(shot_meta, self._log)
+        if spill_path is not None:
+            spill_meta = CameraShotMeta(parms, spill_path)
+
+        self._recorder = CameraRecorder(shot_meta, self._log, spill_meta)
         self._is_recording = True
         self._stop_sign = False
 
@@ -328,15 +429,18 @@ class CameraConnector(Process):
         def remove_shot_file():
             self._shot_loader.on_shot_will_remove(shot_file_path)
 
-            for ext in (
-                CameraShotFileCore.image_ext,
-                CameraShotFileCore.meta_ext
-            ):
-                if shot_file_path is None:
-                    continue
-                file = shot_file_path + ext
-                if os.path.isfile(file):
-                    os.remove(file)
+            if shot_file_path is None:
+                return
+
+            for part_path in shot_file_path:
+                for ext in (
+                    CameraShotFileCore.image_ext,
+                    CameraShotFileCore.meta_ext,
+                    CameraShotFileCore.manifest_ext
+                ):
+                    file = part_path + ext
+                    if os.path.isfile(file):
+                        os.remove(file)
 
         t = Thread(target=remove_shot_file)
         t.start()
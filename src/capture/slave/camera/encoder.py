@@ -1,5 +1,9 @@
+from concurrent.futures import ThreadPoolExecutor
 from threading import Condition
+from collections import deque
+import threading
 import queue
+import time
 import os
 from pathlib import Path
 
@@ -9,6 +13,8 @@ from utility.mix_thread import MixThread
 from utility.define import MessageType
 
 from .shot import CameraShotFileLoader
+from .image import CameraEncodePipeline
+from .submit_manifest import CameraSubmitManifest
 
 
 class CameraLiveViewer(MixThread):
@@ -30,6 +36,7 @@ class CameraLiveViewer(MixThread):
         }  # 預設編碼設定
         self._buffer = None  # 緩衝佇列
         self._cond = Condition()  # 緩衝鎖，以防衝突
+        self._pipeline = CameraEncodePipeline()  # 編碼流程
 
         # 初始化即自動執行
         self.start()
@@ -42,8 +49,9 @@ class CameraLiveViewer(MixThread):
                 break
 
             encoded_data = camera_image.convert_jpeg(
-                **self._encode_parms
+                **self._encode_parms, pipeline=self._pipeline
             )
+            camera_image.release()
 
             message_manager.send_message(
                 MessageType.LIVE_VIEW_IMAGE,
@@ -67,12 +75,16 @@ class CameraLiveViewer(MixThread):
         """設定圖像緩衝
 
         緩衝永遠只有一張，新的會取代舊的
+        圖像會增加緩衝參考，被取代的舊圖像會釋放參考
 
         Args:
             camera_image: CameraImage
 
         """
+        camera_image.retain()
         self._cond.acquire()
+        if self._buffer is not None:
+            self._buffer.release()
         self._buffer = camera_image
         self._cond.notify()
         self._cond.release()
@@ -114,6 +126,7 @@ class CameraShotLoader(MixThread):
         self._file = None  # CameraShotFileLoader
         self._queue = queue.Queue()  # 任務佇列
         self._rotation = rotation
+        self._pipeline = CameraEncodePipeline()  # 編碼流程
 
         self.start()
 
@@ -148,7 +161,8 @@ class CameraShotLoader(MixThread):
                 shot_meta.get_parms(),
                 camera_image.convert_jpeg(
                     shot_meta.quality,
-                    shot_meta.scale_length
+                    shot_meta.scale_length,
+                    self._pipeline
                 )
             )
 
@@ -186,6 +200,9 @@ class CameraShotSubmitter(MixThread):
     監控 self._queue 去讀取特定的 Shot
     將 Shot 轉換出需要範圍的圖像並發佈到解算伺服器
 
+    讀取與轉檔交給 setting.submit_workers 個工作執行緒平行處理，寫檔依照影格順序
+    進度報告每 setting.submit_report_interval 秒最多傳送一次
+
     """
 
     def __init__(self, rotation, log):
@@ -193,17 +210,22 @@ class CameraShotSubmitter(MixThread):
         self._queue = queue.Queue()  # 任務佇列
         self._log = log
         self._rotation = rotation
+        self._workers = max(1, setting.submit_workers)  # 工作執行緒數量
+        self._executor = ThreadPoolExecutor(self._workers)  # 轉檔執行緒池
+        self._local = threading.local()  # 每個工作執行緒的編碼流程
 
         # 自動執行
         self.start()
 
     def _run(self):
         while self._running:
-            project_id, shot_id, job_name, frame_range, offset_frame, shot_file_paths, is_cali, shot_path = self._queue.get()
+            task = self._queue.get()
 
-            if shot_id is None:
+            if task[1] is None:
                 break
 
+            project_id, shot_id, job_name, frame_range, offset_frame, shot_file_paths, is_cali, shot_path = task
+
             self._log.info(
                 'Submit shot: '
                 f'{shot_id} ({frame_range[0]}-{frame_range[1]})'
@@ -227,70 +249,181 @@ class CameraShotSubmitter(MixThread):
                 if not is_cali:
                     shot_id_camera_path = f'{submit_path}{camera_id}/'
                     Path(shot_id_camera_path).mkdir(parents=True, exist_ok=True)
+                    image_folder = shot_id_camera_path
+                else:
+                    image_folder = submit_path
+
+                # 發佈紀錄
+                manifest = CameraSubmitManifest(
+                    CameraSubmitManifest.get_path(shot_file_path, image_folder),
+                    image_folder,
+                    self._log
+                )
 
                 # 進度定義
                 current_count = 0
                 total_count = frame_range[1] - frame_range[0] + 1
+                last_report_time = 0
+
+                # 轉檔中的影格，限制數量以免佔用太多記憶體
+                pending = deque()
 
                 for frame in range(frame_range[0], frame_range[1] + 1):
                     real_frame = frame + offset_frame
-                    camera_image = file_loader.load(real_frame)
-
-                    if camera_image is not None:
-                        if not is_cali:
-                            image_path = (
-                                f'{shot_id_camera_path}{camera_id}_{real_frame:06d}.jpg'
-                            )
-                        else:
-                            image_path = (
-                                f'{submit_path}{camera_id}.jpg'
-                            )
-
-                        # 檢查是否有存在的檔案並大小差不多
-                        is_exist = False
-                        if os.path.isfile(image_path):
-                            exist_size = os.stat(image_path).st_size
-
-                            # 大小超過閥值，略過
-                            size_ratio = setting.bypass_exist_size / exist_size
-                            if 0.6 < size_ratio < 1.4:
-                                is_exist = True
-                            else:
-                                self._log.warning(
-                                    f'Exist image size mismatch: ({size_ratio}) {image_path}'
-                                )
-
-                        # 轉檔與儲存
-                        if not is_exist:
-                            jpg_data = camera_image.convert_jpeg(
-                                setting.jpeg.submit.quality
-                            )
-                            with open(image_path, 'wb') as f:
-                                f.write(jpg_data)
-
+                    if not is_cali:
+                        image_path = (
+                            f'{shot_id_camera_path}{camera_id}_{real_frame:06d}.jpg'
+                        )
                     else:
-                        error_message = f'{camera_id} missing frame {frame}'
-                        self._log.error(error_message)
+                        image_path = (
+                            f'{submit_path}{camera_id}.jpg'
+                        )
 
-                    # 進度整理
+                    future = self._executor.submit(
+                        self._convert_frame,
+                        file_loader, manifest, real_frame, image_path
+                    )
+                    pending.append((frame, image_path, future))
+
+                    # 轉檔中的影格到達上限時，依序寫入最早的影格
+                    if len(pending) >= self._workers * 2:
+                        self._write_frame(
+                            camera_id, manifest, *pending.popleft()
+                        )
+                        current_count += 1
+                        last_report_time = self._report_progress(
+                            camera_id, shot_id, job_name,
+                            (current_count, total_count), last_report_time
+                        )
+
+                # 寫入剩下的影格
+                while len(pending) > 0:
+                    self._write_frame(
+                        camera_id, manifest, *pending.popleft()
+                    )
                     current_count += 1
-
-                    # 傳送進度報告
-                    message_manager.send_message(
-                        MessageType.SUBMIT_REPORT,
-                        {
-                            'camera_id': camera_id,
-                            'shot_id': shot_id,
-                            'job_name': job_name,
-                            'progress': (current_count, total_count)
-                        }
+                    last_report_time = self._report_progress(
+                        camera_id, shot_id, job_name,
+                        (current_count, total_count), last_report_time
                     )
 
+                manifest.save()
+                file_loader.close()
+
+    def _report_progress(
+        self, camera_id, shot_id, job_name, progress, last_report_time
+    ):
+        """傳送進度報告
+
+        間隔 setting.submit_report_interval 秒內只傳一次，完成時一定傳
+
+        Args:
+            camera_id: 相機 ID
+            shot_id: Shot ID
+            job_name: 發佈名稱
+            progress: (目前數量, 總數量)
+            last_report_time: 上次傳送的時間
+
+        Returns:
+            最後傳送的時間
+
+        """
+        now = time.perf_counter()
+        if (
+            now - last_report_time < setting.submit_report_interval and
+            progress[0] != progress[1]
+        ):
+            return last_report_time
+
+        message_manager.send_message(
+            MessageType.SUBMIT_REPORT,
+            {
+                'camera_id': camera_id,
+                'shot_id': shot_id,
+                'job_name': job_name,
+                'progress': progress
+            }
+        )
+        return now
+
+    def _get_pipeline(self):
+        """取得目前工作執行緒的編碼流程"""
+        pipeline = getattr(self._local, 'pipeline', None)
+        if pipeline is None:
+            pipeline = CameraEncodePipeline()
+            self._local.pipeline = pipeline
+        return pipeline
+
+    def _convert_frame(self, file_loader, manifest, real_frame, image_path):
+        """讀取並轉檔單一影格，在工作執行緒執行
+
+        發佈紀錄中來源與設定都相同的圖像不再轉檔
+
+        Args:
+            file_loader: CameraShotFileLoader
+            manifest: CameraSubmitManifest
+            real_frame: 影格編號
+            image_path: 輸出的圖像路徑
+
+        Returns:
+            (是否有該影格, JPEG 資料，已發佈過的話為 None, 來源紀錄)
+
+        """
+        source = file_loader.get_frame_source(real_frame)
+        if source is None:
+            return False, None, None
+
+        entry = manifest.make_entry(
+            source, setting.jpeg.submit.quality, self._rotation
+        )
+        if manifest.is_exported(os.path.basename(image_path), entry):
+            return True, None, entry
+
+        camera_image = file_loader.load(real_frame)
+        if camera_image is None:
+            return False, None, None
+
+        # 轉檔
+        jpg_data = camera_image.convert_jpeg(
+            setting.jpeg.submit.quality,
+            pipeline=self._get_pipeline()
+        )
+        return True, jpg_data, entry
+
+    def _write_frame(self, camera_id, manifest, frame, image_path, future):
+        """等待影格轉檔完成並儲存
+
+        Args:
+            camera_id: 相機 ID
+            manifest: CameraSubmitManifest
+            frame: 影格編號
+            image_path: 輸出的圖像路徑
+            future: 轉檔的 Future
+
+        """
+        try:
+            has_frame, jpg_data, entry = future.result()
+        except Exception as error:
+            self._log.error(f'{camera_id} frame {frame} convert failed: {error}')
+            return
+
+        if not has_frame:
+            error_message = f'{camera_id} missing frame {frame}'
+            self._log.error(error_message)
+            return
+
+        # 儲存並記錄
+        if jpg_data is not None:
+            with open(image_path, 'wb') as f:
+                f.write(jpg_data)
+            manifest.add(os.path.basename(image_path), entry, jpg_data)
+
     def add_task(self, task):
         """將要發佈的 Shot 資訊放到佇列
 
         Args:
-            task: (shot_id, frame_range, shot_file_paths)
+            task: (project_id, shot_id, job_name, frame_range, offset_frame,
+                   shot_file_paths, is_cali, shot_path)
 
         """
         self._queue.put(task)
@@ -298,3 +431,4 @@ class CameraShotSubmitter(MixThread):
     def _after_stop(self):
         self.add_task((None, None, None))
         self.join()
+        self._executor.shutdown()
@@ -14,49 +14,64 @@ class CameraImage:
         data: 二進制陣列
         width: 圖像寬
         height: 圖像高
+        buffer: 資料所在的 CameraBuffer，不是來自緩衝池的話為 None
 
     """
 
-    def __init__(self, data, width, height, rotation: CameraRotation):
+    def __init__(
+        self, data, width, height, rotation: CameraRotation, buffer=None
+    ):
         self._data = data  # 二進制陣列
         self._width = width  # 圖像寬
         self._height = height  # 圖像高
         self._rotation = rotation
+        self._buffer = buffer  # 資料所在的 CameraBuffer
 
-    def _raw_to_cv2(self):
-        """將二進制陣列轉成 cv2 的圖像"""
+    def get_raw(self):
+        """取得 Bayer 馬賽克陣列"""
         im = np.frombuffer(self._data, dtype=np.uint8)
-        im = im.reshape((self._height, self._width))
-        im = cv2.cvtColor(im, cv2.COLOR_BAYER_RG2RGB)
-        if self._rotation is not CameraRotation.NONE:
-            if self._rotation is CameraRotation.RIGHT:
-                rotate_method = cv2.ROTATE_90_CLOCKWISE
-            else:
-                rotate_method = cv2.ROTATE_90_COUNTERCLOCKWISE
-            im = cv2.rotate(im, rotate_method)
-
-            self._width, self._height = self._height, self._width
-        return im
+        return im.reshape((self._height, self._width))
 
-    def _rescale(self, image, scale_length):
-        """縮放圖像
+    def get_bin_step(self, scale_length):
+        """取得縮小 Bayer 馬賽克的取樣間隔
 
-        縮放圖像，最長邊會等於指定的長度
+        縮小的倍數不足 2 或不縮放時為 1
 
         Args:
-            image: 圖像
             scale_length: 最長邊長度
 
         """
-        if self._width > self._height:
-            sw = scale_length
-            sh = int(scale_length * self._height / self._width)
+        if scale_length is None:
+            return 1
+
+        step = max(self._width, self._height) // 2 // scale_length
+        return max(step, 1)
+
+    def get_binned_raw(self, step, out=None):
+        """取得縮小的 Bayer 馬賽克陣列
+
+        以 2x2 的 Bayer 單位做間隔取樣，取樣後仍是相同排列的 Bayer 馬賽克
+        讓縮圖只需要對小圖做色彩轉換
+
+        Args:
+            step: 取樣間隔
+            out: 輸出的緩衝，形狀為 (高 / 2, 2, 寬 / 2, 2)
+
+        """
+        im = self.get_raw()
+        im = im[:self._height // 2 * 2, :self._width // 2 * 2]
+        im = im.reshape((self._height // 2, 2, self._width // 2, 2))
+        im = im[::step, :, ::step, :]
+
+        if out is None:
+            out = np.ascontiguousarray(im)
         else:
-            sh = scale_length
-            sw = int(scale_length * self._width / self._height)
-        return cv2.resize(image, (sw, sh))
+            np.copyto(out, im)
+
+        h, _, w, _ = out.shape
+        return out.reshape((h * 2, w * 2))
 
-    def convert_jpeg(self, quality, scale_length=None):
+    def convert_jpeg(self, quality, scale_length=None, pipeline=None):
         """轉成JPEG
 
         傳送到 master 前的壓縮，scale_length 指定的話就會縮放影像
@@ -64,26 +79,154 @@ class CameraImage:
         Args:
             quality: JPEG品質
             scale_length: 最長邊長度
+            pipeline: 重複使用的 CameraEncodePipeline，沒有的話建立一次性的
 
         """
-        im = self._raw_to_cv2()
-        if scale_length is not None:
-            im = self._rescale(im, scale_length)
-
-        return jpeg_coder.encode(im, quality=quality)
+        if pipeline is None:
+            pipeline = CameraEncodePipeline()
+        return pipeline.encode(self, quality, scale_length)
 
     def save_png(self, path):
-        im = self._raw_to_cv2()
+        im = CameraEncodePipeline().convert(self)
         cv2.imwrite(path, im)
 
-    def write(self, file):
-        """寫入檔案
+    def get_data(self):
+        """取得原始資料陣列"""
+        return np.asarray(self._data)
 
-        將自身資料寫入到指定檔案裏頭
+    def retain(self):
+        """增加緩衝的參考，使用緩衝池的圖像在使用前需呼叫"""
+        if self._buffer is not None:
+            self._buffer.retain()
 
-        """
-        np.save(file, self._data, False, False)
+    def release(self):
+        """釋放緩衝的參考，使用完畢後呼叫"""
+        if self._buffer is not None:
+            self._buffer.release()
+
+    def get_rotation(self):
+        """取得圖像旋轉"""
+        return self._rotation
 
     def get_size(self):
         """取得圖像尺寸"""
         return self._width, self._height
+
+
+class CameraEncodePipeline:
+    """圖像編碼流程
+
+    色彩轉換 -> 縮放 -> 旋轉 -> JPEG 編碼
+    縮放很多時先縮小 Bayer 馬賽克再做色彩轉換，沒有縮放時做完整的色彩轉換
+    先縮放再旋轉，旋轉只需要處理小圖
+    每種 (旋轉, 最長邊長度, 寬, 高) 的組合會保留各步驟的緩衝重複使用，避免每張圖都配置記憶體
+    TurboJPEG 編碼時無法縮放與旋轉，所以只負責編碼
+
+    一個執行緒使用一個，轉換的結果會在下次轉換時被覆蓋
+
+    """
+
+    max_buffers = 8  # 保留的緩衝組合數量上限
+
+    def __init__(self):
+        self._buffers = {}  # {(旋轉, 最長邊長度, 寬, 高): 各步驟的緩衝}
+
+    def _get_buffers(self, camera_image, scale_length):
+        """取得對應圖像與縮放的緩衝，沒有的話建立
+
+        Args:
+            camera_image: CameraImage
+            scale_length: 最長邊長度
+
+        """
+        width, height = camera_image.get_size()
+        rotation = camera_image.get_rotation()
+        key = (rotation, scale_length, width, height)
+        if key in self._buffers:
+            return self._buffers[key]
+
+        # 超過上限時移除最早建立的組合
+        if len(self._buffers) >= self.max_buffers:
+            self._buffers.pop(next(iter(self._buffers)))
+
+        buffers = {}
+
+        # 縮小的 Bayer 馬賽克
+        step = camera_image.get_bin_step(scale_length)
+        if step >= 2:
+            bh = len(range(0, height // 2, step))
+            bw = len(range(0, width // 2, step))
+            buffers['step'] = step
+            buffers['binned'] = np.empty((bh, 2, bw, 2), dtype=np.uint8)
+            rgb_size = (bh * 2, bw * 2)
+        else:
+            rgb_size = (height, width)
+
+        buffers['rgb'] = np.empty((*rgb_size, 3), dtype=np.uint8)
+
+        # 縮放，最長邊等於指定的長度，旋轉不影響最長邊
+        out_size = rgb_size
+        if scale_length is not None:
+            if width > height:
+                sw = scale_length
+                sh = int(scale_length * height / width)
+            else:
+                sh = scale_length
+                sw = int(scale_length * width / height)
+            out_size = (sh, sw)
+            buffers['resized'] = np.empty((sh, sw, 3), dtype=np.uint8)
+
+        # 旋轉
+        if rotation is not CameraRotation.NONE:
+            if rotation is CameraRotation.RIGHT:
+                buffers['rotate_method'] = cv2.ROTATE_90_CLOCKWISE
+            else:
+                buffers['rotate_method'] = cv2.ROTATE_90_COUNTERCLOCKWISE
+            buffers['rotated'] = np.empty(
+                (out_size[1], out_size[0], 3), dtype=np.uint8
+            )
+
+        self._buffers[key] = buffers
+        return buffers
+
+    def convert(self, camera_image, scale_length=None):
+        """將圖像轉成 cv2 的圖像
+
+        Args:
+            camera_image: CameraImage
+            scale_length: 最長邊長度
+
+        """
+        buffers = self._get_buffers(camera_image, scale_length)
+
+        if 'binned' in buffers:
+            raw = camera_image.get_binned_raw(
+                buffers['step'], buffers['binned']
+            )
+        else:
+            raw = camera_image.get_raw()
+
+        im = cv2.cvtColor(raw, cv2.COLOR_BAYER_RG2RGB, dst=buffers['rgb'])
+
+        if 'resized' in buffers:
+            resized = buffers['resized']
+            im = cv2.resize(
+                im, (resized.shape[1], resized.shape[0]), dst=resized
+            )
+
+        if 'rotated' in buffers:
+            im = cv2.rotate(im, buffers['rotate_method'], dst=buffers['rotated'])
+
+        return im
+
+    def encode(self, camera_image, quality, scale_length=None):
+        """轉成JPEG
+
+        Args:
+            camera_image: CameraImage
+            quality: JPEG品質
+            scale_length: 最長邊長度
+
+        """
+        im = self.convert(camera_image, scale_length)
+        return jpeg_coder.encode(im, quality=quality)
@@ -1,37 +1,59 @@
 import queue
+import numpy as np
 
 from utility.mix_thread import MixThread
 from utility.message import message_manager
 from utility.define import MessageType
+from utility.setting import setting
 
-from .shot import CameraShotFileDumper
+from .shot import CameraShotFileDumper, CameraShotStripedDumper
 
 
 class CameraRecorder(MixThread):
     """相機錄製器
 
-    根據 shot 資訊建立 CameraShotFileDumper
-    並監控 self._queue 將圖像給 CameraShotFileDumper
+    根據 shot 資訊建立 CameraShotFileDumper，多個檔案路徑時為 CameraShotStripedDumper
+    並監控 self._queue 將圖像給 dumper
     錄製結束時會回傳錄製報告
 
+    圖像使用擷取緩衝池的緩衝，放入佇列時增加參考，寫入硬碟後釋放
+    錄製佇列的長度為 setting.record.queue_frames，佇列滿時依 setting.record.queue_policy:
+        block: 阻塞擷取直到佇列有空位
+        drop: 捨棄新的影格並記錄
+        spill: 交給另一個 recorder 寫到溢出檔案，溢出也滿了才捨棄
+
     Args:
         shot_meta: Shot 資訊
+        log: logger
+        spill_meta: 溢出檔案的 Shot 資訊
+        is_spill: 是否為溢出用的 recorder，溢出用的不回傳報告
 
     """
 
-    def __init__(self, shot_meta, log):
+    def __init__(self, shot_meta, log, spill_meta=None, is_spill=False):
         super().__init__()
         self._log = log
         self._shot_meta = shot_meta  # Shot 資訊
-        self._queue = queue.Queue()  # 任務佇列
+        self._queue = queue.Queue(setting.record.queue_frames)  # 任務佇列
         self._file = None  # 將資料給 thread 做
         self._count = 0
+        self._policy = 'drop' if is_spill else setting.record.queue_policy
+        self._dropped_frames = []  # 捨棄的影格
+
+        # 溢出
+        self._is_spill = is_spill
+        self._spill_meta = spill_meta  # 溢出檔案的 Shot 資訊
+        self._spill = None  # 溢出用的 CameraRecorder，需要時才建立
 
         self.start()
 
     def _run(self):
         # 負責錄製檔案寫入
-        self._file = CameraShotFileDumper(self._shot_meta.get_path(), self._log)
+        shot_path = self._shot_meta.get_path()
+        if isinstance(shot_path, str):
+            self._file = CameraShotFileDumper(shot_path, self._log)
+        else:
+            self._file = CameraShotStripedDumper(shot_path, self._log)
 
         while True:
             frame, camera_image = self._queue.get()
@@ -43,18 +65,51 @@ class CameraRecorder(MixThread):
 
             self._file.dump(frame, camera_image)
 
+            # 寫入後釋放緩衝
+            camera_image.release()
+
     def _stop(self):
         """停止錄製，利用餵 None tuple 的方式終止運作"""
         self.add_task(None, None)
 
     def _stop_record(self):
         """停止運作，將錄製做收尾，並整理錄製報告傳給 master"""
-        report = self._file.get_report()
+        # 溢出的影格也算在錄製的影格裡
+        extra_frames = ()
+        extra_size = 0
+        if self._spill is not None:
+            self._spill.stop()
+            self._spill.join()
+            extra_frames = self._spill.get_record_frames()
+            extra_size = self._spill.get_record_size()
+            self._dropped_frames.extend(self._spill.get_dropped_frames())
+
+        # 寫完剩下的緩衝後，寫入失敗的影格才完整
         self._file.close()
+        failed_frames = self._file.get_failed_frames()
+        self._dropped_frames.extend(failed_frames)
+
+        if self._is_spill:
+            return
+
+        report = self._file.get_report(extra_frames)
+        report['size'] += extra_size
+
+        if len(failed_frames) > 0:
+            self._log.warning(
+                f'{len(failed_frames)} frames dropped due to write error'
+            )
+
+        if len(self._dropped_frames) > len(failed_frames):
+            self._log.warning(
+                f'{len(self._dropped_frames) - len(failed_frames)} '
+                'frames dropped due to full record queue'
+            )
 
         report.update({
             'camera_id': self._shot_meta.camera_id,
-            'shot_id': self._shot_meta.shot_id
+            'shot_id': self._shot_meta.shot_id,
+            'dropped_frames': sorted(self._dropped_frames)
         })
 
         message_manager.send_message(
@@ -62,17 +117,71 @@ class CameraRecorder(MixThread):
             report
         )
 
+    def _on_queue_full(self, current_frame, camera_image):
+        """錄製佇列滿時的處理
+
+        Args:
+            current_frame: 目前擷取的格數
+            camera_image: CameraImage
+
+        """
+        if self._policy == 'spill' and self._spill_meta is not None:
+            if self._spill is None:
+                self._log.warning(
+                    f'Record queue full, spill to {self._spill_meta.get_path()}'
+                )
+                self._spill = CameraRecorder(
+                    self._spill_meta, self._log, is_spill=True
+                )
+            self._spill.add_task(current_frame, camera_image)
+            return
+
+        self._dropped_frames.append(current_frame)
+
     def get_record_frames(self):
-        """取得錄製的影格陣列"""
+        """取得錄製的影格陣列，包含溢出的影格"""
+        frames = []
         if self._file:
-            return self._file.get_frames()
-        else:
-            return []
+            frames.append(self._file.get_frames())
+        if self._spill is not None:
+            frames.append(self._spill.get_record_frames())
+        if len(frames) == 0:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate(frames)
+
+    def get_record_frame_count(self):
+        """取得錄製的影格數，包含溢出的影格"""
+        count = 0
+        if self._file:
+            count += self._file.get_frame_count()
+        if self._spill is not None:
+            count += self._spill.get_record_frame_count()
+        return count
+
+    def get_record_size(self):
+        """取得錄製的檔案大小"""
+        if self._file:
+            return self._file.get_size()
+        return 0
+
+    def get_dropped_frames(self):
+        """取得捨棄的影格陣列"""
+        return self._dropped_frames
+
+    def get_write_status(self):
+        """取得寫入狀態，包含錄製佇列與寫入緩衝的深度"""
+        status = {
+            'record_queue': self._queue.qsize(),
+            'dropped_frames_count': len(self._dropped_frames)
+        }
+        if self._file:
+            status.update(self._file.get_write_status())
+        return status
 
     def add_task(self, current_frame, camera_image):
         """將圖像放入錄製佇列
 
-        將圖像放到錄製佇列給 recorder 寫入到硬碟
+        圖像增加緩衝參考後放到錄製佇列給 recorder 寫入到硬碟
 
         Args:
             current_frame: 目前擷取的格數
@@ -83,5 +192,29 @@ class CameraRecorder(MixThread):
             current_frame = 0
             if self._count >= 1 and camera_image is not None:
                 return
-        self._queue.put((current_frame, camera_image))
+
+        # 終止事件一定要放入佇列
+        if camera_image is None:
+            self._queue.put((current_frame, None))
+            return
+
+        camera_image.retain()
+        try:
+            self._queue.put(
+                (current_frame, camera_image), block=self._policy == 'block'
+            )
+        except queue.Full:
+            camera_image.release()
+            self._on_queue_full(current_frame, camera_image)
+            return
+
         self._count += 1
+
+    def drop_frame(self, current_frame):
+        """捨棄影格，擷取緩衝池沒有可用緩衝時使用
+
+        Args:
+            current_frame: 目前擷取的格數
+
+        """
+        self._dropped_frames.append(current_frame)
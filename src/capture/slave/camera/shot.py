@@ -1,8 +1,14 @@
 import numpy as np
 import struct
-import io
+import mmap
+import json
+import ast
+import os
+
+from utility.setting import setting
 
 from .image import CameraImage
+from .writer import CameraShotWriter
 
 
 class CameraShotFileCore:
@@ -11,7 +17,11 @@ class CameraShotFileCore:
     shot 檔案會有一個圖像檔案 4dr 跟一個資訊檔案 4dm
     4dr 是所有圖像連續寫入的檔案
     4dm 會記錄每一個影格在 4dr 的位置
-    4dm 的影格格式是: (圖像大小, 寬, 高)
+    4dm 的影格格式是: (影格號碼, 圖像大小, 寬, 高)
+
+    4dr 版本:
+        1: 每一格都是 np.save 的格式 (舊檔)
+        2: 開頭為檔頭，記錄一次 dtype 與尺寸，之後每一格都是原始 Bayer 資料
 
     Args:
         shot_file_path: shot 檔案位置
@@ -21,8 +31,18 @@ class CameraShotFileCore:
 
     binary_format = ">IIII"
     binary_size = struct.calcsize(binary_format)
+    binary_dtype = np.dtype(
+        [("frame", ">u4"), ("size", ">u4"), ("width", ">u4"), ("height", ">u4")]
+    )
     image_ext = ".4dr"
     meta_ext = ".4dm"
+    manifest_ext = ".4ds"
+
+    # 4dr 檔頭: (magic, 版本, 檔頭大小, dtype, 寬, 高)，補齊到 header_size 讓圖像對齊
+    header_magic = b"4DRS"
+    header_format = ">4sHI8sII"
+    header_size = 4096
+    file_version = 2
 
     def __init__(self, shot_file_path, file_handle):
         self._shot_file_path = shot_file_path
@@ -50,13 +70,195 @@ class CameraShotFileCore:
         """取得 shot 檔案位置"""
         return self._shot_file_path
 
+    @classmethod
+    def pack_header(cls, dtype, width, height):
+        """產生 4dr 檔頭
 
-class CameraShotFileLoader(CameraShotFileCore):
-    """shot 檔案讀取器
+        Args:
+            dtype: 圖像資料的 numpy dtype
+            width: 圖像寬
+            height: 圖像高
+
+        """
+        header = struct.pack(
+            cls.header_format,
+            cls.header_magic,
+            cls.file_version,
+            cls.header_size,
+            np.dtype(dtype).str.encode("ascii"),
+            width,
+            height,
+        )
+        return header.ljust(cls.header_size, b"\0")
+
+    @classmethod
+    def unpack_header(cls, buffer):
+        """解析 4dr 檔頭，不是版本 2 以上的檔案回傳 None
+
+        會回傳 (版本, 檔頭大小, dtype, 寬, 高)
+
+        Args:
+            buffer: 檔案開頭的資料
+
+        """
+        if len(buffer) < struct.calcsize(cls.header_format):
+            return None
+
+        magic, version, header_size, dtype, width, height = (
+            struct.unpack_from(cls.header_format, buffer)
+        )
+        if magic != cls.header_magic:
+            return None
+
+        dtype = np.dtype(dtype.rstrip(b"\0").decode("ascii"))
+        return version, header_size, dtype, width, height
+
+
+def get_missing_intervals(frames):
+    """找出影格編號中間遺失的區段
+
+    排序後相鄰編號相差超過 1 的地方即為遺失區段
+
+    Args:
+        frames: 影格編號陣列
+
+    Returns:
+        遺失區段的陣列 [(開始, 結束), ...]，包含開始與結束
+
+    """
+    frames = np.unique(np.asarray(frames, dtype=np.int64))
+    gaps = np.flatnonzero(np.diff(frames) > 1)
+    return [
+        (int(start), int(end))
+        for start, end in zip(frames[gaps] + 1, frames[gaps + 1] - 1)
+    ]
+
+
+def make_record_report(frames, size):
+    """產生錄製報告
+
+    遺失格數以區段表示，避免長時間錄製時報告過大
+    沒有寫入任何影格時 (例如一開始就停止或全部捨棄)，frame_range 為 None
+
+    Args:
+        frames: 寫入的影格編號陣列的陣列
+        size: 寫入的總大小
+
+    """
+    frames = np.concatenate(
+        [np.asarray(f, dtype=np.int64) for f in frames] +
+        [np.empty(0, dtype=np.int64)]
+    )
+
+    if len(frames) == 0:
+        return {
+            "missing_frames": [],
+            "frame_range": None,
+            "size": size,
+        }
+
+    return {
+        "missing_frames": get_missing_intervals(frames),
+        "frame_range": (int(frames.min()), int(frames.max())),
+        "size": size,
+    }
+
+
+class CameraShotFrameLog:
+    """寫入的影格編號紀錄
+
+    使用預先配置的陣列紀錄，空間不夠時加倍，避免 Python list 的物件開銷
+
+    Args:
+        capacity: 初始容量
+
+    """
+
+    def __init__(self, capacity=1024):
+        self._frames = np.empty(capacity, dtype=np.int64)
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def append(self, frame):
+        """加入影格編號"""
+        if self._count == len(self._frames):
+            frames = np.empty(len(self._frames) * 2, dtype=np.int64)
+            frames[:self._count] = self._frames
+            self._frames = frames
+
+        self._frames[self._count] = frame
+        self._count += 1
+
+    def get_array(self):
+        """取得影格編號陣列"""
+        return self._frames[:self._count]
+
+
+class CameraShotFrameIndex:
+    """影格號碼索引
+
+    影格號碼通常是連續的，用陣列做 O(1) 查找
+    號碼跨度超過影格數的倍數時，改用字典，避免索引陣列過大
+    重複的影格以最後的為準
+
+    Args:
+        frames: 影格號碼陣列
+        values: 對應的數值陣列 (非負整數)
+
+    """
+
+    span_ratio = 4  # 改用字典的跨度倍數
+
+    def __init__(self, frames, values):
+        frames = np.asarray(frames, dtype=np.int64)
+        values = np.asarray(values, dtype=np.int64)
+        self._lookup = None  # 索引陣列或字典
+        self._first_frame = 0  # 索引陣列的起始影格
+
+        if len(frames) == 0:
+            self._lookup = {}
+            return
+
+        first_frame = int(frames.min())
+        span = int(frames.max()) - first_frame + 1
+
+        if span > len(frames) * self.span_ratio:
+            self._lookup = dict(zip(frames.tolist(), values.tolist()))
+            return
+
+        lookup = np.full(span, -1, dtype=np.int64)
+        lookup[frames - first_frame] = values
+        self._lookup = lookup
+        self._first_frame = first_frame
+
+    def get(self, frame):
+        """取得影格對應的數值，找不到回傳 None
+
+        Args:
+            frame: 影格號碼
+
+        """
+        if isinstance(self._lookup, dict):
+            return self._lookup.get(frame, None)
+
+        index = frame - self._first_frame
+        if not 0 <= index < len(self._lookup):
+            return None
+
+        value = int(self._lookup[index])
+        if value < 0:
+            return None
+        return value
+
+
+class CameraShotFileReader(CameraShotFileCore):
+    """shot 單一檔案讀取器
 
     根據影格資訊讀取圖像
-    初始化時會先將資訊全部讀出來整理到 self._frames
-    之後再用 load 去讀取圖像
+    初始化時會將 4dm 一次讀成 numpy 結構陣列並建立影格索引
+    4dr 則以 mmap 映射，load 時直接回傳該片段的 numpy view，不做額外複製
 
     Args:
         shot_file_path: shot 檔案位置
@@ -67,49 +269,168 @@ class CameraShotFileLoader(CameraShotFileCore):
         super().__init__(shot_file_path, "rb")
         self._log = log
         self._log.info(f"File read: {self._shot_file_path}")
-        self._frames = {}  # {影格號碼: (圖像在檔案的位置, 圖像大小, 寬, 高)}
         self._rotation = rotation
+        self._records = None  # 4dm 結構陣列 (影格號碼, 圖像大小, 寬, 高)
+        self._offsets = None  # 每一格圖像在 4dr 的位置
+        self._index = None  # 影格號碼 -> 列索引
+        self._image_map = None  # 4dr 的 mmap
+        self._version = 1  # 4dr 版本
+        self._dtype = None  # 版本 2 的圖像 dtype
+        self._npy_headers = {}  # npy 標頭快取 {標頭: (dtype, shape)}
 
         # 先取得資訊
         self._load_metadata()
+        self._map_image_file()
 
     def _load_metadata(self):
-        """讀取影格資訊檔案整理出所有影格資訊"""
-        file_cursor = 0
+        """讀取影格資訊檔案整理出所有影格資訊
 
-        while True:
-            # 讀取特定 size
-            raw_meta = self._meta_file.read(self.binary_size)
+        4dm 為固定長度的紀錄，一次讀成結構陣列
+        如果最後一筆長度不足就捨棄，可能是檔案儲存到一半
 
-            # 如果讀取的長度錯誤的話即中斷，可能是檔案儲存到一半
-            if len(raw_meta) < self.binary_size:
-                break
-
-            # 取得資訊，file_cursor 就是檔案游標位置，不斷增加
-            frame, image_size, w, h = struct.unpack(
-                self.binary_format, raw_meta
-            )
-            self._frames[frame] = (file_cursor, image_size, w, h)
-            file_cursor += image_size
+        """
+        meta_size = os.fstat(self._meta_file.fileno()).st_size
+        count = meta_size // self.binary_dtype.itemsize
+        records = np.fromfile(
+            self._meta_file, dtype=self.binary_dtype, count=count
+        )
 
         # If no frames are found, log an error
-        if len(self._frames) == 0:
+        if len(records) == 0:
             self._log.error(f"No frames found in {self._shot_file_path}")
             return
 
-        frames = list(self._frames.keys())
+        # 圖像在 4dr 內是連續寫入，位置即為前面所有大小的累加
+        sizes = records["size"].astype(np.int64)
+        offsets = np.zeros(len(records), dtype=np.int64)
+        np.cumsum(sizes[:-1], out=offsets[1:])
+
+        self._records = records
+        self._offsets = offsets
+        self._index = CameraShotFrameIndex(
+            records["frame"], np.arange(len(records))
+        )
+
         self._log.info(
             "{} frames loaded ({} -> {})".format(
-                len(self._frames), frames[0], frames[-1]
+                len(records), records["frame"][0], records["frame"][-1]
             )
         )
 
+    def _map_image_file(self):
+        """將 4dr 映射到記憶體"""
+        if self._records is None:
+            return
+
+        if os.fstat(self._image_file.fileno()).st_size == 0:
+            self._log.error(f"Image file is empty: {self._shot_file_path}")
+            self._records = None
+            self._index = None
+            return
+
+        self._image_map = mmap.mmap(
+            self._image_file.fileno(), 0, access=mmap.ACCESS_READ
+        )
+
+        # 有檔頭的新格式，圖像位置要往後推檔頭大小
+        header = self.unpack_header(self._image_map[:self.header_size])
+        if header is not None:
+            self._version, header_size, self._dtype, _, _ = header
+            self._offsets += header_size
+
+    def _find_row(self, frame):
+        """取得影格的列索引，找不到回傳 None
+
+        Args:
+            frame: 影格號碼
+
+        """
+        if self._index is None or self._image_map is None:
+            return None
+
+        return self._index.get(frame)
+
+    def get_frame_location(self, frame):
+        """取得影格片段在 4dr 的位置與大小，找不到回傳 None
+
+        Args:
+            frame: 影格號碼
+
+        """
+        row = self._find_row(frame)
+        if row is None:
+            return None
+
+        return int(self._offsets[row]), int(self._records[row][1])
+
+    def get_frames(self):
+        """取得檔案內所有的影格號碼陣列"""
+        if self._index is None:
+            return np.zeros(0, dtype=np.int64)
+        return self._records["frame"].astype(np.int64)
+
+    def _read_npy_payload(self, offset, size):
+        """取得 np.save 格式片段的圖像 view
+
+        只解析 npy 的標頭找出資料起點，資料本身直接從 mmap 做 view
+
+        Args:
+            offset: 片段在 4dr 的位置
+            size: 片段大小
+
+        """
+        image_map = self._image_map
+
+        # npy 格式: magic(6) + 版本(2) + 標頭長度(1.0 版 2 bytes，之後 4 bytes)
+        if image_map[offset + 6] == 1:
+            header_start = offset + 10
+            (header_length,) = struct.unpack_from("<H", image_map, offset + 8)
+        else:
+            header_start = offset + 12
+            (header_length,) = struct.unpack_from("<I", image_map, offset + 8)
+
+        header = image_map[header_start:header_start + header_length]
+        if header not in self._npy_headers:
+            header_dict = ast.literal_eval(header.decode("latin1"))
+            self._npy_headers[header] = (
+                np.dtype(header_dict["descr"]),
+                header_dict["shape"],
+            )
+        dtype, shape = self._npy_headers[header]
+
+        data_offset = header_start + header_length
+        count = int(np.prod(shape))
+        if data_offset + count * dtype.itemsize > offset + size:
+            raise ValueError("npy payload exceeds frame record")
+
+        data = np.frombuffer(
+            image_map, dtype=dtype, count=count, offset=data_offset
+        )
+        return data.reshape(shape)
+
+    def _read_raw_payload(self, offset, size, width, height):
+        """取得原始格式片段的圖像 view
+
+        Args:
+            offset: 片段在 4dr 的位置
+            size: 片段大小
+            width: 圖像寬
+            height: 圖像高
+
+        """
+        data = np.frombuffer(
+            self._image_map,
+            dtype=self._dtype,
+            count=size // self._dtype.itemsize,
+            offset=offset,
+        )
+        return data.reshape((height, width))
+
     def load(self, frame):
         """讀取圖像
 
         讀取特定影格的圖像，回傳 CameraImage
-        讀取方式是藉由影格資訊去找到該區段在檔案的位置
-        只讀該片段轉成假 file 檔去讀出來
+        藉由影格索引找到該片段在 mmap 的位置，圖像資料為 mmap 的 view
 
         Args:
             frame: 想讀取的影格數
@@ -118,30 +439,139 @@ class CameraShotFileLoader(CameraShotFileCore):
         if frame is None:
             return
 
-        if frame not in self._frames:
+        row = self._find_row(frame)
+        if row is None:
             self._log.error(
                 f"Can't find frame {frame} in {self._shot_file_path}"
             )
             return None
 
         # 取得資訊
-        file_cursor, image_size, w, h = self._frames[frame]
+        _, image_size, w, h = self._records[row]
+        file_cursor = int(self._offsets[row])
+        image_size, w, h = int(image_size), int(w), int(h)
 
-        # 讀取片段
-        self._image_file.seek(file_cursor)
-        image_bytes = self._image_file.read(image_size)
-        f = io.BytesIO(image_bytes)
+        # 檔案儲存到一半的情況，片段不完整
+        if file_cursor + image_size > len(self._image_map):
+            self._log.error(
+                f"Frame {frame} is incomplete in {self._shot_file_path}"
+            )
+            return None
 
         # 讀取圖像
-        data = np.load(f, allow_pickle=False, fix_imports=False)
+        if self._version >= 2:
+            data = self._read_raw_payload(file_cursor, image_size, w, h)
+        else:
+            data = self._read_npy_payload(file_cursor, image_size)
 
         return CameraImage(data, w, h, self._rotation)
 
+    def _close(self):
+        """關閉 mmap，還有圖像 view 在使用時交給 GC 回收"""
+        if self._image_map is None:
+            return
+
+        try:
+            self._image_map.close()
+        except BufferError:
+            self._log.debug(
+                f"Image views still in use: {self._shot_file_path}"
+            )
+        self._image_map = None
+
+
+class CameraShotFileLoader:
+    """shot 檔案讀取器
+
+    一個 shot 可能由多個檔案組成 (主要檔案與錄製時的溢出檔案)
+    每個檔案由 CameraShotFileReader 讀取，這裡合併各檔案的影格索引
+
+    Args:
+        shot_file_path: shot 檔案位置，多個檔案時為 tuple
+
+    """
+
+    def __init__(self, shot_file_path, rotation, log):
+        self._shot_file_path = shot_file_path
+        self._log = log
+
+        if isinstance(shot_file_path, str):
+            part_paths = (shot_file_path,)
+        else:
+            part_paths = tuple(shot_file_path)
+
+        self._readers = [
+            CameraShotFileReader(part_path, rotation, log)
+            for part_path in part_paths
+        ]
+
+        # 影格號碼 -> 所屬的 reader
+        frames = [reader.get_frames() for reader in self._readers]
+        parts = [
+            np.full(len(part_frames), i, dtype=np.int64)
+            for i, part_frames in enumerate(frames)
+        ]
+        self._index = CameraShotFrameIndex(
+            np.concatenate(frames), np.concatenate(parts)
+        )
+
+    def load(self, frame):
+        """讀取圖像
+
+        找到影格所在的檔案後交給該檔案的 reader 讀取，回傳 CameraImage
+
+        Args:
+            frame: 想讀取的影格數
+
+        """
+        if frame is None:
+            return
+
+        part = self._index.get(frame)
+        if part is None:
+            self._log.error(
+                f"Can't find frame {frame} in {self._shot_file_path}"
+            )
+            return None
+
+        return self._readers[part].load(frame)
+
+    def get_frame_source(self, frame):
+        """取得影格的來源，用來辨識輸出的圖像是否來自同一份資料
+
+        Args:
+            frame: 影格數
+
+        Returns:
+            (檔案路徑, 片段位置, 片段大小)，找不到回傳 None
+
+        """
+        part = self._index.get(frame)
+        if part is None:
+            return None
+
+        location = self._readers[part].get_frame_location(frame)
+        if location is None:
+            return None
+
+        return (self._readers[part].get_path(), *location)
+
+    def close(self):
+        """關閉所有檔案"""
+        for reader in self._readers:
+            reader.close()
+
+    def get_path(self):
+        """取得 shot 檔案位置"""
+        return self._shot_file_path
+
 
 class CameraShotFileDumper(CameraShotFileCore):
     """shot 檔案寫入器
 
     將檔案寫入到硬碟，並同時產生影格資訊檔
+    寫入第一格時會先寫入檔頭，之後每格只寫原始資料，不再做 np.save 序列化
+    實際的寫入交給 CameraShotWriter 批次處理
     另外會記錄寫入的編號，在結束寫入時產生報告，以查看有沒有遺失的影格
 
     Args:
@@ -153,7 +583,9 @@ class CameraShotFileDumper(CameraShotFileCore):
         super().__init__(shot_file_path, "wb")
         self._log = log
         self._log.info(f"File write: {self._shot_file_path}")
-        self._frames = []  # 寫入的影格編號陣列
+        self._frames = CameraShotFrameLog()  # 寫入的影格編號
+        self._writer = None  # CameraShotWriter，第一格寫入時建立
+        self._size = 0  # 寫入的總大小
 
     def dump(self, frame, camera_image):
         """寫入
@@ -166,45 +598,192 @@ class CameraShotFileDumper(CameraShotFileCore):
 
         """
         size = camera_image.get_size()
-        # 藉由 tell() 去算出檔案大小
-        start_cursor = self._image_file.tell()
-        camera_image.write(self._image_file)
-        image_size = self._image_file.tell() - start_cursor
+        data = np.ascontiguousarray(camera_image.get_data())
+
+        # 第一格建立寫入器並寫入檔頭
+        if self._writer is None:
+            self._writer = CameraShotWriter(
+                self._image_file, self._meta_file, data.nbytes, self._log
+            )
+            header = self.pack_header(data.dtype, *size)
+            self._writer.write(header)
+            self._size += len(header)
 
         # 包裝 binary
-        meta = struct.pack(self.binary_format, frame, image_size, *size)
-        self._meta_file.write(meta)
+        meta = struct.pack(self.binary_format, frame, data.nbytes, *size)
+        self._writer.write(data, meta, frame)
+        self._size += data.nbytes
 
         # 加入影格
         self._frames.append(frame)
 
     def _close(self):
-        """關閉時的運行，做一個 log 回報"""
+        """關閉時的運行，寫完緩衝的資料並做一個 log 回報"""
+        if self._writer is not None:
+            self._writer.close()
+
+        if len(self._frames) == 0:
+            self._log.info(f"File saved without frames: {self._shot_file_path}")
+            return
+
+        frames = self.get_frames()
         self._log.info(
             "File saved with {} frames ({}/{}): {}".format(
-                len(self._frames),
-                self._frames[0],
-                self._frames[-1],
+                len(frames),
+                frames[0],
+                frames[-1],
                 self._shot_file_path,
             )
         )
 
+    def get_frames(self):
+        """取得寫入的影格編號陣列，不包含寫入失敗的影格"""
+        frames = self._frames.get_array()
+        failed_frames = self.get_failed_frames()
+        if len(failed_frames) > 0:
+            frames = frames[~np.isin(frames, failed_frames)]
+        return frames
+
+    def get_frame_count(self):
+        """取得寫入的影格數"""
+        return len(self._frames) - len(self.get_failed_frames())
+
+    def get_failed_frames(self):
+        """取得寫入失敗的影格"""
+        if self._writer is None:
+            return []
+        return self._writer.get_failed_frames()
+
+    def get_size(self):
+        """取得寫入的總大小"""
+        return self._size
+
+    def get_write_status(self):
+        """取得寫入器的狀態"""
+        if self._writer is None:
+            return {}
+        return self._writer.get_status()
+
+    def get_report(self, extra_frames=()):
+        """取得寫入報告
+
+        Args:
+            extra_frames: 寫在其他檔案的影格編號，例如溢出檔案
+
+        """
+        return make_record_report(
+            (self.get_frames(), extra_frames), self._size
+        )
+
+
+class CameraShotStripedDumper:
+    """shot 分散寫入器
+
+    將影格以 setting.record.stripe_frames 格為一組，輪流寫到各硬碟的 CameraShotFileDumper
+    每個檔案都有自己的寫入執行緒，寫入頻寬會隨硬碟數量增加
+    第一個檔案旁會存一份 manifest (4ds) 記錄組成 shot 的所有檔案
+
+    Args:
+        part_paths: 各硬碟的 shot 檔案位置
+        log: logger
+
+    """
+
+    manifest_version = 1
+
+    def __init__(self, part_paths, log):
+        self._part_paths = tuple(part_paths)
+        self._log = log
+        self._stripe_frames = max(1, setting.record.stripe_frames)
+        self._dumpers = [
+            CameraShotFileDumper(part_path, log)
+            for part_path in self._part_paths
+        ]
+        self._count = 0  # 寫入的影格數
+
+        self._write_manifest()
+
+    def _write_manifest(self):
+        """寫入 manifest"""
+        manifest = {
+            "version": self.manifest_version,
+            "stripe_frames": self._stripe_frames,
+            "parts": list(self._part_paths),
+        }
+        manifest_path = self._part_paths[0] + CameraShotFileCore.manifest_ext
+        with open(manifest_path, "w") as f:
+            json.dump(manifest, f)
+
+    def dump(self, frame, camera_image):
+        """寫入
+
+        依照寫入的影格數決定要寫到哪一個檔案
+
+        Args:
+            frame: 影格編號
+            camera_image: CameraImage
+
+        """
+        part = (self._count // self._stripe_frames) % len(self._dumpers)
+        self._dumpers[part].dump(frame, camera_image)
+        self._count += 1
+
+    def close(self):
+        """關閉所有檔案"""
+        for dumper in self._dumpers:
+            dumper.close()
+
+    def get_path(self):
+        """取得 shot 檔案位置"""
+        return self._part_paths
+
     def get_frames(self):
         """取得寫入的影格編號陣列"""
-        return self._frames
+        return np.concatenate(
+            [dumper.get_frames() for dumper in self._dumpers]
+        )
+
+    def get_frame_count(self):
+        """取得寫入的影格數"""
+        return self._count - len(self.get_failed_frames())
+
+    def get_failed_frames(self):
+        """取得寫入失敗的影格"""
+        return [
+            frame for dumper in self._dumpers
+            for frame in dumper.get_failed_frames()
+        ]
 
-    def get_report(self):
-        """取得寫入報告"""
-        # 算出遺失格數
-        all_frames = [f for f in range(self._frames[0], self._frames[-1])]
-        missing_frames = list(i for i in all_frames if i not in self._frames)
+    def get_size(self):
+        """取得寫入的總大小"""
+        return sum(dumper.get_size() for dumper in self._dumpers)
+
+    def get_write_status(self):
+        """取得寫入器的狀態，合併所有檔案的寫入器"""
+        statuses = [dumper.get_write_status() for dumper in self._dumpers]
+        statuses = [status for status in statuses if status]
+        if len(statuses) == 0:
+            return {}
 
         return {
-            "missing_frames": missing_frames,
-            "frame_range": (self._frames[0], self._frames[-1]),
-            "size": self._image_file.tell(),
+            "queue_depth": sum(s["queue_depth"] for s in statuses),
+            "flush_latency": (
+                max(s["flush_latency"][0] for s in statuses),
+                max(s["flush_latency"][1] for s in statuses),
+            ),
         }
 
+    def get_report(self, extra_frames=()):
+        """取得寫入報告
+
+        Args:
+            extra_frames: 寫在其他檔案的影格編號，例如溢出檔案
+
+        """
+        return make_record_report(
+            (self.get_frames(), extra_frames), self.get_size()
+        )
+
 
 class CameraShotMeta:
     """shot 資訊
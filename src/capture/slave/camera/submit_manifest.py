@@ -0,0 +1,192 @@
+import zlib
+import json
+import os
+
+from utility.setting import setting
+
+
+class CameraSubmitManifest:
+    """發佈紀錄
+
+    每台相機每個發佈資料夾一份，存在 slave 的 shot 檔案旁，不會混進發佈的輸出
+    記錄每張發佈圖像的來源片段、JPEG 品質、旋轉與輸出的大小和 crc32
+    重新發佈重疊的影格範圍時，來源、設定與大小都相同的圖像就略過
+    setting.submit_verify_crc 大於 0 時，每幾張略過的圖像抽一張讀檔比對 crc32
+    第一次檢查時才用一次 scandir 取得資料夾內的圖像大小
+    沒有紀錄的舊圖像，以 setting.bypass_exist_size 判斷
+
+    Args:
+        manifest_path: 紀錄檔案位置
+        image_folder: 圖像資料夾
+        log: logger
+
+    """
+
+    version = 1
+
+    def __init__(self, manifest_path, image_folder, log):
+        self._manifest_path = manifest_path
+        self._image_folder = image_folder
+        self._log = log
+        self._entries = self._load()  # {圖像名稱: 紀錄}
+        self._exist_sizes = None  # {圖像名稱: 大小}，第一次檢查時才讀取
+        self._verify_interval = setting.submit_verify_crc
+        self._skip_count = 0
+        self._is_changed = False
+
+    def _load(self):
+        """讀取紀錄檔案，沒有或格式不符的話回傳空的紀錄"""
+        if not os.path.isfile(self._manifest_path):
+            return {}
+
+        try:
+            with open(self._manifest_path, 'r') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError) as error:
+            self._log.warning(
+                f'Submit manifest unreadable ({error}): {self._manifest_path}'
+            )
+            return {}
+
+        if manifest.get('version') != self.version:
+            return {}
+
+        return manifest['entries']
+
+    def _scan(self, image_folder):
+        """一次取得資料夾內所有圖像的大小"""
+        if not os.path.isdir(image_folder):
+            return {}
+
+        with os.scandir(image_folder) as it:
+            return {
+                entry.name: entry.stat().st_size
+                for entry in it if entry.is_file()
+            }
+
+    @staticmethod
+    def get_path(shot_file_path, image_folder):
+        """取得紀錄檔案位置，放在第一個 shot 檔案旁，以發佈資料夾區分
+
+        Args:
+            shot_file_path: shot 檔案位置，多個檔案時為 tuple
+            image_folder: 圖像資料夾
+
+        """
+        if not isinstance(shot_file_path, str):
+            shot_file_path = shot_file_path[0]
+        folder_hash = zlib.crc32(os.path.normpath(image_folder).encode())
+        return f'{shot_file_path}.submit_{folder_hash:08x}.json'
+
+    def _get_crc32(self, image_name):
+        """讀取已發佈圖像的 crc32，讀不到的話回傳 None"""
+        try:
+            with open(os.path.join(self._image_folder, image_name), 'rb') as f:
+                return zlib.crc32(f.read())
+        except OSError:
+            return None
+
+    def _verify_crc32(self, image_name, record):
+        """依 setting.submit_verify_crc 抽驗已發佈圖像的 crc32
+
+        Args:
+            image_name: 圖像名稱
+            record: 圖像的紀錄
+
+        Returns:
+            沒有抽到或 crc32 相同的話為 True
+
+        """
+        if self._verify_interval <= 0:
+            return True
+
+        self._skip_count += 1
+        if self._skip_count % self._verify_interval != 0:
+            return True
+
+        if self._get_crc32(image_name) != record['crc32']:
+            self._log.warning(f'Exist image crc mismatch: {image_name}')
+            return False
+        return True
+
+    @staticmethod
+    def make_entry(source, quality, rotation):
+        """產生圖像的來源紀錄
+
+        Args:
+            source: (shot 檔案路徑, 片段位置, 片段大小)
+            quality: JPEG品質
+            rotation: CameraRotation
+
+        """
+        return {
+            'source': list(source),
+            'quality': quality,
+            'rotation': rotation.value,
+        }
+
+    def is_exported(self, image_name, entry):
+        """檢查圖像是否已經發佈過
+
+        Args:
+            image_name: 圖像名稱
+            entry: make_entry 產生的來源紀錄
+
+        """
+        if self._exist_sizes is None:
+            self._exist_sizes = self._scan(self._image_folder)
+
+        exist_size = self._exist_sizes.get(image_name)
+        if exist_size is None:
+            return False
+
+        record = self._entries.get(image_name)
+
+        # 有紀錄的話，來源、設定與大小都相同就略過
+        if record is not None:
+            if record['size'] != exist_size or not all(
+                record[key] == value for key, value in entry.items()
+            ):
+                return False
+
+            return self._verify_crc32(image_name, record)
+
+        # 舊的圖像沒有紀錄，大小差不多就略過
+        size_ratio = setting.bypass_exist_size / exist_size
+        if 0.6 < size_ratio < 1.4:
+            return True
+
+        self._log.warning(
+            f'Exist image size mismatch: ({size_ratio}) {image_name}'
+        )
+        return False
+
+    def add(self, image_name, entry, jpg_data):
+        """記錄寫入的圖像
+
+        Args:
+            image_name: 圖像名稱
+            entry: make_entry 產生的來源紀錄
+            jpg_data: 寫入的 JPEG 資料
+
+        """
+        self._entries[image_name] = {
+            **entry,
+            'size': len(jpg_data),
+            'crc32': zlib.crc32(jpg_data),
+        }
+        if self._exist_sizes is not None:
+            self._exist_sizes[image_name] = len(jpg_data)
+        self._is_changed = True
+
+    def save(self):
+        """有變更的話寫入紀錄檔案"""
+        if not self._is_changed:
+            return
+
+        os.makedirs(os.path.dirname(self._manifest_path), exist_ok=True)
+        temp_path = self._manifest_path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump({'version': self.version, 'entries': self._entries}, f)
+        os.replace(temp_path, self._manifest_path)
+        self._is_changed = False
@@ -0,0 +1,208 @@
+import queue
+import mmap
+import time
+
+from utility.mix_thread import MixThread
+from utility.setting import setting
+
+
+class CameraShotWriter(MixThread):
+    """shot 延遲寫入器
+
+    影格先複製進對齊的大緩衝區，緩衝滿了才交給執行緒一次寫入硬碟
+    每次寫入是 write_buffer_frames 格的資料加上對應的 4dm 紀錄
+    錄製執行緒只做記憶體複製，寫入的系統呼叫集中在這裡
+    寫入失敗時檔案退回上次成功的位置，該次寫入的影格記為失敗，由 recorder 列為捨棄
+
+    Args:
+        image_file: 4dr file object
+        meta_file: 4dm file object
+        frame_size: 每格圖像大小
+        log: logger
+
+    """
+
+    alignment = mmap.PAGESIZE  # 緩衝區對齊大小
+
+    def __init__(self, image_file, meta_file, frame_size, log):
+        super().__init__()
+        self._image_file = image_file  # 4dr file object
+        self._meta_file = meta_file  # 4dm file object
+        self._log = log
+
+        # 緩衝區大小以影格數計算，並對齊到 alignment
+        capacity = frame_size * max(1, setting.record.write_buffer_frames)
+        self._capacity = self._align(capacity)
+
+        # 預先配置檔案空間的大小，0 為不配置
+        self._preallocate_size = self._align(
+            frame_size * setting.record.preallocate_frames
+        )
+        self._allocated = 0  # 已配置的檔案大小
+        self._written = 0  # 已寫入的大小
+        self._meta_written = 0  # 4dm 已寫入的大小
+        self._failed_frames = []  # 寫入失敗的影格
+
+        # 緩衝區，mmap 匿名記憶體是分頁對齊的
+        self._free_buffers = queue.Queue()  # 可用的緩衝區
+        for _ in range(max(2, setting.record.write_buffer_count)):
+            self._free_buffers.put(mmap.mmap(-1, self._capacity))
+        # 等待寫入的 (緩衝區, 大小, 4dm 紀錄, 影格, 是否為緩衝池的緩衝區)
+        self._flush_queue = queue.Queue()
+
+        # 目前填寫中的緩衝區
+        self._buffer = self._free_buffers.get()
+        self._buffer_used = 0
+        self._buffer_meta = bytearray()
+        self._buffer_frames = []
+
+        # 寫入延遲統計
+        self._flush_count = 0
+        self._flush_time_total = 0.0
+        self._flush_time_max = 0.0
+
+        self.start()
+
+    def _align(self, size):
+        """將大小對齊到 alignment"""
+        return -(-size // self.alignment) * self.alignment
+
+    def _run(self):
+        while True:
+            task = self._flush_queue.get()
+
+            if task is None:
+                break
+
+            buffer, size, meta, frames, is_pooled = task
+            start_time = time.perf_counter()
+
+            try:
+                self._preallocate(self._written + size)
+                self._write_all(self._image_file, memoryview(buffer)[:size])
+                self._write_all(self._meta_file, meta)
+                self._written += size
+                self._meta_written += len(meta)
+            except OSError as error:
+                self._log.error(f'Shot write error: {error}')
+                self._failed_frames.extend(frames)
+                self._rewind()
+
+            # 單筆過大的資料不是緩衝池的緩衝區，不回收
+            if is_pooled:
+                self._free_buffers.put(buffer)
+
+            # 統計
+            flush_time = time.perf_counter() - start_time
+            self._flush_count += 1
+            self._flush_time_total += flush_time
+            self._flush_time_max = max(self._flush_time_max, flush_time)
+
+    def _rewind(self):
+        """寫入失敗時，檔案位置退回上次成功寫入的結尾"""
+        try:
+            self._image_file.seek(self._written)
+            self._meta_file.seek(self._meta_written)
+            self._meta_file.truncate(self._meta_written)
+        except OSError as error:
+            self._log.error(f'Shot rewind error: {error}')
+
+    @staticmethod
+    def _write_all(file, data):
+        """寫入全部資料，無緩衝的檔案可能只寫入一部分"""
+        view = memoryview(data)
+        written = 0
+        while written < len(view):
+            written += file.write(view[written:])
+
+    def _preallocate(self, size):
+        """檔案大小不夠寫入時，一次往後配置 preallocate_size 的空間"""
+        if self._preallocate_size == 0 or size <= self._allocated:
+            return
+
+        self._allocated = self._align(size) + self._preallocate_size
+        self._image_file.truncate(self._allocated)
+
+    def write(self, data, meta=b'', frame=None):
+        """寫入資料
+
+        資料複製到目前的緩衝區，緩衝區不夠放時先送出去寫入
+        可用的緩衝區都在等待寫入的話會阻塞，直到硬碟跟上
+
+        Args:
+            data: 圖像資料
+            meta: 對應的 4dm 紀錄
+            frame: 影格編號，寫入失敗時回報，檔頭為 None
+
+        """
+        frames = [] if frame is None else [frame]
+        view = memoryview(data).cast('B')
+        size = len(view)
+
+        if self._buffer_used + size > self._capacity:
+            self.flush()
+
+        # 單筆資料超過緩衝區的情況，直接送出寫入
+        if size > self._capacity:
+            self._flush_queue.put(
+                (bytes(view), size, bytes(meta), frames, False)
+            )
+            return
+
+        self._buffer[self._buffer_used:self._buffer_used + size] = view
+        self._buffer_used += size
+        self._buffer_meta += meta
+        self._buffer_frames += frames
+
+    def flush(self):
+        """將目前的緩衝區送出寫入"""
+        if self._buffer_used == 0:
+            return
+
+        self._flush_queue.put((
+            self._buffer,
+            self._buffer_used,
+            bytes(self._buffer_meta),
+            self._buffer_frames,
+            True,
+        ))
+        self._buffer = self._free_buffers.get()
+        self._buffer_used = 0
+        self._buffer_meta = bytearray()
+        self._buffer_frames = []
+
+    def close(self):
+        """寫入剩餘資料並結束，將預先配置的檔案空間截掉"""
+        self.flush()
+        self._flush_queue.put(None)
+        self.join()
+
+        if self._allocated > self._written:
+            self._image_file.truncate(self._written)
+
+        while not self._free_buffers.empty():
+            self._free_buffers.get().close()
+        self._buffer.close()
+
+    def get_failed_frames(self):
+        """取得寫入失敗的影格，close 之後才完整"""
+        return self._failed_frames
+
+    def get_status(self):
+        """取得寫入狀態
+
+        queue_depth: 等待寫入的緩衝區數量
+        flush_latency: 平均跟最長的寫入時間 (ms)
+
+        """
+        average = 0.0
+        if self._flush_count > 0:
+            average = self._flush_time_total / self._flush_count
+
+        return {
+            'queue_depth': self._flush_queue.qsize(),
+            'flush_latency': (
+                round(average * 1000, 2),
+                round(self._flush_time_max * 1000, 2)
+            ),
+        }
@@ -54,12 +54,16 @@ class BodyMode(Enum):
 
 
 class CameraState(Enum):
-    """相機運作狀態"""
+    """相機運作狀態
 
-    CAPTURING = auto()  # 擷取中
-    STANDBY = auto()  # 等待觸發
-    CLOSE = auto()  # 已關閉擷取
-    OFFLINE = auto()
+    數值會放在訊息參數中傳送，固定寫死，只能新增不能更改
+
+    """
+
+    CAPTURING = 1  # 擷取中
+    STANDBY = 2  # 等待觸發
+    CLOSE = 3  # 已關閉擷取
+    OFFLINE = 4
 
 
 class CameraRotation(Enum):
@@ -79,6 +83,7 @@ class CameraCacheType(Enum):
 
 
 class MessageType(Enum):
+    # 傳輸用的編號固定在 Message.TYPE_IDS，新增類型時也要加上編號
     RETRIGGER = auto()
 
     LIVE_VIEW_IMAGE = auto()
@@ -109,7 +114,8 @@ class MessageType(Enum):
     # {camera_parm: (name, value)}
 
     RECORD_REPORT = auto()
-    # {camera_id, shot_id, missing_frames, frame_range, size}
+    # {camera_id, shot_id, missing_frames, frame_range, size, dropped_frames}
+    # missing_frames: [(start, end), ...]
 
     REMOVE_SHOT = auto()
     # {shot_id}
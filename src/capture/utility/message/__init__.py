@@ -6,5 +6,6 @@
 
 from .manager import MessageManager
 from .message import Message
+from .dispatcher import MessageDispatcher
 
 message_manager = MessageManager()
@@ -0,0 +1,379 @@
+import asyncio
+import queue
+
+from utility.logger import log
+from utility.define import MessageType
+
+from .message import Message
+from .node import MessageSendQueue, MessageSendNode, encode_message
+
+
+class MessageAsyncNode():
+    """asyncio 連線 node
+
+    一個連線一個 node，收發都在 event loop 上執行，不另外開執行緒
+    寄送佇列與 MessageSendNode 相同，有優先通道與合併寄送
+    連線中斷時 run 會結束，錯誤存放在 self._error
+
+    Args:
+        loop: event loop
+        reader: asyncio.StreamReader
+        writer: asyncio.StreamWriter
+        name: 連線的位址
+        put_inbox: manager 放入收件匣的 func
+
+    """
+
+    def __init__(self, loop, reader, writer, name, put_inbox):
+        self._loop = loop
+        self._reader = reader
+        self._writer = writer
+        self._name = name  # 連線的位址
+        self._put_inbox = put_inbox  # manager 放入收件匣的 func
+        self._send_queue = MessageSendQueue()  # 寄送佇列
+        self._wakeup = asyncio.Event()  # 寄送佇列有訊息的通知
+        self._codec_version = Message.LEGACY_CODEC_VERSION  # 編碼版本
+        self._compress = False  # 是否壓縮
+        self._error = None  # 連線錯誤時的放置位置
+        self._running = True
+
+    def get_error(self):
+        """取得錯誤訊息，如果沒有會回傳 None"""
+        return self._error
+
+    def get_name(self):
+        """取得連線位址"""
+        return self._name
+
+    def is_running(self):
+        return self._running
+
+    def add_send_queue(self, message):
+        """加入寄送佇列，可以從其他執行緒呼叫"""
+        self._send_queue.put(message)
+        self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def get_queue_depths(self):
+        """取得寄送佇列各通道的深度"""
+        return self._send_queue.get_depths()
+
+    def set_codec_version(self, version, compress=False):
+        """設定編碼版本，使用雙方都支援的版本
+
+        Args:
+            version: 對方支援的編碼版本
+            compress: 雙方是否都支援壓縮
+
+        """
+        version = min(version, Message.CODEC_VERSION)
+        if version != self._codec_version:
+            log.info(f'Message codec version {version} ({self._name})')
+            self._codec_version = version
+        self._compress = compress
+
+    async def run(self):
+        """收發直到連線中斷或停止"""
+        tasks = [
+            self._loop.create_task(self._receive()),
+            self._loop.create_task(self._send())
+        ]
+        try:
+            done, pending = await asyncio.wait(
+                tasks, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                if not task.cancelled() and task.exception() is not None:
+                    self._error = task.exception()
+        finally:
+            # 等收發的 task 真正結束並關閉連線，不留下未完成的 task
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self._running = False
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except OSError:
+                pass
+
+    def stop(self):
+        """停止運作，強制關閉連線，可以從其他執行緒呼叫"""
+        if not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._writer.close)
+
+    async def _receive(self):
+        """接收封包並轉換成訊息後，放到收件匣
+
+        對方關閉連線時 readexactly 會拋出 IncompleteReadError
+
+        """
+        reader = self._reader
+        while True:
+            # 取得大小資訊
+            meta = await reader.readexactly(Message.META_SIZE)
+
+            if Message.is_binary_packet(meta):
+                # 版本 2，讀取剩下的標頭
+                header = meta + await reader.readexactly(
+                    Message.HEADER_SIZE - Message.META_SIZE
+                )
+                msg_type, flags, parms_size, payload_size = (
+                    Message.unpack_header(header)
+                )
+
+                # 取得確切大小的封包
+                parms_bytes = await reader.readexactly(parms_size)
+                payload = await reader.readexactly(payload_size)
+
+                # 對方版本較新的訊息類型，讀完後略過
+                if msg_type is None:
+                    log.warning(f'[{self._name}] Unknown message type')
+                    continue
+
+                # 將封包轉換成物件
+                message = Message.load_from_binary(
+                    msg_type, flags, parms_bytes, payload
+                )
+            else:
+                message_size, payload_size = Message.unpack_meta(meta)
+
+                # 取得確切大小的封包
+                message_bytes = await reader.readexactly(message_size)
+                payload = await reader.readexactly(payload_size)
+
+                # 將封包轉換成物件
+                message = Message.load_from_bytes(message_bytes, payload)
+
+            message.set_sender(self._name)
+
+            # 握手訊息只用來決定編碼版本，不放入收件匣
+            codec_version = message.get_handshake_version()
+            if codec_version is not None:
+                self.set_codec_version(
+                    codec_version, message.is_handshake_compression()
+                )
+                continue
+
+            # 存入收件匣
+            self._put_inbox(message)
+
+    async def _send(self):
+        """等待寄送佇列，佇列裡的訊息合併後一次寫出"""
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+
+            while True:
+                buffers = []
+                batch_size = 0
+                for _ in range(MessageSendNode.BATCH_MESSAGES):
+                    if batch_size >= MessageSendNode.BATCH_BYTES:
+                        break
+                    try:
+                        message = self._send_queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    message_buffers = encode_message(
+                        message, self._codec_version, self._compress
+                    )
+                    buffers.extend(message_buffers)
+                    batch_size += sum(len(b) for b in message_buffers)
+
+                if not buffers:
+                    break
+
+                self._writer.writelines(buffers)
+                await self._writer.drain()
+
+
+class MessageAsyncNodeManager():
+    """asyncio 的 Node 管理
+
+    與 MessageNodeManager 有相同的介面，所有連線都在 MessageManager 執行緒的 event loop 上
+    斷線由各連線的 run 結束時直接通知，不需要輪詢
+
+    Args:
+        put_inbox: manager 放入收件匣的 func
+
+    """
+
+    def __init__(self, put_inbox):
+        self._nodes = {}  # 存放的 node 字典
+        self._put_inbox = put_inbox  # 從 manager 取得的收件匣
+        self._loop = None  # event loop，開始運作時建立
+        self._main_task = None  # 主要的 coroutine
+        self._writers = set()  # 所有連線的 writer，停止時確定關閉
+
+    def run(self, coro):
+        """在目前的執行緒建立 event loop 並執行到 coroutine 結束
+
+        Args:
+            coro: 主要的 coroutine
+
+        """
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._main_task = self._loop.create_task(coro)
+        try:
+            self._loop.run_until_complete(self._main_task)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self._loop.run_until_complete(self._shutdown())
+            self._loop.close()
+
+    async def _shutdown(self):
+        """取消剩下的 task (各連線的收發) 並等待結束，關閉所有連線"""
+        tasks = [
+            task for task in asyncio.all_tasks(self._loop)
+            if task is not asyncio.current_task()
+        ]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        # 還沒開始收發就被取消的連線
+        for writer in list(self._writers):
+            writer.close()
+        self._writers.clear()
+        await asyncio.sleep(0)
+
+        await self._loop.shutdown_asyncgens()
+
+    async def _serve_node(self, reader, writer):
+        """加入連線並收發到中斷為止，回傳 node"""
+        name = writer.get_extra_info('peername') or id(writer)
+        log.info(f'Connection established ({name})')
+        node = MessageAsyncNode(
+            self._loop, reader, writer, name, self._put_inbox
+        )
+
+        # 告知對方支援的編碼版本
+        node.add_send_queue(Message.make_handshake())
+
+        self._nodes[name] = node
+        try:
+            await node.run()
+        finally:
+            self._nodes.pop(name, None)
+            self._writers.discard(writer)
+        return node
+
+    def add_connection(self, conn):
+        """增加已建立的連線，可以從其他執行緒呼叫
+
+        與 MessageNodeManager.add_connection 相同，測試時可直接傳入 socketpair 的一端
+
+        Args:
+            conn: 連線的 socket
+
+        """
+        asyncio.run_coroutine_threadsafe(self._open_socket(conn), self._loop)
+
+    async def _open_socket(self, conn):
+        """將 socket 包成 stream 後開始收發"""
+        reader, writer = await asyncio.open_connection(sock=conn)
+        self._writers.add(writer)
+        self._loop.create_task(self._serve_node(reader, writer))
+
+    async def serve(self, port):
+        """master 用，聆聽連線直到停止
+
+        有連線出錯時送 SLAVE_DOWN 給自己
+
+        Args:
+            port: 聆聽的 port
+
+        """
+        async def serve_connection(reader, writer):
+            node = await self._serve_node(reader, writer)
+            error = node.get_error()
+            if error is not None:
+                log.warning(f'<{node.get_name()[0]}> {error}')
+                self._put_inbox(
+                    Message(MessageType.SLAVE_DOWN, {'node': node})
+                )
+
+        def on_connection(reader, writer):
+            # 一般函式在接受連線時立即執行，先記錄 writer，停止時才能關閉
+            self._writers.add(writer)
+            self._loop.create_task(serve_connection(reader, writer))
+
+        server = await asyncio.start_server(on_connection, '0.0.0.0', port)
+        log.info(f'Socket is Listening: {port}')
+        async with server:
+            await server.serve_forever()
+
+    async def connect(self, address, on_connected, on_disconnected):
+        """slave 用，連接 master 並在斷線後重新連接
+
+        Args:
+            address: master 位址
+            on_connected: 連接上的回調
+            on_disconnected: 斷線的回調，參數為錯誤
+
+        """
+        while True:
+            try:
+                reader, writer = await asyncio.wait_for(
+                    asyncio.open_connection(*address), 1.0
+                )
+            except (OSError, asyncio.TimeoutError):
+                await asyncio.sleep(1.0)
+                continue
+
+            self._writers.add(writer)
+            on_connected()
+            node = await self._serve_node(reader, writer)
+            on_disconnected(node.get_error())
+
+    def add_send_queue(self, message):
+        """增加訊息到寄件佇列
+
+        Args:
+            message: 要放到佇列的訊息
+
+        """
+        for node in list(self._nodes.values()):
+            node.add_send_queue(message)
+
+    def send_to(self, name, message):
+        """增加訊息到指定 node 的寄件佇列，node 不存在時回傳 False"""
+        node = self._nodes.get(name)
+        if node is None:
+            return False
+
+        node.add_send_queue(message)
+        return True
+
+    def get_all(self):
+        """取得全部的 node"""
+        return list(self._nodes.values())
+
+    def get_count(self):
+        """取得正在連線的 node數量"""
+        return len(self._nodes)
+
+    def get_queue_depths(self):
+        """取得所有寄件佇列各通道的深度總和"""
+        depths = dict.fromkeys(MessageSendQueue.LANES, 0)
+        for node in list(self._nodes.values()):
+            for lane, depth in node.get_queue_depths().items():
+                depths[lane] += depth
+        return depths
+
+    def clear(self):
+        """關閉所有連線"""
+        for node in list(self._nodes.values()):
+            node.stop()
+
+    def stop(self):
+        """關閉所有連線並停止 event loop，可以從其他執行緒呼叫"""
+        if self._loop is None or self._loop.is_closed():
+            return
+
+        for node in list(self._nodes.values()):
+            node.stop()
+
+        if self._main_task is not None:
+            self._loop.call_soon_threadsafe(self._main_task.cancel)
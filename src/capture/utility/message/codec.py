@@ -0,0 +1,154 @@
+import struct
+import numbers
+
+
+class MessageCodecError(Exception):
+    """參數無法編碼或解碼"""
+    pass
+
+
+class MessageCodec():
+    """訊息參數的二進制編碼
+
+    取代 pickle 的參數編碼，只支援固定的型別，接收端不會還原任意物件
+    每個值以一個 byte 的標籤開頭，接著是該型別的資料:
+        N: None
+        T / F: True / False
+        i: 整數 (>q)
+        f: 浮點數 (>d)
+        s: 字串 (>I 長度 + utf-8)
+        b: bytes (>I 長度 + 資料)
+        l / t: list / tuple (>I 數量 + 每個值)
+        d: dict (>I 數量 + 每組鍵值)
+
+    numpy 等有 item() 的純量會先轉成 Python 的值
+
+    """
+
+    _LENGTH = struct.Struct('>I')
+    _INT = struct.Struct('>q')
+    _FLOAT = struct.Struct('>d')
+
+    @classmethod
+    def encode(cls, value):
+        """將值編碼成 bytes
+
+        Args:
+            value: 要編碼的值
+
+        """
+        buffer = bytearray()
+        cls._encode(value, buffer)
+        return bytes(buffer)
+
+    @classmethod
+    def _encode(cls, value, buffer):
+        """將值編碼後加到 buffer"""
+        if value is None:
+            buffer += b'N'
+        elif value is True:
+            buffer += b'T'
+        elif value is False:
+            buffer += b'F'
+        elif isinstance(value, str):
+            data = value.encode('utf-8')
+            buffer += b's'
+            buffer += cls._LENGTH.pack(len(data))
+            buffer += data
+        elif isinstance(value, (bytes, bytearray, memoryview)):
+            buffer += b'b'
+            buffer += cls._LENGTH.pack(len(value))
+            buffer += value
+        elif isinstance(value, numbers.Integral):
+            try:
+                data = cls._INT.pack(int(value))
+            except struct.error:
+                raise MessageCodecError(f'Integer out of range: {value}')
+            buffer += b'i'
+            buffer += data
+        elif isinstance(value, numbers.Real):
+            buffer += b'f'
+            buffer += cls._FLOAT.pack(float(value))
+        elif isinstance(value, (list, tuple)):
+            buffer += b'l' if isinstance(value, list) else b't'
+            buffer += cls._LENGTH.pack(len(value))
+            for item in value:
+                cls._encode(item, buffer)
+        elif isinstance(value, dict):
+            buffer += b'd'
+            buffer += cls._LENGTH.pack(len(value))
+            for key, item in value.items():
+                cls._encode(key, buffer)
+                cls._encode(item, buffer)
+        elif hasattr(value, 'item'):
+            cls._encode(value.item(), buffer)
+        else:
+            raise MessageCodecError(
+                f'Unsupported type: {type(value).__name__}'
+            )
+
+    @classmethod
+    def decode(cls, data):
+        """從 bytes 解碼
+
+        Args:
+            data: 編碼過的資料
+
+        """
+        view = memoryview(data)
+        try:
+            value, offset = cls._decode(view, 0)
+        except struct.error:
+            raise MessageCodecError('Unexpected end of data')
+        if offset != len(view):
+            raise MessageCodecError('Trailing data')
+        return value
+
+    @classmethod
+    def _decode(cls, view, offset):
+        """從 offset 解碼一個值，回傳 (值, 下一個位置)"""
+        try:
+            tag = view[offset]
+        except IndexError:
+            raise MessageCodecError('Unexpected end of data')
+        offset += 1
+
+        if tag == ord('N'):
+            return None, offset
+        elif tag == ord('T'):
+            return True, offset
+        elif tag == ord('F'):
+            return False, offset
+        elif tag == ord('i'):
+            return cls._INT.unpack_from(view, offset)[0], offset + 8
+        elif tag == ord('f'):
+            return cls._FLOAT.unpack_from(view, offset)[0], offset + 8
+
+        (length,) = cls._LENGTH.unpack_from(view, offset)
+        offset += 4
+
+        if tag == ord('s') or tag == ord('b'):
+            end = offset + length
+            if end > len(view):
+                raise MessageCodecError('Unexpected end of data')
+            data = view[offset:end].tobytes()
+            if tag == ord('s'):
+                data = data.decode('utf-8')
+            return data, end
+        elif tag == ord('l') or tag == ord('t'):
+            items = []
+            for _ in range(length):
+                item, offset = cls._decode(view, offset)
+                items.append(item)
+            if tag == ord('t'):
+                items = tuple(items)
+            return items, offset
+        elif tag == ord('d'):
+            items = {}
+            for _ in range(length):
+                key, offset = cls._decode(view, offset)
+                item, offset = cls._decode(view, offset)
+                items[key] = item
+            return items, offset
+
+        raise MessageCodecError(f'Unknown tag: {tag}')
@@ -0,0 +1,118 @@
+import threading
+import time
+
+try:
+    import lz4framed
+except ImportError:
+    lz4framed = None
+
+from utility.setting import setting
+from utility.define import MessageType
+
+
+class MessageCompression():
+    """訊息的 LZ4 壓縮
+
+    版本 2 的封包可以分別壓縮參數與 payload，以標頭的 flags 標示
+    只壓縮 setting.message_compression.types 列出的訊息類型，JPEG 已經壓縮過不列入
+    小於 min_size 的片段壓縮效益低，維持原樣
+    lz4framed 是選用的模組，雙方都有安裝並在握手時確認後才會啟用
+
+    """
+
+    NAME = 'lz4'
+
+    FLAG_PARMS = 0x1  # 參數已壓縮
+    FLAG_PAYLOAD = 0x2  # payload 已壓縮
+
+    def __init__(self):
+        config = setting.message_compression
+        self._min_size = config.min_size  # 壓縮的最小大小
+        self._types = {
+            MessageType[name] for name in config.types
+        }  # 壓縮的訊息類型
+
+        # 統計
+        self._lock = threading.Lock()
+        self._raw_bytes = 0  # 壓縮前大小
+        self._compressed_bytes = 0  # 壓縮後大小
+        self._compress_time = 0.0  # 壓縮時間
+        self._decompress_time = 0.0  # 解壓縮時間
+
+    def is_available(self):
+        """是否有安裝 lz4framed"""
+        return lz4framed is not None
+
+    def get_supported(self):
+        """取得支援的壓縮方式，用於握手"""
+        return [self.NAME] if self.is_available() else []
+
+    def is_compress_type(self, msg_type):
+        """訊息類型是否要壓縮"""
+        return msg_type in self._types
+
+    def compress(self, data, flag):
+        """壓縮片段，太小或壓縮後沒有變小時維持原樣
+
+        回傳 (片段, flag)，沒有壓縮時 flag 為 0
+
+        Args:
+            data: 原始片段
+            flag: 壓縮時要設定的 flag
+
+        """
+        if len(data) < self._min_size:
+            return data, 0
+
+        start_time = time.perf_counter()
+        compressed = lz4framed.compress(data)
+        cost_time = time.perf_counter() - start_time
+
+        if len(compressed) >= len(data):
+            compressed, flag = data, 0
+
+        with self._lock:
+            self._raw_bytes += len(data)
+            self._compressed_bytes += len(compressed)
+            self._compress_time += cost_time
+
+        return compressed, flag
+
+    def decompress(self, data):
+        """解壓縮片段
+
+        Args:
+            data: 壓縮過的片段
+
+        """
+        start_time = time.perf_counter()
+        data = lz4framed.decompress(data)
+        cost_time = time.perf_counter() - start_time
+
+        with self._lock:
+            self._decompress_time += cost_time
+
+        return data
+
+    def get_stats(self):
+        """取得壓縮統計
+
+        ratio 為壓縮後與壓縮前的大小比例，時間單位為毫秒
+
+        """
+        with self._lock:
+            raw_bytes = self._raw_bytes
+            compressed_bytes = self._compressed_bytes
+            compress_time = self._compress_time
+            decompress_time = self._decompress_time
+
+        return {
+            'raw_bytes': raw_bytes,
+            'compressed_bytes': compressed_bytes,
+            'ratio': compressed_bytes / raw_bytes if raw_bytes else 1.0,
+            'compress_ms': compress_time * 1000,
+            'decompress_ms': decompress_time * 1000,
+        }
+
+
+message_compression = MessageCompression()
@@ -0,0 +1,175 @@
+import threading
+import queue
+import time
+
+from utility.logger import log
+
+
+class MessageDispatcher():
+    """訊息分派
+
+    依訊息類型把收到的訊息直接分派給註冊的處理函式，不經過主迴圈
+    每個處理函式有自己的工作執行緒，慢的處理 (例如報告蒐集) 不會卡住其他類型的訊息
+    沒有註冊的類型回傳 False，由 MessageManager 放回收件匣
+
+    """
+
+    def __init__(self):
+        self._handlers = {}  # {MessageType: MessageHandler}
+
+    def register(self, msg_types, func, name, workers=1, key=None):
+        """註冊處理函式
+
+        Args:
+            msg_types: 處理的訊息類型列表
+            func: 處理函式，參數為訊息
+            name: 處理名稱，用於統計
+            workers: 工作執行緒數量
+            key: 分配執行緒的 func，參數為訊息，相同 key 的訊息依序處理
+
+        """
+        handler = MessageHandler(func, name, workers, key)
+        for msg_type in msg_types:
+            self._handlers[msg_type] = handler
+
+    def dispatch(self, message):
+        """分派訊息，沒有對應的處理時回傳 False
+
+        Args:
+            message: 收到的訊息
+
+        """
+        handler = self._handlers.get(message.type)
+        if handler is None:
+            return False
+
+        handler.put(message)
+        return True
+
+    def get_handlers(self):
+        """取得所有處理，不重複"""
+        handlers = []
+        for handler in self._handlers.values():
+            if handler not in handlers:
+                handlers.append(handler)
+        return handlers
+
+    def get_metrics(self):
+        """取得各處理的統計 {名稱: 統計}"""
+        return {
+            handler.get_name(): handler.get_metrics()
+            for handler in self.get_handlers()
+        }
+
+    def stop(self):
+        """停止所有工作執行緒"""
+        for handler in self.get_handlers():
+            handler.stop()
+
+
+class MessageHandler():
+    """訊息處理
+
+    一個處理函式與它的工作執行緒，每個執行緒有自己的佇列
+    有 key 的話相同 key 的訊息分給同一個執行緒，例如同一台相機的圖像維持順序
+    沒有 key 的話依序分給各執行緒
+
+    Args:
+        func: 處理函式
+        name: 處理名稱
+        workers: 工作執行緒數量
+        key: 分配執行緒的 func
+
+    """
+
+    def __init__(self, func, name, workers, key):
+        self._func = func  # 處理函式
+        self._name = name  # 處理名稱
+        self._key = key  # 分配執行緒的 func
+        self._queues = [queue.Queue() for _ in range(workers)]  # 各執行緒的佇列
+        self._next = 0  # 沒有 key 時下一個分配的執行緒
+
+        # 統計
+        self._lock = threading.Lock()
+        self._count = 0  # 處理數量
+        self._wait_time = 0.0  # 累計排隊時間
+        self._run_time = 0.0  # 累計處理時間
+        self._max_run_time = 0.0  # 最長處理時間
+        self._errors = 0  # 錯誤數量
+
+        self._threads = [
+            threading.Thread(
+                target=self._work, args=(q,),
+                name=f'{name}-{i}', daemon=True
+            )
+            for i, q in enumerate(self._queues)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def get_name(self):
+        """取得處理名稱"""
+        return self._name
+
+    def put(self, message):
+        """將訊息放入工作執行緒的佇列"""
+        if self._key is not None:
+            index = hash(self._key(message)) % len(self._queues)
+        else:
+            index = self._next
+            self._next = (index + 1) % len(self._queues)
+
+        self._queues[index].put((time.perf_counter(), message))
+
+    def _work(self, work_queue):
+        """工作執行緒，阻塞等待佇列"""
+        while True:
+            task = work_queue.get()
+            if task is None:
+                break
+
+            put_time, message = task
+            start_time = time.perf_counter()
+            try:
+                self._func(message)
+                is_error = False
+            except Exception as error:
+                log.error(f'Message handler [{self._name}] error: {error}')
+                is_error = True
+            end_time = time.perf_counter()
+
+            run_time = end_time - start_time
+            with self._lock:
+                self._count += 1
+                self._wait_time += start_time - put_time
+                self._run_time += run_time
+                self._max_run_time = max(self._max_run_time, run_time)
+                if is_error:
+                    self._errors += 1
+
+    def get_metrics(self):
+        """取得統計
+
+        時間單位為毫秒，平均值為開始運作後的累計平均
+
+        """
+        with self._lock:
+            count = self._count
+            wait_time = self._wait_time
+            run_time = self._run_time
+            max_run_time = self._max_run_time
+            errors = self._errors
+
+        return {
+            'count': count,
+            'pending': sum(q.qsize() for q in self._queues),
+            'wait_ms': wait_time / count * 1000 if count else 0.0,
+            'run_ms': run_time / count * 1000 if count else 0.0,
+            'max_run_ms': max_run_time * 1000,
+            'errors': errors,
+        }
+
+    def stop(self):
+        """處理完佇列中的訊息後停止"""
+        for q in self._queues:
+            q.put(None)
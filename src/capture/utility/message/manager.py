@@ -9,7 +9,9 @@ from utility.logger import log
 from utility.define import MessageType
 
 from .node import MessageNodeManager
+from .aio import MessageAsyncNodeManager
 from .message import Message
+from .compression import message_compression
 
 
 class MessageManager(MixThread):
@@ -17,6 +19,7 @@ class MessageManager(MixThread):
 
     管理連線，並負責所有訊息的收發動作
     建立連線的資訊與主從判斷都來自 setting 模組
+    setting.message_transport 為 asyncio 時，所有連線都在此執行緒的 event loop 上收發
 
     """
 
@@ -24,18 +27,60 @@ class MessageManager(MixThread):
         super().__init__()
         self._address = setting.get_host_address()  # 連線地址
         self._inbox = queue.Queue()  # 收件匣
-        self._node = MessageNodeManager(self.put_inbox)  # Node 管理
+        self._is_async = setting.message_transport == 'asyncio'
+
+        # Node 管理
+        if self._is_async:
+            self._node = MessageAsyncNodeManager(self.put_inbox)
+        else:
+            self._node = MessageNodeManager(self.put_inbox)
+        self._dispatcher = None  # 訊息分派，設定後收到的訊息直接交給處理函式
+        self._routes = {}  # 路由表 {相機 ID: node 名稱}，由 CAMERA_STATUS 回報建立
 
         # 初始化後即自動執行
         self.start()
 
     def _run(self):
         """依照主從狀況去運作"""
-        if setting.is_master():
+        if self._is_async:
+            self._run_async()
+        elif setting.is_master():
             self._run_master()
         else:
             self._run_slave()
 
+    def _run_async(self):
+        """asyncio 的運作
+
+        master 聆聽連線，slave 連接 host 並在斷線後重新連接
+        斷線由連線的 coroutine 結束時直接回報，不需要輪詢
+
+        """
+        if setting.is_master():
+            coro = self._node.serve(setting.host_address.port)
+        else:
+            coro = self._node.connect(
+                self._address,
+                self._on_master_up,
+                self._on_master_down
+            )
+
+        self._node.run(coro)
+
+    def _on_master_up(self):
+        """asyncio slave 連接上 master"""
+        self.send_message(MessageType.MASTER_UP, is_local=True)
+
+    def _on_master_down(self, error):
+        """asyncio slave 與 master 斷線
+
+        Args:
+            error: 斷線的錯誤
+
+        """
+        log.warning(error)
+        self.send_message(MessageType.MASTER_DOWN, is_local=True)
+
     def _build_socket(self):
         """建立所需 socket 並回傳"""
         sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -146,8 +191,10 @@ class MessageManager(MixThread):
             self._accepter.stop()
 
     def _after_stop(self):
-        """已連線的 Nodes 也都要停下來"""
+        """已連線的 Nodes 也都要停下來，asyncio 的情況也會停止 event loop"""
         self._node.stop()
+        if self._dispatcher is not None:
+            self._dispatcher.stop()
 
     def send_message(self, msg_type, parms={}, payload=b'', is_local=False):
         """傳送訊息到 master 或 slaves
@@ -167,6 +214,43 @@ class MessageManager(MixThread):
         else:
             self.put_inbox(message)
 
+    def send_to(self, camera_id, msg_type, parms={}, payload=b''):
+        """傳送訊息到相機所在的 slave
+
+        依照路由表只傳給該相機的連線，路由表還沒有該相機時傳給全部
+
+        Args:
+            camera_id: 相機 ID
+            msg_type: 訊息類型，為 MessageType Enum
+            parms: 額外附帶參數
+            payload: 二進制邊碼，主要為圖像傳輸用
+
+        """
+        message = Message(msg_type, parms, payload)
+        name = self._routes.get(camera_id)
+        if name is not None and self._node.send_to(name, message):
+            return
+
+        # 連線已中斷，移除路由
+        if name is not None:
+            self._routes.pop(camera_id, None)
+
+        self._node.add_send_queue(message)
+
+    def _update_routes(self, message):
+        """從 slave 的 CAMERA_STATUS 回報更新路由表
+
+        Args:
+            message: CAMERA_STATUS 訊息
+
+        """
+        sender = message.get_sender()
+        if sender is None:
+            return
+
+        for camera_id in message.unpack():
+            self._routes[camera_id] = sender
+
     def send_error(self, error_message: str, require_restart=False):
         self.send_message(
             MessageType.SLAVE_ERROR,
@@ -177,10 +261,28 @@ class MessageManager(MixThread):
             }
         )
 
+    def set_dispatcher(self, dispatcher):
+        """設定訊息分派
+
+        有註冊處理的訊息不再放入收件匣，直接由 MessageDispatcher 的工作執行緒處理
+
+        Args:
+            dispatcher: MessageDispatcher
+
+        """
+        self._dispatcher = dispatcher
+
+    def get_dispatch_metrics(self):
+        """取得訊息分派各處理的統計，沒有設定分派時為空"""
+        if self._dispatcher is None:
+            return {}
+        return self._dispatcher.get_metrics()
+
     def receive_message(self):
         """查看接收訊息
 
         會回傳 Message 物件，是阻塞式調用
+        有設定分派時只會收到沒有註冊處理的訊息
 
         """
         while True:
@@ -196,6 +298,18 @@ class MessageManager(MixThread):
             message: message 物件
 
         """
+        if (
+            message.type is MessageType.CAMERA_STATUS and
+            setting.is_master()
+        ):
+            self._update_routes(message)
+
+        if (
+            self._dispatcher is not None and
+            self._dispatcher.dispatch(message)
+        ):
+            return
+
         self._inbox.put(message)
 
     def is_connected(self):
@@ -210,6 +324,14 @@ class MessageManager(MixThread):
         """取得正在連線的 node數量"""
         return self._node.get_count()
 
+    def get_queue_depths(self):
+        """取得寄件佇列各通道的深度 {control, live, bulk}"""
+        return self._node.get_queue_depths()
+
+    def get_compression_stats(self):
+        """取得訊息壓縮的大小比例與耗時"""
+        return message_compression.get_stats()
+
 
 class MessageAccepter(MixThread):
     """Message 聆聽用模組
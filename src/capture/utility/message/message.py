@@ -4,12 +4,20 @@ import copy
 
 from utility.define import MessageType
 
+from .codec import MessageCodec
+from .compression import message_compression
+
 
 class Message():
     """訊息物件，機器間交互溝通的核心
 
     訊息物件由訊息類型、參數字典檔、payload (可選，二進制編碼)構成
-    訊息傳出時，前二者會 pickle 序列化再加上 payload 來傳輸
+    封包有兩種格式:
+        版本 1 (舊版): META_FORMAT 大小資訊 + pickle 序列化的訊息物件 + payload
+        版本 2: HEADER_FORMAT 標頭 + MessageCodec 編碼的參數 + payload
+    連線時雙方先用版本 1 交換握手訊息，確認對方支援後才改用版本 2
+    版本 2 的參數與 payload 可以用 LZ4 壓縮，以標頭的 flags 標示，雙方都支援時才會使用
+    接收時以第一個 byte 判斷格式，版本 1 的第一個 byte 為訊息大小的最高位，不會是 MAGIC
 
     Args:
         msg_type: 訊息類型，為 MessageType Enum
@@ -22,31 +30,108 @@ class Message():
     META_FORMAT = '>II'
     META_SIZE = struct.calcsize(META_FORMAT)
 
+    # 版本 2 的標頭: magic, 版本, 訊息類型, flags, 參數大小, payload 大小
+    MAGIC = 0xD4
+    HEADER_FORMAT = '>BBHHII'
+    HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+    # 編碼版本
+    LEGACY_CODEC_VERSION = 1
+    CODEC_VERSION = 2
+
+    # 版本 2 標頭的訊息類型編號，固定寫死，不依 MessageType 的宣告順序
+    # 新增類型時只能加新的編號，不能更改或重複使用既有編號，否則要提高 CODEC_VERSION
+    # 收到不認識的編號 (較新版本的類型) 時略過該訊息
+    TYPE_IDS = {
+        MessageType.RETRIGGER: 1,
+        MessageType.LIVE_VIEW_IMAGE: 2,
+        MessageType.TOGGLE_LIVE_VIEW: 3,
+        MessageType.TOGGLE_RECORDING: 4,
+        MessageType.GET_SHOT_IMAGE: 5,
+        MessageType.SHOT_IMAGE: 6,
+        MessageType.SLAVE_DOWN: 7,
+        MessageType.MASTER_UP: 8,
+        MessageType.MASTER_DOWN: 9,
+        MessageType.CAMERA_STATUS: 10,
+        MessageType.CAMERA_PARM: 11,
+        MessageType.RECORD_REPORT: 12,
+        MessageType.REMOVE_SHOT: 13,
+        MessageType.SUBMIT_SHOT: 14,
+        MessageType.SUBMIT_REPORT: 15,
+        MessageType.SLAVE_ERROR: 16,
+        MessageType.SLAVE_RESTART: 17,
+    }
+    TYPES_BY_ID = {type_id: msg_type for msg_type, type_id in TYPE_IDS.items()}
+
     def __init__(self, msg_type, parms={}, payload=b''):
         self._type = msg_type  # 訊息類型
         self._parms = parms  # 參數
         self._payload = payload  # 二進制編碼
+        self._sender = None  # 寄件的 node 名稱，本地訊息為 None
 
     def __str__(self):
         return f'[{self._type.name}]: {self._parms}'
 
-    def to_packet(self):
-        """轉換成封包
+    def to_buffers(self, codec_version=LEGACY_CODEC_VERSION, compress=False):
+        """轉換成封包的各個片段
+
+        訊息傳輸前的動作，回傳 [標頭, 參數, payload]，沒有壓縮時 payload 不複製
+        版本 2 將參數編碼後加上標頭
+        版本 1 先複製一個去掉 payload 的自身物件並序列化，再用 struct 包裝大小資訊
 
-        訊息傳輸前的動作
-        先複製一個去掉 payload 的自身物件並序列化
-        再將 payload 加回去後利用 struct 包裝傳出
+        Args:
+            codec_version: 編碼版本
+            compress: 對方是否支援壓縮，只在版本 2 有效
 
         """
+        if codec_version >= self.CODEC_VERSION:
+            parms = MessageCodec.encode(self._parms)
+            payload = self._payload
+            flags = 0
+
+            # 壓縮設定的訊息類型
+            if compress and message_compression.is_compress_type(self._type):
+                parms, parms_flag = message_compression.compress(
+                    parms, message_compression.FLAG_PARMS
+                )
+                payload, payload_flag = message_compression.compress(
+                    payload, message_compression.FLAG_PAYLOAD
+                )
+                flags = parms_flag | payload_flag
+
+            header = struct.pack(
+                self.HEADER_FORMAT,
+                self.MAGIC,
+                self.CODEC_VERSION,
+                self.TYPE_IDS[self._type],
+                flags,
+                len(parms),
+                len(payload)
+            )
+            return [header, parms, payload]
+
         obj = copy.copy(self)
         obj._payload = b''
+        obj._sender = None
         msg = pickle.dumps(obj)
-        packet = struct.pack(
+        meta = struct.pack(
             self.META_FORMAT,
             len(msg),
             len(self._payload)
-        ) + msg + self._payload
-        return packet
+        )
+        return [meta, msg, self._payload]
+
+    def to_packet(self, codec_version=LEGACY_CODEC_VERSION, compress=False):
+        """轉換成封包
+
+        將 to_buffers 的片段串接成一個 bytes
+
+        Args:
+            codec_version: 編碼版本
+            compress: 對方是否支援壓縮
+
+        """
+        return b''.join(self.to_buffers(codec_version, compress))
 
     def unpack(self):
         """提取資料
@@ -101,6 +186,97 @@ class Message():
         """取得訊息類型"""
         return self._type
 
+    def get_parms(self):
+        """取得參數"""
+        return self._parms
+
+    def set_sender(self, name):
+        """設定寄件的 node 名稱，由接收的 node 設定
+
+        Args:
+            name: node 名稱
+
+        """
+        self._sender = name
+
+    def get_sender(self):
+        """取得寄件的 node 名稱，本地訊息為 None"""
+        return getattr(self, '_sender', None)
+
+    @classmethod
+    def make_handshake(cls):
+        """建立握手訊息
+
+        用舊版也認得的 MASTER_UP 附上支援的編碼版本與壓縮方式，舊版收到會直接忽略
+
+        """
+        return cls(
+            MessageType.MASTER_UP,
+            {
+                'codec_version': cls.CODEC_VERSION,
+                'compression': message_compression.get_supported()
+            }
+        )
+
+    def get_handshake_version(self):
+        """如果是握手訊息，回傳對方支援的編碼版本，不是的話回傳 None"""
+        if (
+            self._type is MessageType.MASTER_UP and
+            isinstance(self._parms, dict)
+        ):
+            return self._parms.get('codec_version')
+        return None
+
+    def is_handshake_compression(self):
+        """握手訊息中，雙方是否都支援壓縮"""
+        return (
+            message_compression.NAME in self._parms.get('compression', ()) and
+            message_compression.is_available()
+        )
+
+    @classmethod
+    def is_binary_packet(cls, meta):
+        """從封包開頭判斷是否為版本 2 的封包
+
+        Args:
+            meta: 封包開頭的 META_SIZE 個 bytes
+
+        """
+        return meta[0] == cls.MAGIC
+
+    @classmethod
+    def unpack_header(cls, header):
+        """取得版本 2 封包的標頭資訊
+
+        會回傳訊息類型、flags、參數大小與 payload 大小，不認識的訊息類型為 None
+
+        Args:
+            header: 收到的 HEADER_SIZE 個 bytes
+
+        """
+        _, _, type_id, flags, parms_size, payload_size = struct.unpack(
+            cls.HEADER_FORMAT, header
+        )
+        msg_type = cls.TYPES_BY_ID.get(type_id)
+        return msg_type, flags, parms_size, payload_size
+
+    @classmethod
+    def load_from_binary(cls, msg_type, flags, parms_bytes, payload):
+        """從版本 2 的封包建立訊息
+
+        Args:
+            msg_type: 訊息類型
+            flags: 標頭的 flags，標示壓縮過的片段
+            parms_bytes: 編碼過的參數
+            payload: 二進制邊碼，可以是 memoryview
+
+        """
+        if flags & message_compression.FLAG_PARMS:
+            parms_bytes = message_compression.decompress(parms_bytes)
+        if flags & message_compression.FLAG_PAYLOAD:
+            payload = message_compression.decompress(payload)
+        return cls(msg_type, MessageCodec.decode(parms_bytes), payload)
+
     @classmethod
     def unpack_meta(cls, meta):
         """取得封包的大小資訊
@@ -119,9 +295,17 @@ class Message():
 
         Args:
             message_bytes: 序列化的訊息物件
-            payload: 二進制邊碼
+            payload: 二進制邊碼，可以是 memoryview
 
         """
         message = pickle.loads(message_bytes)
         message._payload = payload
         return message
+
+
+# 新增 MessageType 時必須在 Message.TYPE_IDS 指定編號
+_missing_types = set(MessageType) - set(Message.TYPE_IDS)
+if _missing_types:
+    raise RuntimeError(
+        f'MessageType without wire ID: {sorted(t.name for t in _missing_types)}'
+    )
@@ -1,9 +1,31 @@
+from collections import deque
+import threading
 import queue
 
 from utility.mix_thread import MixThread
 from utility.logger import log
+from utility.define import MessageType
 
 from .message import Message
+from .codec import MessageCodecError
+
+
+def encode_message(message, codec_version, compress=False):
+    """將訊息轉換成封包片段
+
+    參數有新版不支援的型別時改用舊版
+
+    Args:
+        message: 訊息
+        codec_version: 編碼版本
+        compress: 是否壓縮
+
+    """
+    try:
+        return message.to_buffers(codec_version, compress)
+    except MessageCodecError as error:
+        log.warning(f'{error}, send as legacy packet: {message}')
+        return message.to_buffers(Message.LEGACY_CODEC_VERSION)
 
 
 class MessageNodeManager():
@@ -34,9 +56,14 @@ class MessageNodeManager():
         log.info(f'Connection established ({name})')
         send_node = MessageSendNode(conn, name)
         receive_node = MessageReceiveNode(
-            conn, name, put_inbox=self._put_inbox
+            conn, name,
+            put_inbox=self._put_inbox,
+            on_handshake=send_node.set_codec_version
         )
 
+        # 告知對方支援的編碼版本
+        send_node.add_send_queue(Message.make_handshake())
+
         self._nodes[name] = (send_node, receive_node)
 
     def get_all(self):
@@ -75,6 +102,32 @@ class MessageNodeManager():
         for pair_node in self._nodes.values():
             pair_node[0].add_send_queue(message)
 
+    def send_to(self, name, message):
+        """增加訊息到指定 node 的寄件佇列
+
+        Args:
+            name: node 名稱
+            message: 要放到佇列的訊息
+
+        Returns:
+            node 不存在時回傳 False
+
+        """
+        pair_node = self._nodes.get(name)
+        if pair_node is None:
+            return False
+
+        pair_node[0].add_send_queue(message)
+        return True
+
+    def get_queue_depths(self):
+        """取得所有寄件佇列各通道的深度總和"""
+        depths = dict.fromkeys(MessageSendQueue.LANES, 0)
+        for pair_node in self._nodes.values():
+            for lane, depth in pair_node[0].get_queue_depths().items():
+                depths[lane] += depth
+        return depths
+
     def clear(self):
         """清空連線
 
@@ -90,6 +143,117 @@ class MessageNodeManager():
             node.stop()
 
 
+class MessageSendQueue():
+    """寄件佇列
+
+    依訊息類型分成三個通道，取出時先取高優先的通道
+        control: 控制訊息，例如錄製開關、相機參數
+        live: 即時預覽、相機狀態與圖像請求
+        bulk: 大量傳輸，例如 shot 圖像與發佈進度
+    即時預覽與相機狀態只保留最新的，還在佇列中的舊訊息會被取代
+
+    """
+
+    LANES = ('control', 'live', 'bulk')
+
+    # 訊息類型對應的通道，沒有列出的都是 control
+    LANE_TYPES = {
+        MessageType.LIVE_VIEW_IMAGE: 'live',
+        MessageType.CAMERA_STATUS: 'live',
+        MessageType.GET_SHOT_IMAGE: 'live',
+        MessageType.SHOT_IMAGE: 'bulk',
+        MessageType.SUBMIT_REPORT: 'bulk',
+    }
+
+    # 只保留最新的訊息類型
+    COALESCE_TYPES = (MessageType.LIVE_VIEW_IMAGE, MessageType.CAMERA_STATUS)
+
+    def __init__(self):
+        self._lanes = {lane: deque() for lane in self.LANES}  # 各通道的佇列
+        self._pending = {}  # 等待取代的訊息 {識別 key: [訊息]}
+        self._cond = threading.Condition()
+        self._is_closed = False  # 是否已關閉，關閉後等待中的 get 會回傳 None
+
+    def _get_coalesce_key(self, message):
+        """取得訊息的取代識別 key，不需取代的回傳 None
+
+        即時預覽以相機區分，相機狀態以參數的 key 區分 (slave 回報為相機 ID)
+
+        """
+        if message.type not in self.COALESCE_TYPES:
+            return None
+
+        parms = message.get_parms()
+        if message.type is MessageType.LIVE_VIEW_IMAGE:
+            return message.type, parms.get('camera_id')
+        return message.type, tuple(parms)
+
+    def put(self, message):
+        """放入訊息
+
+        Args:
+            message: 訊息
+
+        """
+        lane = self.LANE_TYPES.get(message.type, 'control')
+        key = self._get_coalesce_key(message)
+
+        with self._cond:
+            # 取代佇列中的舊訊息
+            if key is not None and key in self._pending:
+                self._pending[key][0] = message
+                return
+
+            slot = [message]
+            if key is not None:
+                self._pending[key] = slot
+            self._lanes[lane].append((key, slot))
+            self._cond.notify()
+
+    def get(self, block=True):
+        """依優先順序取出訊息
+
+        Args:
+            block: 佇列為空時是否等待
+
+        Returns:
+            訊息，等待時佇列被關閉的話為 None
+
+        Raises:
+            queue.Empty: 不等待且佇列為空
+
+        """
+        with self._cond:
+            while True:
+                for lane in self.LANES:
+                    if self._lanes[lane]:
+                        key, slot = self._lanes[lane].popleft()
+                        if key is not None:
+                            del self._pending[key]
+                        return slot[0]
+
+                if not block:
+                    raise queue.Empty
+                if self._is_closed:
+                    return None
+                self._cond.wait()
+
+    def close(self):
+        """關閉佇列，喚醒等待中的 get"""
+        with self._cond:
+            self._is_closed = True
+            self._cond.notify_all()
+
+    def get_nowait(self):
+        """不等待取出訊息"""
+        return self.get(False)
+
+    def get_depths(self):
+        """取得各通道的深度"""
+        with self._cond:
+            return {lane: len(items) for lane, items in self._lanes.items()}
+
+
 class MessageNode(MixThread):
     """Node 元件
 
@@ -130,33 +294,129 @@ class MessageSendNode(MessageNode):
 
     繼承 MessageNode 元件，檢查自己的 self._send_queue
     一有訊息就執行寄送
+    預設用舊版編碼，收到對方的握手訊息後才改用新版
 
     """
 
+    BATCH_MESSAGES = 64  # 一次寄送的最多訊息數
+    BATCH_BYTES = 4 * 1024 * 1024  # 累積超過此大小就不再合併訊息
+    COALESCE_BYTES = 64 * 1024  # 沒有 sendmsg 時，小於此大小的片段串接後寄送
+    MAX_IOV = 512  # sendmsg 一次的最多片段數
+
     def __init__(self, sock, name):
         super().__init__(sock, name)
-        self._send_queue = queue.Queue()  # 寄送佇列
+        self._send_queue = MessageSendQueue()  # 寄送佇列
+        self._codec_version = Message.LEGACY_CODEC_VERSION  # 編碼版本
+        self._compress = False  # 是否壓縮
 
         # 初始化後即自動執行
         self.start()
 
     def _run(self):
-        """監測寄送佇列，有訊息變將其轉換成封包送出"""
+        """監測寄送佇列，有訊息變將其轉換成封包送出
+
+        佇列裡有多個訊息時一次取出，合併成一次寄送
+
+        """
         while self._running:
             message = self._send_queue.get()
 
-            packet = message.to_packet()
+            # 停止時佇列會被關閉，不再等待訊息
+            if message is None:
+                break
+
+            buffers = self._to_buffers(message)
+            batch_size = sum(len(buffer) for buffer in buffers)
+
+            # 一併取出已在佇列中的訊息
+            for _ in range(self.BATCH_MESSAGES - 1):
+                if batch_size >= self.BATCH_BYTES:
+                    break
+                try:
+                    message = self._send_queue.get_nowait()
+                except queue.Empty:
+                    break
+                message_buffers = self._to_buffers(message)
+                buffers.extend(message_buffers)
+                batch_size += sum(len(buffer) for buffer in message_buffers)
 
             try:
-                self._sock.sendall(packet)
+                self._send_buffers(buffers)
             except Exception as error:
                 self._error = error
                 self.stop()
 
+    def _stop(self):
+        """停止運作時，關閉 socket 並喚醒等待中的寄送佇列"""
+        super()._stop()
+        self._send_queue.close()
+
+    def _to_buffers(self, message):
+        """將訊息轉換成封包片段"""
+        return encode_message(
+            message, self._codec_version, self._compress
+        )
+
+    def _send_buffers(self, buffers):
+        """寄送封包片段
+
+        有 sendmsg 的平台直接分散寄送，片段不用先串接
+        沒有的話 (Windows)，小片段串接後寄送，大片段直接 sendall
+
+        Args:
+            buffers: 封包片段陣列
+
+        """
+        buffers = [memoryview(buffer) for buffer in buffers if len(buffer)]
+
+        if not hasattr(self._sock, 'sendmsg'):
+            pending = []
+            for buffer in buffers:
+                if len(buffer) >= self.COALESCE_BYTES:
+                    if pending:
+                        self._sock.sendall(b''.join(pending))
+                        pending = []
+                    self._sock.sendall(buffer)
+                else:
+                    pending.append(buffer)
+            if pending:
+                self._sock.sendall(b''.join(pending))
+            return
+
+        while buffers:
+            sent = self._sock.sendmsg(buffers[:self.MAX_IOV])
+
+            # 移除已寄送的片段，部分寄送的片段保留剩下的部分
+            while sent > 0:
+                if sent >= len(buffers[0]):
+                    sent -= len(buffers[0])
+                    buffers.pop(0)
+                else:
+                    buffers[0] = buffers[0][sent:]
+                    sent = 0
+
     def add_send_queue(self, message):
         """加入寄送佇列"""
         self._send_queue.put(message)
 
+    def get_queue_depths(self):
+        """取得寄送佇列各通道的深度"""
+        return self._send_queue.get_depths()
+
+    def set_codec_version(self, version, compress=False):
+        """設定編碼版本，使用雙方都支援的版本
+
+        Args:
+            version: 對方支援的編碼版本
+            compress: 雙方是否都支援壓縮
+
+        """
+        version = min(version, Message.CODEC_VERSION)
+        if version != self._codec_version:
+            log.info(f'Message codec version {version} ({self._name})')
+            self._codec_version = version
+        self._compress = compress
+
 
 class MessageReceiveNode(MessageNode):
     """Node 接收元件
@@ -166,12 +426,15 @@ class MessageReceiveNode(MessageNode):
 
     Args:
         put_inbox: manager 放入收件匣的 func
+        on_handshake: 收到握手訊息時呼叫，參數為對方支援的編碼版本與是否壓縮
 
     """
 
-    def __init__(self, sock, name, put_inbox):
+    def __init__(self, sock, name, put_inbox, on_handshake):
         super().__init__(sock, name)
         self._put_inbox = put_inbox  # manager 放入收件匣的 func
+        self._on_handshake = on_handshake  # 收到握手訊息的 func
+        self._header = memoryview(bytearray(Message.HEADER_SIZE))  # 標頭緩衝
 
         # 初始化後即自動執行
         self.start()
@@ -181,15 +444,48 @@ class MessageReceiveNode(MessageNode):
         while self._running:
             try:
                 # 取得大小資訊
-                meta = self._recvall(Message.META_SIZE)
-                message_size, payload_size = Message.unpack_meta(meta)
-
-                # 取得確切大小的封包
-                message_bytes = self._recvall(message_size)
-                payload = self._recvall(payload_size)
-
-                # 將封包轉換成物件
-                message = Message.load_from_bytes(message_bytes, payload)
+                meta = self._header[:Message.META_SIZE]
+                self._recv_into(meta)
+
+                if Message.is_binary_packet(meta):
+                    # 版本 2，讀取剩下的標頭
+                    self._recv_into(self._header[Message.META_SIZE:])
+                    msg_type, flags, parms_size, payload_size = (
+                        Message.unpack_header(self._header)
+                    )
+
+                    # 取得確切大小的封包
+                    parms_bytes = self._recvall(parms_size)
+                    payload = self._recvall(payload_size)
+
+                    # 對方版本較新的訊息類型，讀完後略過
+                    if msg_type is None:
+                        log.warning(f'[{self._name}] Unknown message type')
+                        continue
+
+                    # 將封包轉換成物件
+                    message = Message.load_from_binary(
+                        msg_type, flags, parms_bytes, payload
+                    )
+                else:
+                    message_size, payload_size = Message.unpack_meta(meta)
+
+                    # 取得確切大小的封包
+                    message_bytes = self._recvall(message_size)
+                    payload = self._recvall(payload_size)
+
+                    # 將封包轉換成物件
+                    message = Message.load_from_bytes(message_bytes, payload)
+
+                message.set_sender(self._name)
+
+                # 握手訊息只用來決定編碼版本，不放入收件匣
+                codec_version = message.get_handshake_version()
+                if codec_version is not None:
+                    self._on_handshake(
+                        codec_version, message.is_handshake_compression()
+                    )
+                    continue
 
                 # 存入收件匣
                 self._put_inbox(message)
@@ -197,15 +493,32 @@ class MessageReceiveNode(MessageNode):
                 self._error = error
                 self.stop()
 
+    def _recv_into(self, view):
+        """接收封包直到填滿 view
+
+        對方關閉連線時 recv 會收到 0 byte，此時拋出錯誤結束接收
+
+        Args:
+            view: 接收用的 memoryview
+
+        """
+        received = 0
+        while received < len(view):
+            size = self._sock.recv_into(view[received:])
+            if size == 0:
+                raise ConnectionResetError('Connection closed by peer')
+            received += size
+
     def _recvall(self, n):
         """接收封包到指定大小為止
 
+        依大小預先配置 bytearray 直接接收，不用反覆串接 bytes
+        回傳該 bytearray 的 memoryview，交給 Message 時不再複製
+
         Args:
             n: 封包大小
 
         """
-        data = b''
-        while len(data) < n:
-            packet = self._sock.recv(n - len(data))
-            data += packet
-        return data
+        view = memoryview(bytearray(n))
+        self._recv_into(view)
+        return view
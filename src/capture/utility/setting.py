@@ -9,6 +9,7 @@ from common.camera_structure.camera_structure import CameraStructure
 
 
 SETTINGS_YAML_PATH = Path(__file__) / '../../settings'
+SHOT_SPILL_SUFFIX = '_spill'  # 錄製溢出檔案的後綴
 
 
 class SettingManager(CameraStructure):
@@ -93,13 +94,100 @@ class SettingManager(CameraStructure):
         folder = self.record.folder_name
         return f'{drive}:/{folder}/'
 
+    def get_spill_folder_path(self, camera_index):
+        """取得錄製溢出的路徑
+
+        使用錄製硬碟的下一顆硬碟，只有一顆硬碟時回傳 None
+
+        """
+        drives = self.record.drives
+        if len(drives) < 2:
+            return None
+        drive = drives[(camera_index + 1) % len(drives)]
+        folder = self.record.folder_name
+        return f'{drive}:/{folder}/'
+
+    def get_stripe_folder_paths(self, camera_index):
+        """取得分散錄製的路徑
+
+        沒開啟分散錄製時只有錄製路徑
+        開啟的話為所有硬碟，從相機分配的硬碟開始輪流，避免相機都從同一顆開始寫
+
+        """
+        if not self.record.stripe:
+            return [self.get_record_folder_path(camera_index)]
+
+        drives = self.record.drives
+        folder = self.record.folder_name
+        return [
+            f'{drives[(camera_index + i) % len(drives)]}:/{folder}/'
+            for i in range(len(drives))
+        ]
+
+    def get_buffer_pool_frames(self):
+        """取得每台相機擷取緩衝池的影格數
+
+        以 record.memory_budget_mb 為整台 slave 的記憶體上限，平均分給每台相機
+        扣掉寫入緩衝的最大用量 (每個寫入檔案 write_buffer_frames × write_buffer_count 格，
+        分散錄製時每顆硬碟一個檔案，溢出時再加一個) 後剩下的都給緩衝池
+        錄製佇列只參考緩衝池的緩衝，不另外佔用記憶體
+
+        """
+        record = self.record
+        frame_size = self.camera_resolution[0] * self.camera_resolution[1]
+        camera_budget = (
+            record.memory_budget_mb * 1024 ** 2 //
+            self.get_slave_cameras_count()
+        )
+
+        writers = len(record.drives) if record.stripe else 1
+        if record.queue_policy == 'spill':
+            writers += 1
+        writer_frames = writers * (
+            max(1, record.write_buffer_frames) *
+            max(2, record.write_buffer_count)
+        )
+
+        return max(camera_budget // frame_size - writer_frames, 2)
+
     def get_shot_file_path(self, shot_id, camera_id):
+        """取得 shot 的檔案路徑
+
+        shot 可能由分散錄製的多個檔案與溢出檔案組成，回傳所有找到的檔案路徑 tuple
+        有 manifest (4ds) 的話依照 manifest 記錄的檔案，沒有的話搜尋每顆硬碟
+        都找不到的話回傳 None
+
+        """
         folder = self.record.folder_name
-        for drive in self.record.drives:
-            file_path = f'{drive}:/{folder}/{shot_id}/{camera_id}'
-            if os.path.isfile(file_path + '.4dr'):
-                return file_path
-        return None
+        drives = self.record.drives
+        file_paths = []
+
+        # 分散錄製的 manifest
+        for drive in drives:
+            manifest_path = f'{drive}:/{folder}/{shot_id}/{camera_id}.4ds'
+            if os.path.isfile(manifest_path):
+                with open(manifest_path, 'r') as f:
+                    manifest = json.load(f)
+                file_paths.extend(
+                    file_path for file_path in manifest['parts']
+                    if os.path.isfile(file_path + '.4dr')
+                )
+                break
+
+        # 沒有 manifest 的話逐一搜尋，溢出檔案一律用搜尋的
+        file_names = [camera_id + SHOT_SPILL_SUFFIX]
+        if len(file_paths) == 0:
+            file_names.insert(0, camera_id)
+
+        for file_name in file_names:
+            for drive in drives:
+                file_path = f'{drive}:/{folder}/{shot_id}/{file_name}'
+                if os.path.isfile(file_path + '.4dr'):
+                    file_paths.append(file_path)
+
+        if len(file_paths) == 0:
+            return None
+        return tuple(file_paths)
 
     def get_slave_cameras_count(self):
         return self.slaves[platform.node()]
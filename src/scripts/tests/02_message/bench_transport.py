@@ -0,0 +1,358 @@
+"""訊息傳輸的效能測試
+
+在本機啟動一個 master 模式的 MessageManager 與多個模擬相機連線的 slave MessageManager
+每個 slave 行程模擬一台相機的連線，重現實際的訊息組合:
+    即時預覽: 每台相機每秒 fps 張 LIVE_VIEW_IMAGE
+    索取圖像: master 定期對每台相機送出一批 GET_SHOT_IMAGE，slave 回傳 SHOT_IMAGE
+    狀態詢問: master 每 0.1 秒送出 CAMERA_STATUS，slave 回報狀態
+結束後依訊息類型列出 p50 / p99 延遲、吞吐量、編解碼的 CPU 時間，以及各行程的 CPU 使用率
+
+執行方式 (PYTHONPATH 需包含 src 與 src/capture):
+    python bench_transport.py --slaves 8 --duration 10 --transport asyncio
+
+"""
+
+import multiprocessing
+import argparse
+import threading
+import time
+import os
+
+
+def _setup(role, args):
+    """在子行程設定主從並載入訊息模組，回傳 (message_manager, MessageType, Message)"""
+    os.environ['4DREC_TYPE'] = role
+
+    from utility.setting import setting
+
+    # 改連本機，並套用測試的傳輸方式
+    setting._settings['host_address'] = {
+        'ip': '127.0.0.1', 'port': args.port
+    }
+    setting._settings['message_transport'] = args.transport
+
+    from utility.message import message_manager, Message
+    from utility.define import MessageType
+    return message_manager, MessageType, Message
+
+
+def _percentile(values, ratio):
+    """取得百分位數，沒有資料時為 None"""
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(len(values) * ratio), len(values) - 1)]
+
+
+def _measure_codec(Message, MessageType, args, iterations=200):
+    """量測各訊息類型在目前編碼下的編碼加解碼 CPU 時間 (微秒)"""
+    samples = {
+        MessageType.LIVE_VIEW_IMAGE: Message(
+            MessageType.LIVE_VIEW_IMAGE,
+            {'camera_id': 'bench_0', 'sent_at': time.time()},
+            os.urandom(args.live_size)
+        ),
+        MessageType.SHOT_IMAGE: Message(
+            MessageType.SHOT_IMAGE,
+            {'camera_id': 'bench_0', 'frame': 0, 'requested_at': time.time()},
+            os.urandom(args.shot_size)
+        ),
+        MessageType.CAMERA_STATUS: Message(
+            MessageType.CAMERA_STATUS,
+            {'bench_0': _make_status('bench_0', time.time())}
+        ),
+    }
+
+    costs = {}
+    for msg_type, message in samples.items():
+        start_time = time.process_time()
+        for _ in range(iterations):
+            header, parms, payload = message.to_buffers(
+                Message.CODEC_VERSION, args.compress
+            )
+            _, flags, _, _ = Message.unpack_header(header)
+            Message.load_from_binary(msg_type, flags, parms, payload)
+        costs[msg_type.name] = (
+            (time.process_time() - start_time) / iterations * 1e6
+        )
+    return costs
+
+
+def _make_status(camera_id, polled_at):
+    """模擬相機的狀態回報"""
+    return {
+        'state': 2,
+        'current_frame': 0,
+        'record_frames_count': 0,
+        'buffer_pool': (3, 44),
+        'send_queue': {'control': 0, 'live': 0, 'bulk': 0},
+        'camera_id': camera_id,
+        'polled_at': polled_at,
+    }
+
+
+def run_master(args, result_queue):
+    """master 行程，送出詢問並統計收到的訊息"""
+    message_manager, MessageType, Message = _setup('MASTER', args)
+
+    codec_costs = _measure_codec(Message, MessageType, args)
+
+    # 等待所有 slave 連上並回報狀態建立路由
+    while message_manager.get_nodes_count() < args.slaves:
+        time.sleep(0.1)
+
+    camera_ids = set()
+    while len(camera_ids) < args.slaves:
+        message_manager.send_message(MessageType.CAMERA_STATUS, {})
+        message = message_manager.receive_message()
+        if message.type is MessageType.CAMERA_STATUS:
+            camera_ids.update(message.get_parms())
+    camera_ids = sorted(camera_ids)
+
+    running = True
+
+    def poll_status():
+        while running:
+            message_manager.send_message(
+                MessageType.CAMERA_STATUS, {'polled_at': time.time()}
+            )
+            time.sleep(0.1)
+
+    def request_shot_images():
+        frame = 0
+        while running:
+            for camera_id in camera_ids:
+                for i in range(args.burst):
+                    message_manager.send_to(
+                        camera_id,
+                        MessageType.GET_SHOT_IMAGE,
+                        {
+                            'camera_id': camera_id,
+                            'frame': frame + i,
+                            'requested_at': time.time()
+                        }
+                    )
+            frame += args.burst
+            time.sleep(args.burst_interval)
+
+    # 開始測試
+    message_manager.send_message(
+        MessageType.TOGGLE_LIVE_VIEW, {'fps': args.fps}
+    )
+    threads = [
+        threading.Thread(target=poll_status, daemon=True),
+        threading.Thread(target=request_shot_images, daemon=True),
+    ]
+    for thread in threads:
+        thread.start()
+
+    stats = {}  # {類型名稱: {'latency': [], 'bytes': 0}}
+    start_time = time.time()
+    start_cpu = time.process_time()
+    end_time = start_time + args.duration
+
+    def stop_later():
+        time.sleep(args.duration)
+        message_manager.send_message(MessageType.MASTER_DOWN, is_local=True)
+
+    threading.Thread(target=stop_later, daemon=True).start()
+
+    while True:
+        message = message_manager.receive_message()
+        now = time.time()
+        if message.type is MessageType.MASTER_DOWN or now > end_time:
+            break
+
+        parms = message.get_parms()
+        if message.type is MessageType.LIVE_VIEW_IMAGE:
+            latency = now - parms['sent_at']
+        elif message.type is MessageType.SHOT_IMAGE:
+            latency = now - parms['requested_at']
+        elif message.type is MessageType.CAMERA_STATUS:
+            polled_at = next(iter(parms.values())).get('polled_at')
+            if polled_at is None:
+                continue
+            latency = now - polled_at
+        else:
+            continue
+
+        stat = stats.setdefault(
+            message.type.name, {'latency': [], 'bytes': 0}
+        )
+        stat['latency'].append(latency)
+        stat['bytes'] += len(message._payload)
+
+    elapsed = time.time() - start_time
+    cpu = time.process_time() - start_cpu
+    running = False
+
+    # 通知 slave 結束
+    message_manager.send_message(MessageType.MASTER_DOWN)
+    time.sleep(0.5)
+
+    result_queue.put({
+        'role': 'master',
+        'elapsed': elapsed,
+        'cpu': cpu,
+        'codec_us': codec_costs,
+        'stats': {
+            name: {
+                'count': len(stat['latency']),
+                'p50': _percentile(stat['latency'], 0.5),
+                'p99': _percentile(stat['latency'], 0.99),
+                'bytes': stat['bytes'],
+            }
+            for name, stat in stats.items()
+        },
+        'compression': message_manager.get_compression_stats(),
+    })
+    message_manager.stop()
+
+
+def run_slave(args, index, result_queue):
+    """slave 行程，模擬一台相機的即時預覽、圖像回傳與狀態回報"""
+    message_manager, MessageType, Message = _setup('SLAVE', args)
+
+    camera_id = f'bench_{index}'
+    live_payload = os.urandom(args.live_size)
+    shot_payload = os.urandom(args.shot_size)
+    sent = {}  # {類型名稱: 數量}
+    live_view = threading.Event()
+    running = True
+
+    def count(msg_type):
+        sent[msg_type.name] = sent.get(msg_type.name, 0) + 1
+
+    def send_live_view():
+        interval = 1.0 / args.fps
+        live_view.wait()
+        next_time = time.time()
+        while running:
+            message_manager.send_message(
+                MessageType.LIVE_VIEW_IMAGE,
+                {'camera_id': camera_id, 'sent_at': time.time()},
+                live_payload
+            )
+            count(MessageType.LIVE_VIEW_IMAGE)
+            next_time += interval
+            time.sleep(max(next_time - time.time(), 0))
+
+    threading.Thread(target=send_live_view, daemon=True).start()
+
+    start_cpu = None
+    while True:
+        message = message_manager.receive_message()
+
+        if message.type is MessageType.TOGGLE_LIVE_VIEW:
+            start_cpu = time.process_time()
+            live_view.set()
+
+        elif message.type is MessageType.GET_SHOT_IMAGE:
+            parms = message.get_parms()
+            message_manager.send_message(
+                MessageType.SHOT_IMAGE,
+                {
+                    'camera_id': camera_id,
+                    'frame': parms['frame'],
+                    'requested_at': parms['requested_at']
+                },
+                shot_payload
+            )
+            count(MessageType.SHOT_IMAGE)
+
+        elif message.type is MessageType.CAMERA_STATUS:
+            polled_at = message.get_parms().get('polled_at')
+            message_manager.send_message(
+                MessageType.CAMERA_STATUS,
+                {camera_id: _make_status(camera_id, polled_at)}
+            )
+            count(MessageType.CAMERA_STATUS)
+
+        elif message.type is MessageType.MASTER_DOWN:
+            break
+
+    running = False
+    result_queue.put({
+        'role': 'slave',
+        'cpu': time.process_time() - (start_cpu or 0),
+        'sent': sent,
+    })
+    message_manager.stop()
+
+    # 送出結果後直接結束，不等待模擬用的執行緒
+    result_queue.close()
+    result_queue.join_thread()
+    os._exit(0)
+
+
+def print_report(args, master, slaves):
+    """輸出測試結果"""
+    elapsed = master['elapsed']
+    sent = {}
+    for slave in slaves:
+        for name, value in slave['sent'].items():
+            sent[name] = sent.get(name, 0) + value
+
+    print(
+        f'transport={args.transport} slaves={args.slaves} '
+        f'duration={elapsed:.1f}s compress={args.compress}'
+    )
+    print(
+        f'{"type":<16}{"sent":>8}{"recv":>8}{"msg/s":>9}{"MB/s":>8}'
+        f'{"p50 ms":>9}{"p99 ms":>9}{"codec us":>10}'
+    )
+    for name, stat in sorted(master['stats'].items()):
+        p50 = stat['p50'] * 1000 if stat['p50'] is not None else 0
+        p99 = stat['p99'] * 1000 if stat['p99'] is not None else 0
+        print(
+            f'{name:<16}{sent.get(name, 0):>8}{stat["count"]:>8}'
+            f'{stat["count"] / elapsed:>9.1f}'
+            f'{stat["bytes"] / elapsed / 1e6:>8.1f}'
+            f'{p50:>9.2f}{p99:>9.2f}'
+            f'{master["codec_us"].get(name, 0):>10.1f}'
+        )
+
+    slave_cpu = sum(slave['cpu'] for slave in slaves) / len(slaves)
+    print(f'master cpu: {master["cpu"] / elapsed * 100:.1f}%')
+    print(f'slave cpu (avg): {slave_cpu / elapsed * 100:.1f}%')
+    print(f'compression: {master["compression"]}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='utility.message benchmark')
+    parser.add_argument('--slaves', type=int, default=8, help='模擬的相機連線數')
+    parser.add_argument('--duration', type=float, default=10.0, help='測試秒數')
+    parser.add_argument('--transport', default='thread', choices=('thread', 'asyncio'))
+    parser.add_argument('--port', type=int, default=64199)
+    parser.add_argument('--fps', type=int, default=30, help='即時預覽每秒張數')
+    parser.add_argument('--live-size', type=int, default=20000, help='即時預覽圖像大小')
+    parser.add_argument('--shot-size', type=int, default=400000, help='索取圖像大小')
+    parser.add_argument('--burst', type=int, default=10, help='每批索取的圖像數')
+    parser.add_argument('--burst-interval', type=float, default=1.0, help='每批索取的間隔秒數')
+    parser.add_argument('--compress', action='store_true', help='編解碼量測包含壓縮')
+    args = parser.parse_args()
+
+    result_queue = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(target=run_master, args=(args, result_queue))
+    ]
+    processes += [
+        multiprocessing.Process(
+            target=run_slave, args=(args, i, result_queue), daemon=True
+        )
+        for i in range(args.slaves)
+    ]
+    for process in processes:
+        process.start()
+
+    results = [result_queue.get() for _ in processes]
+    master = next(r for r in results if r['role'] == 'master')
+    slaves = [r for r in results if r['role'] == 'slave']
+    print_report(args, master, slaves)
+
+    for process in processes:
+        process.join(2)
+
+
+if __name__ == '__main__':
+    main()
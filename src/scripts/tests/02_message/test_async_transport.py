@@ -0,0 +1,89 @@
+"""asyncio 傳輸測試
+
+asyncio 端與執行緒端以 socketpair 相連，不連線到 master 也不需要網路
+只載入 utility.message 的子模組，不建立套件層級的 message_manager 單例，
+否則單例的執行緒會一直嘗試連線 setting.host_address，測試無法結束
+
+執行方式 (PYTHONPATH 需包含 src 與 src/capture):
+    python test_async_transport.py
+
+"""
+
+import socket
+import threading
+import asyncio
+import queue
+import types
+import time
+import sys
+import os
+
+os.environ.setdefault('4DREC_TYPE', 'SLAVE')
+
+# 以空的套件取代 utility.message，略過 __init__ 建立的 message_manager
+import utility
+
+message_package = types.ModuleType('utility.message')
+message_package.__path__ = [
+    os.path.join(path, 'message') for path in utility.__path__
+]
+sys.modules['utility.message'] = message_package
+
+from utility.message.aio import MessageAsyncNodeManager
+from utility.message.node import MessageNodeManager
+from utility.message.message import Message
+from utility.define import MessageType
+
+
+# asyncio 端與執行緒端以 socketpair 相連
+async_inbox = queue.Queue()
+thread_inbox = queue.Queue()
+async_manager = MessageAsyncNodeManager(async_inbox.put)
+thread_manager = MessageNodeManager(thread_inbox.put)
+
+loop_thread = threading.Thread(
+    target=async_manager.run, args=(asyncio.sleep(3600),), daemon=True
+)
+loop_thread.start()
+
+while async_manager._loop is None or not async_manager._loop.is_running():
+    time.sleep(0.01)
+
+sock_a, sock_b = socket.socketpair()
+async_manager.add_connection(sock_a)
+thread_manager.add_connection(sock_b)
+
+# 執行緒端 -> asyncio 端
+thread_manager.add_send_queue(Message(MessageType.RETRIGGER))
+message = async_inbox.get(timeout=2)
+assert message.type is MessageType.RETRIGGER
+print('async received:', message)
+
+# asyncio 端 -> 執行緒端，大量圖像
+payloads = [os.urandom(size) for size in (0, 10, 100_000, 3_000_000) * 10]
+for i, payload in enumerate(payloads):
+    async_manager.add_send_queue(
+        Message(MessageType.SHOT_IMAGE, {'camera_id': 'test', 'frame': i}, payload)
+    )
+
+for i, payload in enumerate(payloads):
+    parms, received = thread_inbox.get(timeout=10).unpack()
+    assert parms['frame'] == i and bytes(received) == payload
+print('burst ok:', len(payloads))
+
+codec_versions = [node._codec_version for node in async_manager.get_all()]
+assert codec_versions == [Message.CODEC_VERSION]
+print('codec version ok:', codec_versions)
+
+# 執行緒端斷線，asyncio 端不用輪詢就會移除連線
+thread_manager.stop()
+deadline = time.perf_counter() + 2
+while async_manager.get_count() != 0:
+    assert time.perf_counter() < deadline, 'disconnect not detected'
+    time.sleep(0.01)
+print('disconnect detected')
+
+async_manager.stop()
+loop_thread.join(2)
+assert not loop_thread.is_alive()
+print('loop stopped')
@@ -0,0 +1,29 @@
+"""錄製報告測試
+
+執行方式 (PYTHONPATH 需包含 src 與 src/capture):
+    python test_record_report.py
+
+"""
+
+import os
+
+os.environ.setdefault('4DREC_TYPE', 'SLAVE')
+
+from slave.camera.shot import make_record_report
+
+
+# 沒有寫入任何影格，例如一開始就停止或全部捨棄
+report = make_record_report(((), ()), 0)
+assert report == {'missing_frames': [], 'frame_range': None, 'size': 0}
+print('empty ok:', report)
+
+# 主檔與溢出檔案都沒有影格，但有檔頭大小
+report = make_record_report(([], []), 128)
+assert report['frame_range'] is None and report['size'] == 128
+print('empty with header ok:', report)
+
+# 一般情況，遺失的影格以區段表示
+report = make_record_report(([0, 1, 2, 5, 6], [9]), 1000)
+assert report['frame_range'] == (0, 9)
+assert report['missing_frames'] == [(3, 4), (7, 8)]
+print('frames ok:', report)